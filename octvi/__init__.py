@@ -36,19 +36,25 @@ logging.basicConfig(level=os.environ.get("LOGLEVEL","INFO"))
 log = logging.getLogger(__name__)
 
 
-import octvi.exceptions, octvi.array, octvi.extract, octvi.url
+import octvi.exceptions, octvi.array, octvi.cache, octvi.extract, octvi.indices, octvi.qa, octvi.url
 from octvi.url import supported_products
 from octvi.array import supported_indices
 from octvi.config import configFile
-import configparser, gdal, shutil, subprocess
+import configparser, gdal, itertools, threading, time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import closing
 from datetime import datetime, timedelta
+from functools import partial
 from urllib.request import HTTPError
 
 
 __all__ = [
 			'exceptions',
 			'array',
+			'cache',
 			'extract',
+			'indices',
+			'qa',
 			'url'
 			]
 
@@ -72,12 +78,49 @@ try:
 except:
 	log.warning("No app key found in config file; downloading will be unavailable. Run `octviconfig` from the command line.\nInformation on app keys can be found at https://ladsweb.modaps.eosdis.nasa.gov/tools-and-services/data-download-scripts/#appkeys")
 
+## optional limits on requests and bandwidth, set next to app_key, e.g.
+# [NASA]
+# max_requests_per_second = 10
+# max_bytes_per_second = 50000000
+if config.has_section('NASA'):
+	try:
+		maxRequests = config['NASA'].get('max_requests_per_second')
+		maxBytes = config['NASA'].get('max_bytes_per_second')
+		octvi.url.rate_limiter.configure(float(maxRequests) if maxRequests else None,float(maxBytes) if maxBytes else None)
+	except ValueError:
+		log.warning("Could not parse rate limits from the [NASA] section of the config file.")
+
+## optional granule and listing caches, e.g.
+# [CACHE]
+# directory = /data/octvi_cache
+# max_bytes = 53687091200
+# listing_directory = /data/octvi_listings
+# day_directory = /data/octvi_days
+# day_max_bytes = 21474836480
+if config.has_section('CACHE'):
+	try:
+		if 'directory' in config['CACHE']:
+			octvi.cache.enable(config['CACHE']['directory'],int(config['CACHE'].get('max_bytes',50*1024**3)))
+		if 'listing_directory' in config['CACHE']:
+			octvi.cache.persistListings(config['CACHE']['listing_directory'])
+		if 'day_directory' in config['CACHE']:
+			octvi.cache.enableDayStore(config['CACHE']['day_directory'],int(config['CACHE'].get('day_max_bytes',20*1024**3)))
+	except (ValueError, OSError):
+		log.warning("Could not set up caching from the [CACHE] section of the config file.")
+
 def mosaic(in_files:list,out_path:str,compression="DEFLATE") -> str:
 	"""
 	This function takes a list of input raster files, and uses
 	a gdal VRT to create a mosaic of all the inputs. This mosaic
 	is then saved to the output location specified by out_path,
-	as a single raster file.
+	as a single tiled, compressed raster file with overviews.
+
+	The VRT is held in memory, and the output is written by
+	octvi.array.saveMosaic(), in process.
+
+	globalVi() no longer uses this function; it writes each tile
+	straight into its mosaic with octvi.array.MosaicWriter. It is
+	kept as a thin wrapper for scripts that mosaic their own files.
 
 	Note that global 250/500-m scale mosaics are large files, and
 	a single image may be more than 2 GB in size. Make sure that
@@ -96,68 +139,128 @@ def mosaic(in_files:list,out_path:str,compression="DEFLATE") -> str:
 		The full path to a mosaic raster file to be created
 	"""
 
-	## define intermediate raster name
-	ext = os.path.splitext(out_path)[1]
-	intermediate_path = out_path.replace(ext,".vrt")
-	interim_path = out_path.replace(ext,f".TEMP{ext}")
-
-	## build the vrt command line call
-	# subsetting to dimensions of mhumber's MOD13Q1 files
-	north= 8895604.157#9962342# 9972315.0495 * 0.999
-	west= -20015109.354#-22735470# -22758229.000 * 0.999
-	south = -6671703.118#-9143189# -9152341.5816 * 0.999
-	east= 20015109.354#20958445# 20979424.893 * 0.999
-	command = ["gdalbuildvrt","-te",str(west),str(south),str(east),str(north),'-q',intermediate_path] # gdal script and output file
-	#command = ["gdalbuildvrt",intermediate_path] # gdal script and output file
-	command += in_files # append the list of input files
-
-
-	## build the vrt
-	subprocess.call(command)
-
-	## save vrt to output file location, clipped to sinusoidal bounds
-	subprocess.call(["gdal_translate","-co", "TILED=YES",'-co',"COPY_SRC_OVERVIEWS=YES",'-co', f"COMPRESS={compression}",'-q', intermediate_path,out_path])
-
-	## remove intermediate file
-	os.remove(intermediate_path)
-	try: # try removing vrt.ovr
-		os.remove(intermediate_path+".ovr")
-	except: # if it doesn't exist, oh well
-		pass
-
-	# copy to interim path
-	with open(out_path,'rb') as rf:
-		with open(interim_path,'wb') as wf:
-			shutil.copyfileobj(rf,wf)
-
-	# delete nodata from file
-	ds = gdal.Open(interim_path,1)
-	for i in range(ds.RasterCount):
-		ds.GetRasterBand(i + 1).DeleteNoDataValue()
-	ds = None
-
-	## add overviews to file
-	subprocess.call(["gdaladdo",interim_path, "2", "4", "8", "16", "32", "64", "128", "256", "512", "1024"])
-
-	# put nodata back on file
-	ds =  gdal.Open(interim_path,1)
-	for i in range(ds.RasterCount):
-		ds.GetRasterBand(i + 1).SetNoDataValue(-3000)
-	ds = None
-
-	# copy back to out_path
-	subprocess.call(["gdal_translate","-co", "TILED=YES",'-co',"COPY_SRC_OVERVIEWS=YES",'-co', f"COMPRESS={compression}",'-q', interim_path,out_path])
-
-	# delete interim_path
-	os.remove(interim_path)
+	## build the vrt, clipped to sinusoidal bounds
+	vrt = gdal.BuildVRT("",in_files,outputBounds=octvi.array.MOSAIC_BOUNDS)
+
+	## save vrt to output file location, with overviews
+	octvi.array.saveMosaic(vrt,out_path,compression)
+	vrt = None
 
 	return out_path
 
 
-def modCmgVi(date,out_path:str,overwrite=False,vi="NDVI",snow_mask=True) -> str:
+WGS84_WKT = 'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,AUTHORITY["EPSG","7030"]],AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4326"]]'
+
+def _pullCmg(product,date,working_directory) -> str:
+	"""Downloads one daily CMG file, falling back from LADS to LP"""
+	try:
+		url, tileName, fileSize = octvi.url.getUrls(product,date)[0]
+		return octvi.url.pull(url,working_directory,file_size=fileSize)
+	except octvi.exceptions.UnavailableError:
+		log.error("HTTPError from LADS DAAC; retrying from LP DAAC")
+		url, tileName, fileSize = octvi.url.getUrls(product,date,lads_or_lp="LP")[0]
+		return octvi.url.pull(url,working_directory,file_size=fileSize)
+
+
+def _cmgDates(date:str,days:int) -> list:
+	"""Returns the {days} datetime objects beginning on date"""
+	dates = [datetime.strptime(date,"%Y-%m-%d")]
+	while len(dates) < days:
+		dates.append(dates[-1] + timedelta(days=1))
+	return dates
+
+
+def _cmgComposite(product,dates:list,out_path,vi,snow_mask,jobs=1,store=None):
 	"""
-	This function produces an 8-day composite VI image
-	at cmg scale (MOD09CMG), beginning on the provided date
+	Composites the daily CMG files of {product} for {dates}
+	(datetime objects, in order) into a VI raster at out_path.
+	If vi is a list, out_path is the list of output paths, one
+	per index, and each day is downloaded and read only once for
+	all of them; the list of paths is then returned.
+
+	With jobs <= 1, each day is folded into the composite as
+	it is read. A day found in store (by default the enabled
+	octvi.cache.day_store, if any) is taken from there without
+	downloading it; any other day is downloaded, added to the
+	store, and deleted. With more jobs, all days are downloaded
+	first, and then composited in row stripes in parallel; the
+	day store cannot be used that way, since it keeps whole days
+	rather than stripes, so this raises UnsupportedError if a
+	store is in use.
+	"""
+	if store is None:
+		store = octvi.cache.day_store
+	if (jobs > 1) and (store is not None):
+		raise octvi.exceptions.UnsupportedError("Parallel CMG compositing (jobs > 1) cannot read from or add to the day store; use jobs=1 to composite with the day store")
+	vis = [vi] if isinstance(vi,str) else list(vi)
+	out_paths = [out_path] if isinstance(out_path,str) else list(out_path)
+	working_directory = os.path.dirname(out_paths[0])
+
+	## fold each day into the composites
+	log.info(f"Reading daily {', '.join(vis)} arrays")
+	# the selection key depends on each index's nodata, so every
+	# index keeps its own compositor
+	compositors = [octvi.extract.CmgCompositor(index,product,snow_mask) for index in vis]
+	georeference = None
+	files = []
+	try:
+		for dobj in dates:
+			d = dobj.strftime("%Y-%m-%d")
+			log.debug(d)
+			if jobs > 1:
+				files.append(_pullCmg(product,d,working_directory))
+				continue
+			stored = {index:(store.get(product,d,index) if store is not None else None) for index in vis}
+			missing = [index for index in vis if stored[index] is None]
+			if missing:
+				files.append(_pullCmg(product,d,working_directory))
+				with octvi.extract.openGranule(files[-1]) as granule:
+					dayArrays = octvi.extract.cmgDayArrays(granule,missing,product)
+					dayGeoreference = granule.georeference()
+				for index, arrays in zip(missing,dayArrays):
+					stored[index] = (arrays,dayGeoreference)
+					if store is not None:
+						store.put(product,d,index,*stored[index])
+				os.remove(files.pop())
+			for index, compositor in zip(vis,compositors):
+				compositor.addDayArrays(*stored[index][0])
+			# the first day georeferences the output
+			if georeference is None:
+				georeference = stored[vis[0]][1]
+
+		for index, compositor, path in zip(vis,compositors,out_paths):
+			## create ideal ndvi array
+			if jobs <= 1:
+				ndviArray = compositor.finalize()
+			else:
+				log.info(f"Creating {index} composite")
+				ndviArray = octvi.extract.cmgCompositeStripes(files,index,product,snow_mask,jobs)
+				georeference = files[0]
+
+			## write to disk
+			octvi.array.toRaster(ndviArray,path,georeference)
+
+			## project to WGS84
+			ds = gdal.Open(path,1)
+			if ds:
+				res = ds.SetProjection(WGS84_WKT)
+				if res != 0:
+					logging.error("--projection failed: {}".format(str(res)))
+				ds = None
+			else:
+				logging.error("--could not open with GDAL")
+	finally:
+		## delete downloaded files
+		for f in files:
+			os.remove(f)
+	return out_path
+
+
+def modCmgVi(date,out_path:str,overwrite=False,vi="NDVI",snow_mask=True,days=8,jobs=1) -> str:
+	"""
+	This function produces a composite VI image at cmg
+	scale (MOD09CMG), of {days} days beginning on the
+	provided date (by default 8)
 
 	***
 
@@ -172,9 +275,22 @@ def modCmgVi(date,out_path:str,overwrite=False,vi="NDVI",snow_mask=True) -> str:
 		Default: False
 	vi:str
 		What Vegetation Index type should be calculated. Default
-		"NDVI", valid options ["NDVI","GCVI"]
+		"NDVI", valid options ["NDVI","GCVI","EVI","SAVI"], or
+		any other registered index (see octvi.indices.register())
+		using red, nir, green, or blue
 	snow_mask:bool
 		If True (default), masks out snow- and ice-flagged pixels.
+	days:int
+		Length of the compositing period. Each day is folded
+		into the composite as it is downloaded, so memory use
+		does not grow with the number of days. Days already in
+		the day store (see octvi.cache.enableDayStore()) are not
+		downloaded again. Default 8
+	jobs:int
+		Number of processes used for compositing. If more than 1,
+		all days are downloaded first, and then composited in row
+		stripes in parallel; this cannot be combined with the day
+		store. Default 1
 	"""
 
 	if vi not in supported_indices:
@@ -183,57 +299,19 @@ def modCmgVi(date,out_path:str,overwrite=False,vi="NDVI",snow_mask=True) -> str:
 	if os.path.exists(out_path) and overwrite == False:
 		raise FileExistsError(f"{out_path} already exists. To overwrite file, set 'overwrite=True'.")
 
-	working_directory = os.path.dirname(out_path)
-
 	log.info("Fetching dates")
-	## build list of eight days in compositing period
+	## build list of days in compositing period
 	# each date is a datetime object
-	dates = [datetime.strptime(date,"%Y-%m-%d")]
-	while len(dates) < 8:
-		dates.append(dates[-1] + timedelta(days=1))
+	dates = _cmgDates(date,days)
 
-	## download all hdfs and record their paths
-	log.info(f"Downloading daily {vi} files")
-	hdfs = []
-	try:
-		for dobj in dates:
-			d = dobj.strftime("%Y-%m-%d")
-			log.debug(d)
-			try:
-				url = octvi.url.getUrls("MOD09CMG",d)[0][0]
-				hdfs.append(octvi.url.pull(url,working_directory))
-			except octvi.exceptions.UnavailableError:
-				log.error("HTTPError from LADS DAAC; retrying from LP DAAC")
-				url = octvi.url.getUrls("MOD09CMG",d,lads_or_lp="LP")[0][0]
-				hdfs.append(octvi.url.pull(url,working_directory))
-
-		## create ideal ndvi array
-		log.info("Creating composite")
-		ndviArray = octvi.extract.cmgBestViPixels(hdfs,snow_mask=snow_mask)
-
-		## write to disk
-		octvi.array.toRaster(ndviArray,out_path,hdfs[0])
-
-		## project to WGS84
-		ds = gdal.Open(out_path,1)
-		if ds:
-			res = ds.SetProjection('GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,AUTHORITY["EPSG","7030"]],AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4326"]]')
-			if res != 0:
-				logging.error("--projection failed: {}".format(str(res)))
-			ds = None
-		else:
-			logging.error("--could not open with GDAL")
-	finally:
-		## delete hdfs
-		for hdf in hdfs:
-			os.remove(hdf)
-	return out_path
+	return _cmgComposite("MOD09CMG",dates,out_path,vi,snow_mask,jobs)
 
 
-def vnpCmgVi(date,out_path:str,overwrite=False,vi="NDVI",snow_mask=True) ->str:
+def vnpCmgVi(date,out_path:str,overwrite=False,vi="NDVI",snow_mask=True,days=8,jobs=1) ->str:
 	"""
-	This function produces an 8-day composite VI image
-	at cmg scale (VNP09CMG), beginning on the provided date
+	This function produces a composite VI image at cmg
+	scale (VNP09CMG), of {days} days beginning on the
+	provided date (by default 8)
 
 	***
 
@@ -248,9 +326,22 @@ def vnpCmgVi(date,out_path:str,overwrite=False,vi="NDVI",snow_mask=True) ->str:
 		Default: False
 	vi:str
 		What Vegetation Index type should be calculated. Default
-		"NDVI", valid options ["NDVI","GCVI"]
+		"NDVI", valid options ["NDVI","GCVI","EVI","SAVI"], or
+		any other registered index (see octvi.indices.register())
+		using red, nir, green, or blue
 	snow_mask:bool
 		If True (default), masks out snow- and ice-flagged pixels.
+	days:int
+		Length of the compositing period. Each day is folded
+		into the composite as it is downloaded, so memory use
+		does not grow with the number of days. Days already in
+		the day store (see octvi.cache.enableDayStore()) are not
+		downloaded again. Default 8
+	jobs:int
+		Number of processes used for compositing. If more than 1,
+		all days are downloaded first, and then composited in row
+		stripes in parallel; this cannot be combined with the day
+		store. Default 1
 	"""
 	if vi not in supported_indices:
 		raise octvi.exceptions.UnsupportedError(f"Vegetation index '{vi}' not recognized or not supported.")
@@ -258,59 +349,254 @@ def vnpCmgVi(date,out_path:str,overwrite=False,vi="NDVI",snow_mask=True) ->str:
 	if os.path.exists(out_path) and overwrite == False:
 		raise FileExistsError(f"{out_path} already exists. To overwrite file, set 'overwrite=True'.")
 
-	working_directory = os.path.dirname(out_path)
-
 	log.info("Fetching dates")
-	## build list of eight days in compositing period
+	## build list of days in compositing period
 	# each date is a datetime object
-	dates = [datetime.strptime(date,"%Y-%m-%d")]
-	while len(dates) < 8:
-		dates.append(dates[-1] + timedelta(days=1))
+	dates = _cmgDates(date,days)
+
+	return _cmgComposite("VNP09CMG",dates,out_path,vi,snow_mask,jobs)
+
+
+def rollingCmgVi(date,out_path:str,product="MOD09CMG",overwrite=False,vi="NDVI",snow_mask=True,days=8,store=None) -> str:
+	"""
+	This function produces a composite VI image at cmg
+	scale of the {days} days ending on the provided date
+	(by default 8), for daily-updated composites.
+
+	The per-day arrays of every date are kept in a day store
+	(see octvi.cache.DayStore), so when the window moves on by
+	a day, only the newest day is downloaded and read; the
+	rest are folded straight from the store. Days are therefore
+	composited one at a time, in a single process.
+
+	***
+
+	Parameters
+	----------
+	date:str
+		Last date of the compositing period, in format "%Y-%m-%d"
+	out_path:str
+		Full path to output file location on disk
+	product:str
+		"MOD09CMG" (default) or "VNP09CMG"
+	overwrite:bool
+		Whether to allow overwriting of existing file on disk.
+		Default: False
+	vi:str
+		What Vegetation Index type should be calculated. Default
+		"NDVI", valid options ["NDVI","GCVI","EVI","SAVI"], or
+		any other registered index (see octvi.indices.register())
+		using red, nir, green, or blue
+	snow_mask:bool
+		If True (default), masks out snow- and ice-flagged pixels.
+	days:int
+		Length of the compositing period. Default 8
+	store:octvi.cache.DayStore
+		Store of per-day arrays. Default is the store turned on
+		with octvi.cache.enableDayStore()
+	"""
+	if product not in ("MOD09CMG","VNP09CMG"):
+		raise octvi.exceptions.UnsupportedError(f"Product '{product}' is not a CMG-scale product.")
+
+	if vi not in supported_indices:
+		raise octvi.exceptions.UnsupportedError(f"Vegetation index '{vi}' not recognized or not supported.")
+
+	if os.path.exists(out_path) and overwrite == False:
+		raise FileExistsError(f"{out_path} already exists. To overwrite file, set 'overwrite=True'.")
+
+	if (store is None) and (octvi.cache.day_store is None):
+		log.warning("No day store is enabled; every day of the rolling composite will be downloaded. See octvi.cache.enableDayStore().")
+
+	## build list of days in compositing period, ending on date
+	lastDate = datetime.strptime(date,"%Y-%m-%d")
+	dates = [lastDate - timedelta(days=i) for i in range(days-1,-1,-1)]
+
+	return _cmgComposite(product,dates,out_path,vi,snow_mask,store=store)
+
+
+def _otherDaac(daac:str) -> str:
+	if daac=="LADS":
+		return "LP"
+	elif daac == "LP":
+		return "LADS"
+
+
+def _hedgedPull(product,date,tile,working_directory,daac,hedge) -> str:
+	"""
+	Downloads a single tile from {daac}, starting a second request
+	against the other DAAC if the first is judged slow by the
+	octvi.url.HedgePolicy {hedge}. The first transfer to finish is
+	kept and the other is cancelled. If one request fails outright,
+	the other DAAC is tried, as in _pullTile().
 
-	## download all hdf5s and record their paths
-	log.info(f"Downloading daily {vi} files")
-	h5s = []
+	Returns the path to the downloaded file.
+	"""
+	final = os.path.join(working_directory,octvi.url.fileName(tile[0]))
+	other = _otherDaac(daac)
+	received = {daac:0,other:0}
+	cancels = {daac:threading.Event(),other:threading.Event()}
+
+	def run(source,url,size):
+		# each source writes to its own file, so both can run at once
+		return octvi.url.pull(url,working_directory,
+			file_name_override=f"{os.path.basename(final)}.{source}",
+			file_size=size,
+			progress=lambda n: received.__setitem__(source,n),
+			cancel=cancels[source])
+
+	def discard(future):
+		# clean up after a request that finished after the race was decided
+		if (not future.cancelled()) and (future.exception() is None):
+			os.remove(future.result())
+
+	def startOther():
+		log.info(f"Hedging {tile[1]} against {other} DAAC")
+		url, tileName, tileSize = octvi.url.getUrls(product,date,tiles=tile[1],lads_or_lp=other)[0]
+		futures[executor.submit(run,other,url,tileSize)] = other
+
+	start = time.monotonic()
+	executor = ThreadPoolExecutor(max_workers=2)
+	futures = {executor.submit(run,daac,tile[0],tile[2]):daac}
+	hedged = False
 	try:
-		for dobj in dates:
-			d = dobj.strftime("%Y-%m-%d")
-			log.debug(d)
-			try:
-				url = octvi.url.getUrls("VNP09CMG",d)[0][0]
-				h5s.append(octvi.url.pull(url,working_directory))
-			except octvi.exceptions.UnavailableError:
-				log.error("HTTPError from LADS DAAC; retrying from LP DAAC")
-				url = octvi.url.getUrls("VNP09CMG",d,lads_or_lp="LP")[0][0]
-				h5s.append(octvi.url.pull(url,working_directory))
-
-		## create ideal ndvi array
-		log.info("Creating composite")
-		ndviArray = octvi.extract.cmgBestViPixels(h5s,product="VNP09CMG",snow_mask=snow_mask)
-		## write to disk
-		octvi.array.toRaster(ndviArray,out_path,h5s[0])
-
-		## project to WGS84
-		ds = gdal.Open(out_path,1)
-		if ds:
-			res = ds.SetProjection('GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,AUTHORITY["EPSG","7030"]],AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4326"]]')
-			if res != 0:
-				logging.error("--projection failed: {}".format(str(res)))
-			ds = None
-		else:
-			logging.error("--could not open with GDAL")
+		while futures:
+			done, not_done = wait(futures,timeout=hedge.interval,return_when=FIRST_COMPLETED)
+			for future in done:
+				source = futures.pop(future)
+				try:
+					path = future.result()
+				except octvi.exceptions.UnavailableError as e:
+					if futures: # the other request may still succeed
+						continue
+					if hedged:
+						raise
+					log.error(f"Unavailable from {source} DAAC; trying from {other} DAAC")
+					hedged = True
+					startOther()
+					continue
+				hedge.record(time.monotonic() - start)
+				os.replace(path,final)
+				return final
+			if (not hedged) and hedge.shouldHedge(time.monotonic() - start,received[daac]):
+				hedged = True
+				# a hedge that cannot be started must not fail the tile
+				try:
+					startOther()
+				except (octvi.exceptions.UnavailableError, IndexError) as e:
+					log.warning(f"Could not hedge {tile[1]} against {other} DAAC ({e}); waiting on {daac} DAAC")
 	finally:
-		## delete hdfs
-		for h5 in h5s:
-			os.remove(h5)
-	return out_path
+		for future, source in futures.items():
+			cancels[source].set()
+			future.add_done_callback(discard)
+		executor.shutdown(wait=False)
 
 
-def globalVi(product,date,out_path:str,overwrite=False,vi="NDVI",cmg_snow_mask=True,qa=False,daac="LADS") -> str:
+def _pullTile(product,date,tile,working_directory,daac="LADS",hedge=None) -> str:
+	"""
+	This function downloads a single tile, as listed by
+	octvi.url.getUrls(), to working_directory. If all attempts
+	against the requested DAAC fail, the tile is pulled from
+	the other DAAC instead.
+
+	Returns the path to the downloaded file.
+
+	...
+
+	Parameters
+	----------
+
+	product: str
+		Name of imagery product; e.g. "MOD09Q1"
+	date: str
+		Date in format "%Y-%m-%d"
+	tile: tuple
+		A (url,tileName,fileSize) tuple, as returned by octvi.url.getUrls()
+	working_directory: str
+		Directory where the downloaded file will be written
+	daac: str
+		DAAC to try first; one of "LADS" or "LP"
+	hedge: octvi.url.HedgePolicy (optional)
+		If set, slow transfers are raced against the other DAAC
+	"""
+	log.debug(tile[1])
+	if hedge is not None:
+		return _hedgedPull(product,date,tile,working_directory,daac,hedge)
+	url = tile[0]
+	try:
+		log.debug(f"Attempting to pull {url}")
+		hdf_file = octvi.url.pull(url,working_directory,file_size=tile[2])
+	except octvi.exceptions.UnavailableError:
+		new_daac = _otherDaac(daac)
+		log.error(f"Unavailable from {daac} DAAC; trying from {new_daac} DAAC")
+		url, tileName,tileSize = octvi.url.getUrls(product,date,tiles=tile[1],lads_or_lp=new_daac)[0]
+		hdf_file = octvi.url.pull(url,working_directory,file_size=tileSize)
+	return hdf_file
+
+
+def _iterPulls(tiles:list,fetch,jobs=1):
+	"""
+	Generator that applies fetch() to each item of tiles in
+	a pool of {jobs} worker threads, yielding (tile,path) pairs
+	in order of completion. At most {jobs} transfers are in
+	flight at once, so that downloads never run far ahead of
+	whatever the caller does with each file.
+
+	Exceptions raised by fetch() are re-raised in the caller.
+	Files pulled by transfers that were still running when
+	the generator was closed are deleted.
+	"""
+	jobs = max(1,int(jobs))
+	tileIter = iter(tiles)
+	pending = {}
+	with ThreadPoolExecutor(max_workers=jobs) as executor:
+		try:
+			for tile in itertools.islice(tileIter,jobs):
+				pending[executor.submit(fetch,tile)] = tile
+			while pending:
+				done, not_done = wait(pending,return_when=FIRST_COMPLETED)
+				for future in done:
+					tile = pending.pop(future)
+					# top up the pool before handing the file to the caller
+					for nextTile in itertools.islice(tileIter,1):
+						pending[executor.submit(fetch,nextTile)] = nextTile
+					yield tile, future.result()
+		finally:
+			for future in pending:
+				if future.cancel():
+					continue
+				try:
+					os.remove(future.result())
+				except Exception:
+					pass
+
+
+def _viPaths(out_path:str,vis:list) -> list:
+	"""
+	Returns the output path of each index in vis. Any "{vi}" in
+	out_path is replaced by the lower-case name of the index;
+	otherwise, if there are several indices, the name is added
+	before the extension.
+	"""
+	if "{vi}" in out_path:
+		return [out_path.replace("{vi}",vi.lower()) for vi in vis]
+	if len(vis) == 1:
+		return [out_path]
+	root, ext = os.path.splitext(out_path)
+	return [f"{root}.{vi.lower()}{ext}" for vi in vis]
+
+
+def globalVi(product,date,out_path:str,overwrite=False,vi="NDVI",cmg_snow_mask=True,qa=False,daac="LADS",jobs=1,hedge=False,block_bytes=None,cmg_days=8):
 	"""
 	This function takes the name of an imagery product, observation date,
 	and a vegetation index, and creates a global mosaic of the given
 	product's VI on that date.
 
-	Returns the path to the output file.
+	Several indices can be made at once by passing a list as vi. Each
+	tile is then downloaded, read, and masked once, and every index is
+	computed from the same bands, with one mosaic written per index.
+
+	Returns the path to the output file, or if vi is a list, the list
+	of output paths.
 
 	...
 
@@ -322,16 +608,42 @@ def globalVi(product,date,out_path:str,overwrite=False,vi="NDVI",cmg_snow_mask=T
 	date: str
 		Date in format "%Y-%m-%d"
 	out_path: str
-		Full path to location where output file will be saved; e.g. "C:/temp/output.tif"
+		Full path to location where output file will be saved; e.g. "C:/temp/output.tif".
+		For several indices, "{vi}" in out_path is replaced by the name of each
+		index (e.g. "C:/temp/{vi}.tif"); without it, the name is added before
+		the extension (e.g. "C:/temp/output.ndvi.tif")
 	overwrite: bool
 		Default False, whether to overwrite existing file at out_path
-	vi: str
-		Default "NDVI", valid ["NDVI", "GCVI", "NDWI"]
+	vi: str or list
+		Default "NDVI", valid ["NDVI", "GCVI", "NDWI", "EVI", "SAVI"], or
+		any other index registered with octvi.indices.register(); or a
+		list of these
 	cmg_snow_mask:bool
 		Implemented only for CMG-scale imagery. If set to True, masks out snow- and
 		ice-flagged pixels.
 	qa:bool
 		Whether to include a Quality Assurance layer as a second band
+	daac:str
+		Default "LADS", which DAAC to try first; one of ["LADS", "LP"]
+	jobs:int
+		Default 1, number of tiles to download concurrently. For
+		CMG-scale imagery, the number of processes used for
+		compositing instead; ignored if the day store is enabled
+		(see octvi.cache.enableDayStore()).
+	hedge:bool or octvi.url.HedgePolicy
+		Default False. If set, a tile transfer that is slow compared to
+		the others is duplicated against the other DAAC, and whichever
+		finishes first is kept. Pass a HedgePolicy to tune when this
+		happens. Ignored for CMG-scale imagery.
+	block_bytes:int
+		Default None. If set, each tile is processed in row stripes using
+		about this many bytes of memory, rather than all at once. Stripes
+		are whole blocks of the output mosaic, at least 240 rows, which
+		for a 4800-pixel tile is about 55 MB; smaller budgets are raised
+		to that. Ignored for CMG-scale imagery.
+	cmg_days:int
+		Default 8. Implemented only for CMG-scale imagery; the number of
+		daily files composited, starting on date.
 	"""
 
 	startTime = datetime.now()
@@ -339,17 +651,21 @@ def globalVi(product,date,out_path:str,overwrite=False,vi="NDVI",cmg_snow_mask=T
 	if product not in supported_products:
 		raise octvi.exceptions.UnsupportedError(f"Product '{product}' is not currently supported. See octvi.supported_products for list of supported products.")
 
-	if vi not in supported_indices:
-		raise octvi.exceptions.UnsupportedError(f"Vegetation index '{vi}' not recognized or not supported.")
+	vis = [vi] if isinstance(vi,str) else list(vi)
+	for index in vis:
+		if index not in supported_indices:
+			raise octvi.exceptions.UnsupportedError(f"Vegetation index '{index}' not recognized or not supported.")
 
-	if os.path.exists(out_path) and overwrite == False:
-		raise FileExistsError(f"{out_path} already exists. To overwrite file, set 'overwrite=True'.")
+	out_paths = _viPaths(out_path,vis)
+	for path in out_paths:
+		if os.path.exists(path) and overwrite == False:
+			raise FileExistsError(f"{path} already exists. To overwrite file, set 'overwrite=True'.")
 
 	qa_dataset = None
 	qa_path = None
 	if qa:
-		out_ext = os.path.splitext(out_path)[1]
-		qa_path = out_path.replace(out_ext,f".QA{out_ext}")
+		out_ext = os.path.splitext(out_paths[0])[1]
+		qa_path = out_paths[0].replace(out_ext,f".QA{out_ext}")
 		qa_dataset = QA_DICT[product]
 		if qa_dataset is None:
 			raise octvi.exceptions.UnsupportedError(f"No qa dataset recognized for product '{product}'.")
@@ -357,68 +673,57 @@ def globalVi(product,date,out_path:str,overwrite=False,vi="NDVI",cmg_snow_mask=T
 	working_directory = os.path.dirname(out_path)
 
 	if product[5:8] == "CMG":
-		if product[0] == "M":
-			modCmgVi(date,out_path,overwrite=overwrite,vi=vi,snow_mask=cmg_snow_mask)
-		elif product[0] == "V":
-			vnpCmgVi(date,out_path,overwrite=overwrite,vi=vi,snow_mask=cmg_snow_mask)
+		# all indices are composited together, from one download
+		# and one read of each day; the day store needs serial
+		# compositing
+		if octvi.cache.day_store is not None:
+			jobs = 1
+		_cmgComposite(product,_cmgDates(date,cmg_days),out_paths,vis,cmg_snow_mask,jobs)
 	else:
 		log.info("Fetching urls")
 		tiles = octvi.url.getUrls(product,date,lads_or_lp=daac)
-		log.info(f"Building {vi} tiles")
-		ndvi_files = []
-		qa_files = []
+		log.info(f"Building {', '.join(vis)} mosaics")
+		# each tile is written straight into its place in the global
+		# mosaics as soon as it is ready
+		writers = [octvi.array.MosaicWriter(path) for path in out_paths]
+		qa_writer = octvi.array.MosaicWriter(qa_path) if qa else None
+		if hedge is True:
+			hedge = octvi.url.HedgePolicy()
+		fetch = partial(_pullTile,product,date,working_directory=working_directory,daac=daac,hedge=hedge or None)
 		try:
-			for tile in tiles:
-				log.debug(tile[1])
-				tileSize = tile[2]
-				url = tile[0]
-				diskSize = 0
-				try:
-					for i in range(5):
-						if diskSize ==0:
-							log.debug(f"Attempting to pull {url}")
-							hdf_file = octvi.url.pull(url,working_directory,retries=8)
-							diskSize = os.path.getsize(hdf_file)
-					if diskSize==0: # all recourse on LADS has failed
-						raise octvi.exceptions.UnavailableError(f"File sizes do not match after 5 attempts to pull from {daac}")
-				except octvi.exceptions.UnavailableError:
-					if daac=="LADS":
-						new_daac="LP"
-					elif daac == "LP":
-						new_daac="LADS"
-					log.error(f"Unavailable from {daac} DAAC; trying from {new_daac} DAAC")
-					url, tileName,tileSize = octvi.url.getUrls(product,date,tiles=tile[1],lads_or_lp=new_daac)[0]
-					hdf_file = octvi.url.pull(url,working_directory)
-				ext = os.path.splitext(hdf_file)[1]
-				vi_functions = {
-					"NDVI":octvi.extract.ndviToRaster,
-					"GCVI":octvi.extract.gcviToRaster,
-					"NDWI":octvi.extract.ndwiToRaster
-				}
-				try:
-					ndvi_files.append(vi_functions[vi](hdf_file,hdf_file.replace(ext,f".{vi}.tif")))
-				except octvi.UnsupportedError:
-					raise octvi.exceptions.UnsupportedError(f"Vegetation index '{vi}' not supported for product '{product}'")
-				if qa:
-					octvi.extract.datasetToRaster(hdf_file,qa_dataset,hdf_file.replace(ext,".qa.tif"))
-					qa_files.append(hdf_file.replace(ext,".qa.tif"))
-				os.remove(hdf_file)
-			log.info("Creating VI mosaic")
-			mosaic(ndvi_files,out_path)
+			with closing(_iterPulls(tiles,fetch,jobs)) as pulls:
+				for tile, hdf_file in pulls:
+					try:
+						# every band needed for the VIs, their mask and the QA
+						# layer is read once, and shared by all of them
+						with octvi.extract.openGranule(hdf_file) as granule:
+							try:
+								if block_bytes is None:
+									granule.load(octvi.extract.readPlan(granule,vis,qa_dataset))
+								octvi.extract.visToMosaics(granule,vis,writers,block_bytes=block_bytes)
+							except octvi.exceptions.UnsupportedError:
+								raise octvi.exceptions.UnsupportedError(f"Vegetation index '{', '.join(vis)}' not supported for product '{product}'")
+							if qa:
+								octvi.extract.datasetToMosaic(granule,qa_dataset,qa_writer,block_bytes=block_bytes)
+					finally:
+						os.remove(hdf_file)
+			for index, writer in zip(vis,writers):
+				log.info(f"Adding overviews to {index} mosaic")
+				if writer.close() is None:
+					raise octvi.exceptions.UnavailableError(f"No {product} tiles on {date} fall inside the global mosaic")
 			if qa:
-				log.info("Creating Quality Assurance mosaic")
-				mosaic(qa_files,qa_path)
+				log.info("Adding overviews to Quality Assurance mosaic")
+				qa_writer.close()
 
-		## remove indiviual HDFs
+		## remove partly written mosaics
 		finally:
-			for f in ndvi_files:
-				os.remove(f)
-			for f in qa_files:
-				os.remove(f)
+			for writer in writers + [qa_writer]:
+				if writer is not None:
+					writer.abort()
 
 	endTime = datetime.now()
 	log.info(f"Done. Elapsed time {endTime-startTime}")
-	return out_path
+	return out_path if isinstance(vi,str) else out_paths
 
 
 def cmgNdvi(date,out_path:str,overwrite=False,snow_mask=False) -> str:
@@ -3,19 +3,27 @@ import logging, os
 logging.basicConfig(level=os.environ.get("LOGLEVEL","INFO"))
 log = logging.getLogger(__name__)
 
-import gdal, h5py, octvi.extract
+import gdal, h5py, octvi.exceptions, octvi.extract, octvi.indices, octvi.qa
 import numpy as np
 from gdalnumeric import *
 
-supported_indices = ["NDVI","GCVI","NDWI"]
+## every registered index; see octvi.indices.register()
+supported_indices = octvi.indices.supported_indices
 
-def calcNdvi(red_array,nir_array) -> "numpy array":
+## MODIS sinusoidal projection, for files that do not report their own
+SINUSOIDAL_WKT = 'PROJCS["unnamed",GEOGCS["Unknown datum based upon the custom spheroid",DATUM["Not specified (based on custom spheroid)",SPHEROID["Custom spheroid",6371007.181,0]],PRIMEM["Greenwich",0],UNIT["degree",0.0174532925199433]],PROJECTION["Sinusoidal"],PARAMETER["longitude_of_center",0],PARAMETER["false_easting",0],PARAMETER["false_northing",0],UNIT["Meter",1]]'
+
+def calcNdvi(red_array,nir_array,dtype=np.int16,out=None) -> "numpy array":
 	"""
 	A function to robustly build an NDVI array from two
 	arrays (red and NIR) of the same shape.
 
 	Resulting array is scaled by 10000, with values stored
-	as integers. Nodata value is -3000.
+	as integers. Nodata value is -3000, which is also given
+	to pixels where red + NIR is zero.
+
+	The index is evaluated in float32 chunks by its registered
+	expression; see octvi.indices.Expression.
 
 	...
 
@@ -26,28 +34,27 @@ def calcNdvi(red_array,nir_array) -> "numpy array":
 		Array of red reflectances
 	nir_array: numpy.array
 		Array of near-infrared reflectances
+	dtype: numpy dtype
+		Type of the returned array. Default int16
+	out: numpy.array (optional)
+		Preallocated array of the same shape to write the result
+		into, in which case its own dtype is used
 
 	"""
 
-	## perform NDVI generation
-	ndvi = np.divide((nir_array - red_array),(nir_array + red_array))
-
-	## rescale and replace infinities
-	ndvi = ndvi * 10000
-	ndvi[ndvi == np.inf] = -3000
-	ndvi[ndvi == -np.inf] = -3000
-	ndvi = ndvi.astype(int)
-
-	## return array
-	return ndvi
+	return octvi.indices.get("NDVI").evaluate({"red":red_array,"nir":nir_array},dtype,out)
 
-def calcGcvi(green_array,nir_array) -> "numpy array":
+def calcGcvi(green_array,nir_array,dtype=np.int16,out=None) -> "numpy array":
 	"""
 	A function to robustly build a GCVI array from two
 	arrays (green and NIR) of the same shape.
 
 	Resulting array is scaled by 10000, with values stored
-	as integers. Nodata value is -3000.
+	as integers. Nodata value is -3000, which is also given
+	to pixels where green is zero.
+
+	The index is evaluated in float32 chunks by its registered
+	expression; see octvi.indices.Expression.
 
 	...
 
@@ -58,28 +65,27 @@ def calcGcvi(green_array,nir_array) -> "numpy array":
 		Array of green reflectances
 	nir_array: numpy.array
 		Array of near-infrared reflectances
+	dtype: numpy dtype
+		Type of the returned array. Default int16
+	out: numpy.array (optional)
+		Preallocated array of the same shape to write the result
+		into, in which case its own dtype is used
 
 	"""
 
-	## perform NDVI generation
-	gcvi = np.divide(nir_array, green_array) - 1
-
-	## rescale and replace infinities
-	gcvi = gcvi * 10000
-	gcvi[gcvi == np.inf] = -3000
-	gcvi[gcvi == -np.inf] = -3000
-	gcvi = gcvi.astype(int)
-
-	## return array
-	return gcvi
+	return octvi.indices.get("GCVI").evaluate({"green":green_array,"nir":nir_array},dtype,out)
 
-def calcNdwi(nir_array, swir_array) -> "numpy array":
+def calcNdwi(nir_array, swir_array,dtype=np.int16,out=None) -> "numpy array":
 	"""
 	A function to robustly build an NDWI array from two
 	arrays (SWIR and NIR) of the same shape.
 
 	Resulting array is scaled by 10000, with values stored
-	as integers. Nodata value is -3000.
+	as integers. Nodata value is -3000, which is also given
+	to pixels where NIR + SWIR is zero.
+
+	The index is evaluated in float32 chunks by its registered
+	expression; see octvi.indices.Expression.
 
 	...
 
@@ -90,20 +96,15 @@ def calcNdwi(nir_array, swir_array) -> "numpy array":
 		Array of near-infrared reflectances
 	swir_array: numpy.array
 		Array of shortwave infrared reflectances
+	dtype: numpy dtype
+		Type of the returned array. Default int16
+	out: numpy.array (optional)
+		Preallocated array of the same shape to write the result
+		into, in which case its own dtype is used
 
 	"""
 
-	## perform NDVI generation
-	ndwi = np.divide((nir_array - swir_array),(nir_array + swir_array))
-
-	## rescale and replace infinities
-	ndwi = ndwi * 10000
-	ndwi[ndwi == np.inf] = -3000
-	ndwi[ndwi == -np.inf] = -3000
-	ndwi = ndwi.astype(int)
-
-	## return array
-	return ndwi
+	return octvi.indices.get("NDWI").evaluate({"nir":nir_array,"swir":swir_array},dtype,out)
 
 def mask(in_array, source_stack) -> "numpy array":
 	"""
@@ -124,229 +125,370 @@ def mask(in_array, source_stack) -> "numpy array":
 		The array to be cleaned. This must have the same dimensions
 		as source_stack, and preferably have been extracted from the
 		stack.
-	source_stack: str
+	source_stack: str or octvi.extract.Granule
 		Path to a hierarchical data file containing QA layers with
 		which to perform the masking. Currently valid formats include
 		MOD09Q1 hdf and VNP09H1 files.
 	"""
 
-	## get file extension and product suffix
-	ext = os.path.splitext(source_stack)[1]
-	suffix = os.path.basename(source_stack).split(".")[0][3:7]
+	source_stack = octvi.extract.openGranule(source_stack)
 
+	## clouds, cloud shadow, aerosol, snow/ice, and water; for CMG
+	## files, pixels ranked "7" or below; see octvi.qa for the rules
+	spec = octvi.qa.maskSpec(source_stack)
+	in_array[source_stack.decode(spec) <= spec.threshold] = -3000
 
-	## product-conditional behavior
+	## return output
+	return in_array
 
-	# MODIS pre-generated VI masking
-	if suffix == "13Q1" or suffix == "13Q4":
-		if suffix[-1] == "1":
-			pr_arr = octvi.extract.datasetToArray(source_stack, "250m 16 days pixel reliability")
-			qa_arr = octvi.extract.datasetToArray(source_stack, "250m 16 days VI Quality")
-		else:
-			pr_arr = octvi.extract.datasetToArray(source_stack, "250m 8 days pixel reliability")
-			qa_arr = octvi.extract.datasetToArray(source_stack, "250m 8 days VI Quality")
-
-
-		#in_array[(pr_arr != 0) & (pr_arr != 1)] = -3000
-
-		# mask clouds
-		in_array[(qa_arr & 0b11) > 1] = -3000 # bits 0-1 > 01 = Cloudy
-
-		# mask Aerosol
-		in_array[(qa_arr & 0b11000000) == 0] = -3000 # climatology
-		in_array[(qa_arr & 0b11000000) == 192] = -3000 # high
-
-		# mask water
-		in_array[((qa_arr & 0b11100000000000) != 2048) & ((qa_arr & 0b11100000000000) != 4096) & ((qa_arr & 0b11100000000000) != 8192)] = -3000
-		# 001 = land, 010 = coastline, 100 = ephemeral water
-
-		# mask snow/ice
-		in_array[(qa_arr & 0b100000000000000) != 0] = -3000 # bit 14
-
-		# mask cloud shadow
-		in_array[(qa_arr & 0b1000000000000000) != 0] = -3000 # bit 15
-
-		# mask cloud adjacent pixels
-		in_array[(qa_arr & 0b100000000) != 0] = -3000 # bit 8
-
-	# MODIS and VIIRS surface reflectance masking
-	# CMG
-	elif suffix == "09CM":
-		if ext == ".hdf": # MOD09CMG
-			qa_arr = octvi.extract.datasetToArray(source_stack,"Coarse Resolution QA")
-			state_arr = octvi.extract.datasetToArray(source_stack,"Coarse Resolution State QA")
-			vang_arr = octvi.extract.datasetToArray(source_stack,"Coarse Resolution View Zenith Angle")
-			vang_arr[vang_arr<=0]=9999
-			sang_arr = octvi.extract.datasetToArray(source_stack,"Coarse Resolution Solar Zenith Angle")
-			rank_arr = np.full(qa_arr.shape,10) # empty rank array
-
-			## perform the ranking!
-			logging.debug("--rank 9: SNOW")
-			SNOW = ((state_arr & 0b1000000000000) | (state_arr & 0b1000000000000000)) # state bit 12 OR 15
-			rank_arr[SNOW>0]=9 # snow
-			del SNOW
-			logging.debug("--rank 8: HIGHAEROSOL")
-			HIGHAEROSOL=(state_arr & 0b11000000) # state bits 6 AND 7
-			rank_arr[HIGHAEROSOL==192]=8
-			del HIGHAEROSOL
-			logging.debug("--rank 7: CLIMAEROSOL")
-			CLIMAEROSOL=(state_arr & 0b11000000) # state bits 6 & 7
-			#CLIMAEROSOL=(cloudMask & 0b100000000000000) # cloudMask bit 14
-			rank_arr[CLIMAEROSOL==0]=7 # default aerosol level
-			del CLIMAEROSOL
-			logging.debug("--rank 6: UNCORRECTED")
-			UNCORRECTED = (qa_arr & 0b11) # qa bits 0 AND 1
-			rank_arr[UNCORRECTED==3]=6 # flagged uncorrected
-			del UNCORRECTED
-			logging.debug("--rank 5: SHADOW")
-			SHADOW = (state_arr & 0b100) # state bit 2
-			rank_arr[SHADOW==4]=5 # cloud shadow
-			del SHADOW
-			logging.debug("--rank 4: CLOUDY")
-			# set adj to 11 and internal to 12 to verify in qa output
-			CLOUDY = ((state_arr & 0b11)) # state bit 0 OR bit 1 OR bit 10 OR bit 13
-			#rank_arr[CLOUDY!=0]=4 # cloud pixel
-			del CLOUDY
-			CLOUDADJ = (state_arr & 0b10000000000000)
-			#rank_arr[CLOUDADJ>0]=4 # adjacent to cloud
-			del CLOUDADJ
-			CLOUDINT = (state_arr & 0b10000000000)
-			rank_arr[CLOUDINT>0]=4
-			del CLOUDINT
-			logging.debug("--rank 3: HIGHVIEW")
-			rank_arr[sang_arr>(85/0.01)]=3 # HIGHVIEW
-			logging.debug("--rank 2: LOWSUN")
-			rank_arr[vang_arr>(60/0.01)]=2 # LOWSUN
-			# BAD pixels
-			logging.debug("--rank 1: BAD pixels") # qa bits (2-5 OR 6-9 == 1110)
-			BAD = ((qa_arr & 0b111100) | (qa_arr & 0b1110000000))
-			rank_arr[BAD==112]=1
-			rank_arr[BAD==896]=1
-			rank_arr[BAD==952]=1
-			del BAD
-
-			logging.debug("-building water mask")
-			water = ((state_arr & 0b111000)) # check bits
-			water[water==56]=1 # deep ocean
-			water[water==48]=1 # continental/moderate ocean
-			water[water==24]=1 # shallow inland water
-			water[water==40]=1 # deep inland water
-			water[water==0]=1 # shallow ocean
-			rank_arr[water==1]=0
-			vang_arr[water==32]=9999 # ephemeral water???
-			water[state_arr==0]=0
-			water[water!=1]=0 # set non-water to zero
-			in_array[rank_arr <= 7] = -3000
-		elif ext == ".h5": # VNP09CMG
-			qf2 = octvi.extract.datasetToArray(source_stack,"SurfReflect_QF2")
-			qf4 = octvi.extract.datasetToArray(source_stack,"SurfReflect_QF4")
-			state_arr = octvi.extract.datasetToArray(source_stack,"State_QA")
-			vang_arr = octvi.extract.datasetToArray(source_stack,"SensorZenith")
-			vang_arr[vang_arr<=0]=9999
-			sang_arr = octvi.extract.datasetToArray(source_stack,"SolarZenith")
-			rank_arr = np.full(state_arr.shape,10) # empty rank array
-
-			## perform the ranking!
-			logging.debug("--rank 9: SNOW")
-			SNOW = (state_arr & 0b1000000000000000) # state bit 15
-			rank_arr[SNOW>0]=9 # snow
-			del SNOW
-			logging.debug("--rank 8: HIGHAEROSOL")
-			HIGHAEROSOL=(qf2 & 0b10000) # qf2 bit 4
-			rank_arr[HIGHAEROSOL!=0]=8
-			del HIGHAEROSOL
-			logging.debug("--rank 7: AEROSOL")
-			CLIMAEROSOL=(state_arr & 0b1000000) # state bit 6
-			#CLIMAEROSOL=(cloudMask & 0b100000000000000) # cloudMask bit 14
-			#rank_arr[CLIMAEROSOL==0]=7 # "No"
-			del CLIMAEROSOL
-			# logging.debug("--rank 6: UNCORRECTED")
-			# UNCORRECTED = (qa_arr & 0b11) # qa bits 0 AND 1
-			# rank_arr[UNCORRECTED==3]=6 # flagged uncorrected
-			# del UNCORRECTED
-			logging.debug("--rank 5: SHADOW")
-			SHADOW = (state_arr & 0b100) # state bit 2
-			rank_arr[SHADOW!=0]=5 # cloud shadow
-			del SHADOW
-			logging.debug("--rank 4: CLOUDY")
-			# set adj to 11 and internal to 12 to verify in qa output
-			# CLOUDY = ((state_arr & 0b11)) # state bit 0 OR bit 1 OR bit 10 OR bit 13
-			# rank_arr[CLOUDY!=0]=4 # cloud pixel
-			# del CLOUDY
-			# CLOUDADJ = (state_arr & 0b10000000000) # nonexistent for viirs
-			# #rank_arr[CLOUDADJ>0]=4 # adjacent to cloud
-			# del CLOUDADJ
-			CLOUDINT = (state_arr & 0b10000000000) # state bit 10
-			rank_arr[CLOUDINT>0]=4
-			del CLOUDINT
-			logging.debug("--rank 3: HIGHVIEW")
-			rank_arr[sang_arr>(85/0.01)]=3 # HIGHVIEW
-			logging.debug("--rank 2: LOWSUN")
-			rank_arr[vang_arr>(60/0.01)]=2 # LOWSUN
-			# BAD pixels
-			logging.debug("--rank 1: BAD pixels") # qa bits (2-5 OR 6-9 == 1110)
-			BAD = (qf4 & 0b110)
-			rank_arr[BAD!= 0]=1
-			del BAD
-
-			logging.debug("-building water mask")
-			water = ((state_arr & 0b111000)) # check bits 3-5
-			water[water == 40] = 0 # "coastal" = 101
-			water[water>8]=1 # sea water = 011; inland water = 010
-			# water[water==16]=1 # inland water = 010
-			# water[state_arr==0]=0
-			water[water!=1]=0 # set non-water to zero
-			water[water!=0]=1
-			rank_arr[water==1]=0
-			in_array[rank_arr <= 7] = -3000
-		else:
-			raise octvi.exceptions.FileTypeError("File must be of format .hdf or .h5")
-	# standard
+def h5GeoTransform(h5_file,file_name:str) -> tuple:
+	"""
+	Returns the geoTransform of a VIIRS HDF5 file, parsed from its
+	StructMetadata.0 grid metadata.
+
+	...
+
+	Parameters
+	----------
+
+	h5_file: h5py.File
+		The open file
+	file_name: str
+		Path or name of the file; used to recognize CMG-scale products
+	"""
+	pixelSize = 463.3127165
+	fileMetadata = h5_file['HDFEOS INFORMATION']['StructMetadata.0'][()].split() # grab metadata
+	fileMetadata = [m.decode('utf-8') for m in fileMetadata] # decode UTF
+	ulc = [i for i in fileMetadata if 'UpperLeftPointMtrs' in i][0]    # Search file metadata for the upper left corner of the file
+	ulcLon = float(ulc.split('=(')[-1].replace(')', '').split(',')[0]) # Parse metadata string for upper left corner lon value
+	ulcLat = float(ulc.split('=(')[-1].replace(')', '').split(',')[1]) # Parse metadata string for upper left corner lat value
+	# special behavior for VNP09CMG
+	if os.path.basename(file_name).split(".")[0][-3:] == "CMG":
+		ulcLon = ulcLon / 1000000
+		ulcLat = ulcLat / 1000000
+		pixelSize = 0.05
+	return (ulcLon, pixelSize, 0.0, ulcLat, 0.0, -pixelSize)
+
+def getGeoreference(model_file) -> tuple:
+	"""
+	Returns the (geoTransform, projection) of a MODIS or VIIRS
+	file, reading the VIIRS grid metadata where GDAL does not
+	report it. The projection is returned as WKT.
+
+	...
+
+	Parameters
+	----------
+
+	model_file: str or octvi.extract.Granule
+		Hierarchical file, or subdataset path, to be georeferenced
+	"""
+
+	granule = None
+	if isinstance(model_file,octvi.extract.Granule):
+		granule = model_file
+		refDs = granule.container
+		model_file = granule.path
 	else:
-		# modis
-		## MOD09A1
-		if suffix == "09A1":
-			qa_arr = octvi.extract.datasetToArray(source_stack, "sur_refl_qc_500m")
-			state_arr = octvi.extract.datasetToArray(source_stack,"sur_refl_state_500m")
-		## all other MODIS products
-		elif ext == ".hdf":
-			qa_arr = octvi.extract.datasetToArray(source_stack, "sur_refl_qc_250m")
-			state_arr = octvi.extract.datasetToArray(source_stack,"sur_refl_state_250m")
-
-		# viirs
-		elif ext == ".h5":
-			qa_arr = octvi.extract.datasetToArray(source_stack, "SurfReflect_QC_500m")
-			state_arr = octvi.extract.datasetToArray(source_stack,"SurfReflect_State_500m")
+		refDs = gdal.Open(model_file,0)
+	sr = refDs.GetProjection() # as WKT
+	# viirs won't tell you its projection
+	if sr == '':
+		sr = SINUSOIDAL_WKT
+	geoTransform = refDs.GetGeoTransform()
+	# viirs won't tell you its geotransform
+	if geoTransform[1] == 1.0:
+		if os.path.splitext(model_file)[1] == ".h5":
+			# use h5py
+			try:
+				refDs = h5py.File(model_file.split("\"")[1],mode='r') # open file in read-only mode
+			except IndexError:
+				refDs = h5py.File(model_file,mode='r') # open file in read-only mode
+			geoTransform = h5GeoTransform(refDs,model_file)
+		elif os.path.splitext(model_file)[1] == ".hdf":
+			if granule is not None:
+				ds_sub = granule.dataset(granule.datasetNames()[0])
+			else:
+				ds_sub = gdal.Open(refDs.GetSubDatasets()[0][0])
+			geoTransform = ds_sub.GetGeoTransform()
+			sr = ds_sub.GetProjection()
+	return geoTransform, sr
 
-		else:
-			raise octvi.exceptions.FileTypeError("File must be of format .hdf or .h5")
+## global extent of mosaics in the sinusoidal grid, as (west, south,
+## east, north); subset to the dimensions of mhumber's MOD13Q1 files
+MOSAIC_BOUNDS = (-20015109.354,-6671703.118,20015109.354,8895604.157)
 
-		## mask clouds
-		in_array[(state_arr & 0b11) != 0 ] = -3000
-		in_array[(state_arr & 0b10000000000) != 0] = -3000 # internal cloud mask
+## overview levels of all mosaics; the COG driver only makes powers of 2
+OVERVIEW_LEVELS = [2,4,8,16,32,64,128,256,512,1024]
 
-		## mask cloud shadow
-		in_array[(state_arr & 0b100) != 0] = -3000
+def saveMosaic(source,out_path:str,compression="DEFLATE") -> str:
+	"""
+	This function writes a gdal dataset (e.g. a VRT of tiles) to
+	out_path as a tiled, compressed GeoTIFF with internal
+	overviews, and every band's nodata value set to -3000.
 
-		## mask cloud adjacent pixels
-		in_array[(state_arr & 0b10000000000000) != 0] = -3000
+	With the COG driver of GDAL 3.6 and later, which can be told
+	how many overviews to make, they are built while the file is
+	written. Otherwise, they are added to the written file. Either
+	way, the overviews are nearest-neighbour, at OVERVIEW_LEVELS.
 
-		## mask aerosols
-		in_array[(state_arr & 0b11000000) == 0] = -3000 # climatology
-		in_array[(state_arr & 0b11000000) == 192] = -3000 # high; known to be an unreliable flag in MODIS collection 6
+	Returns out_path
 
-		## mask snow/ice
-		in_array[(state_arr & 0b1000000000000) != 0] = -3000
+	...
 
-		## mask water
-		in_array[((state_arr & 0b111000) != 8) & ((state_arr & 0b111000) != 16) & ((state_arr & 0b111000) !=32)] = -3000 # checks against three 'allowed' land/water classes and excludes pixels that don't match
+	Parameters
+	----------
 
-		## mask bad solar zenith
-		#in_array[(qa_arr & 0b11100000) != 0] = -3000
+	source: gdal dataset
+		The dataset to be written
+	out_path: str
+		Full path to the raster file to be created
+	compression: str
+		GeoTIFF compression method. Default "DEFLATE"
+	"""
+	creationOptions = [f"COMPRESS={compression}","BIGTIFF=IF_SAFER"]
+	if (gdal.GetDriverByName("COG") is not None) and (int(gdal.VersionInfo()) >= 3060000):
+		ds = gdal.Translate(out_path,source,format="COG",noData=-3000,creationOptions=creationOptions + ["BLOCKSIZE=256","RESAMPLING=NEAREST","OVERVIEW_RESAMPLING=NEAREST",f"OVERVIEW_COUNT={len(OVERVIEW_LEVELS)}"])
+	else:
+		ds = gdal.Translate(out_path,source,format="GTiff",noData=-3000,creationOptions=creationOptions + ["TILED=YES"])
+		if ds is not None:
+			addOverviews(ds,compression)
+	if ds is None:
+		log.error(f"--could not write {out_path}")
+	ds = None # flush to disk
+	return out_path
+
+def addOverviews(dataset,compression="DEFLATE") -> None:
+	"""
+	Builds nearest-neighbour internal overviews at OVERVIEW_LEVELS
+	on a GeoTIFF dataset open for writing, compressed with the
+	given method.
+	"""
+	previous = gdal.GetConfigOption("COMPRESS_OVERVIEW")
+	gdal.SetConfigOption("COMPRESS_OVERVIEW",compression)
+	try:
+		dataset.BuildOverviews("NEAREST",OVERVIEW_LEVELS)
+	finally:
+		gdal.SetConfigOption("COMPRESS_OVERVIEW",previous)
+
+def tileIndex(file_name:str) -> tuple:
+	"""
+	Returns the (horizontal, vertical) position of a MODIS/VIIRS
+	tile in the global sinusoidal grid, parsed from the "hXXvYY"
+	part of its file name; e.g. (8, 5) for
+	"MOD09Q1.A2019001.h08v05.006.2019010204213.hdf"
+	"""
+	for part in os.path.basename(file_name).split("."):
+		if (len(part) == 6) and (part[0] == "h") and (part[3] == "v") and part[1:3].isdigit() and part[4:].isdigit():
+			return int(part[1:3]), int(part[4:])
+	raise octvi.exceptions.UnsupportedError(f"No sinusoidal tile found in file name '{os.path.basename(file_name)}'")
 
+class MosaicWriter:
+	"""
+	A global mosaic in the sinusoidal grid, written one tile at a
+	time. The output file is created at MOSAIC_BOUNDS on the first
+	call to write(), with the pixel size and projection of
+	model_file, or else of that first tile; each tile's array is
+	then written directly to its place in the grid, as computed
+	from the "hXXvYY" in its file name.
+	Tiles, or parts of tiles, outside of MOSAIC_BOUNDS are dropped.
+
+	The output is a tiled, compressed GeoTIFF whose blocks evenly
+	divide a tile, so that each block is compressed and written
+	once, as long as a tile is written whole or in row stripes of
+	stripeRows(). Blocks that no tile covers are left out of the
+	file, and read as nodata (-3000). close() adds the internal
+	overviews.
 
-	## return output
-	return in_array
+	...
+
+	Parameters
+	----------
+
+	out_path: str
+		Full path to the mosaic raster file to be created
+	compression: str
+		GeoTIFF compression method. Default "DEFLATE"
+	dtype: str
+		One of "Byte", "Int16", "Int32", "Float32", "Float64". Default Int16.
+	model_file: str, octvi.extract.Granule, or tuple (optional)
+		Tile file with the pixel size and projection of the mosaic, or
+		its (geoTransform, projection) as returned by getGeoreference()
+	"""
+
+	def __init__(self,out_path:str,compression="DEFLATE",dtype=None,model_file=None):
+		self.out_path = out_path
+		self.compression = compression
+		self.dtype = dtype
+		self.model_file = model_file
+		self.dataset = None
+		self.tilePixels = None
+		self.blockSize = None
+		self._rowOffset = None
+		self._warned = False
+		self._written = False
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self,exc_type,exc_value,traceback):
+		if exc_type is None:
+			self.close()
+		else:
+			self.abort()
+
+	def _create(self,model_file) -> None:
+		if isinstance(model_file,octvi.extract.Granule):
+			geoTransform, sr = model_file.georeference()
+		elif isinstance(model_file,tuple):
+			geoTransform, sr = model_file
+		else:
+			geoTransform, sr = getGeoreference(model_file)
+		west, south, east, north = MOSAIC_BOUNDS
+		pixelSize = geoTransform[1]
+		tileSize = (east - west) / 36 # 36 tiles around the globe, 18 from pole to pole
+		self.tilePixels = int(round(tileSize / pixelSize))
+		self._rowOffset = int(round((9 * tileSize - north) / pixelSize)) # grid rows above the mosaic
+		xSize = int(round((east - west) / pixelSize))
+		ySize = int(round((north - south) / pixelSize))
+		# small blocks keep the floor on row stripes low; 240 for 4800-, 2400- and 1200-pixel tiles
+		blockSize = next((b for b in range(256,15,-16) if self.tilePixels % b == 0),256)
+		self.blockSize = blockSize
+		typeTable = {"Byte":gdal.GDT_Byte,"Int16":gdal.GDT_Int16,"Int32":gdal.GDT_Int32,"Float32":gdal.GDT_Float32,"Float64":gdal.GDT_Float64}
+		outType = typeTable.get(self.dtype,gdal.GDT_Int16)
+		driver = gdal.GetDriverByName('GTiff')
+		self.dataset = driver.Create(self.out_path,xSize,ySize,1,outType,["TILED=YES",f"BLOCKXSIZE={blockSize}",f"BLOCKYSIZE={blockSize}",f"COMPRESS={self.compression}","BIGTIFF=IF_SAFER","SPARSE_OK=TRUE"])
+		self.dataset.GetRasterBand(1).SetNoDataValue(-3000)
+		self.dataset.SetGeoTransform((west,pixelSize,0.0,north,0.0,geoTransform[5]))
+		self.dataset.SetProjection(sr)
+		log.debug(f"Created {xSize}x{ySize} mosaic {self.out_path} in blocks of {blockSize}")
+
+	def _open(self,tile) -> None:
+		if self.dataset is None:
+			self._create(tile if self.model_file is None else self.model_file)
+
+	def stripeRows(self,tile,rows:int) -> int:
+		"""
+		Returns rows rounded down to a whole number of the mosaic's
+		blocks, so that no two row stripes of a tile share a block.
+		Stripes are never less than one block (240 rows, for MODIS
+		and VIIRS tiles); a smaller request is raised to that, with
+		a warning. Creates the output file if this is the first tile.
+		"""
+		self._open(tile)
+		rows = int(rows)
+		if (rows < self.blockSize) and (not self._warned):
+			log.warning(f"Row stripes of {rows} rows are below the {self.blockSize}-row blocks of {os.path.basename(self.out_path)}; using {self.blockSize} rows, which needs more memory than requested")
+			self._warned = True
+		return max(self.blockSize,rows - rows % self.blockSize)
+
+	def write(self,tile,in_array,xoff=0,yoff=0) -> None:
+		"""
+		Writes in_array to the mosaic, at the (xoff, yoff) pixel
+		offset within the given tile; by default, at the tile's
+		upper left corner.
+
+		...
+
+		Parameters
+		----------
+
+		tile: str or octvi.extract.Granule
+			The tile file that in_array was read from
+		in_array: numpy.array
+			The array to be written
+		xoff: int
+			Column of the tile at which in_array starts
+		yoff: int
+			Row of the tile at which in_array starts
+		"""
+		tilePath = tile.path if isinstance(tile,octvi.extract.Granule) else tile
+		h, v = tileIndex(tilePath)
+		self._open(tile)
+		col = h * self.tilePixels + xoff
+		row = v * self.tilePixels - self._rowOffset + yoff
+		top = max(0,-row)
+		bottom = min(in_array.shape[0],self.dataset.RasterYSize - row)
+		if bottom <= top:
+			log.debug(f"{os.path.basename(tilePath)} is outside of the mosaic; skipping")
+			return None
+		self.dataset.GetRasterBand(1).WriteArray(in_array[top:bottom],col,row + top)
+		self._written = True
+		return None
+
+	def close(self) -> str:
+		"""
+		Adds internal overviews to the mosaic and flushes it to disk.
+		Returns the path to the output file, or None if no tile fell
+		inside the mosaic; in that case, no file is left behind.
+		"""
+		if not self._written:
+			log.warning(f"No tiles written to {self.out_path}")
+			self.abort()
+			return None
+		addOverviews(self.dataset,self.compression)
+		self.dataset = None # flush to disk
+		return self.out_path
+
+	def abort(self) -> None:
+		"""Discards the mosaic, removing any partly written file"""
+		if self.dataset is not None:
+			self.dataset = None
+			os.remove(self.out_path)
+		return None
+
+def iterWindows(x_size:int,y_size:int,rows:int):
+	"""
+	Generator yielding (xoff, yoff, xsize, ysize) windows of
+	{rows} full-width rows each, which together cover a raster
+	of x_size columns and y_size rows.
+	"""
+	rows = max(1,int(rows))
+	for yoff in range(0,y_size,rows):
+		yield (0,yoff,x_size,min(rows,y_size - yoff))
+
+def createRaster(out_path,model_file,x_size:int,y_size:int,nbands=1,dtype=None) -> "gdal dataset":
+	"""
+	This function creates an empty raster file with the same
+	projection and extents as the provided model file, and returns
+	it open for writing, so that it can be filled one window at a
+	time with WriteArray(). Setting the returned dataset to None
+	flushes it to disk.
+
+	...
+
+	Parameters
+	----------
+
+	out_path: str
+		Full path to raster file to be created
+	model_file: str, octvi.extract.Granule, or tuple
+		Existing raster file with matching spatial reference and geotransform,
+		or its (geoTransform, projection) as returned by getGeoreference()
+	x_size: int
+		Number of columns
+	y_size: int
+		Number of rows
+	nbands: int
+		Number of bands; band 1 is given a nodata value of -3000
+	dtype: str
+		One of "Byte", "Int16", "Int32", "Float32", "Float64". Default Int16.
+	"""
+	if isinstance(model_file,octvi.extract.Granule):
+		geoTransform, sr = model_file.georeference()
+	elif isinstance(model_file,tuple):
+		geoTransform, sr = model_file
+	else:
+		geoTransform, sr = getGeoreference(model_file)
+	typeTable = {"Byte":gdal.GDT_Byte,"Int16":gdal.GDT_Int16,"Int32":gdal.GDT_Int32,"Float32":gdal.GDT_Float32,"Float64":gdal.GDT_Float64}
+	outType = typeTable.get(dtype,gdal.GDT_Int16)
+
+	driver = gdal.GetDriverByName('GTiff')
+	dataset = driver.Create(out_path,x_size,y_size,nbands,outType,['COMPRESS=DEFLATE'])
+	dataset.GetRasterBand(1).SetNoDataValue(-3000)
+	dataset.SetGeoTransform(geoTransform)
+	dataset.SetProjection(sr)
+	return dataset
 
 def toRaster(in_array,out_path,model_file,dtype = None,*args,**kwargs) -> None:
 	"""
@@ -365,8 +507,9 @@ def toRaster(in_array,out_path,model_file,dtype = None,*args,**kwargs) -> None:
 		The array to be written to disk
 	out_path: str
 		Full path to raster file where the output will be written
-	model_file: str
-		Existing raster file with matching spatial reference and geotransform
+	model_file: str, octvi.extract.Granule, or tuple
+		Existing raster file with matching spatial reference and geotransform,
+		or its (geoTransform, projection) as returned by getGeoreference()
 	qa_array (optional): numpy.array
 		If this parameter is used, the output raster will have two bands. Band
 		1 stores in_array, band 2 stores qa_array
@@ -379,38 +522,13 @@ def toRaster(in_array,out_path,model_file,dtype = None,*args,**kwargs) -> None:
 		nbands = 1
 
 	## extract extent, geotransform, and projection
-	refDs = gdal.Open(model_file,0)
-	sr = refDs.GetProjection() # as WKT
-	# viirs won't tell you its projection
-	if sr == '':
-		sr = 'PROJCS["unnamed",GEOGCS["Unknown datum based upon the custom spheroid",DATUM["Not specified (based on custom spheroid)",SPHEROID["Custom spheroid",6371007.181,0]],PRIMEM["Greenwich",0],UNIT["degree",0.0174532925199433]],PROJECTION["Sinusoidal"],PARAMETER["longitude_of_center",0],PARAMETER["false_easting",0],PARAMETER["false_northing",0],UNIT["Meter",1]]'
-	geoTransform = refDs.GetGeoTransform()
-	# viirs won't tell you its geotransform
-	if geoTransform[1] == 1.0:
-		if os.path.splitext(model_file)[1] == ".h5":
-			pixelSize = 463.3127165
-			# use h5py
-			try:
-				refDs = h5py.File(model_file.split("\"")[1],mode='r') # open file in read-only mode
-			except IndexError:
-				refDs = h5py.File(model_file,mode='r') # open file in read-only mode
-			fileMetadata = refDs['HDFEOS INFORMATION']['StructMetadata.0'][()].split() # grab metadata
-			fileMetadata = [m.decode('utf-8') for m in fileMetadata] # decode UTF
-			ulc = [i for i in fileMetadata if 'UpperLeftPointMtrs' in i][0]    # Search file metadata for the upper left corner of the file
-			ulcLon = float(ulc.split('=(')[-1].replace(')', '').split(',')[0]) # Parse metadata string for upper left corner lon value
-			ulcLat = float(ulc.split('=(')[-1].replace(')', '').split(',')[1]) # Parse metadata string for upper left corner lat value
-			# special behavior for VNP09CMG
-			if os.path.basename(model_file).split(".")[0][-3:] == "CMG":
-				ulcLon = ulcLon / 1000000
-				ulcLat = ulcLat / 1000000
-				pixelSize = 0.05
-			geoTransform = (ulcLon, pixelSize, 0.0, ulcLat, 0.0, -pixelSize)
-		elif os.path.splitext(model_file)[1] == ".hdf":
-			ds_sub = gdal.Open(refDs.GetSubDatasets()[0][0])
-			geoTransform = ds_sub.GetGeoTransform()
-			sr = ds_sub.GetProjection()
+	if isinstance(model_file,octvi.extract.Granule):
+		geoTransform, sr = model_file.georeference()
+	elif isinstance(model_file,tuple):
+		geoTransform, sr = model_file
+	else:
+		geoTransform, sr = getGeoreference(model_file)
 	rasterYSize, rasterXSize = in_array.shape
-	refDs = None
 
 	## parse datatype
 	typeTable = {"Byte":gdal.GDT_Byte,"Int16":gdal.GDT_Int16,"Int32":gdal.GDT_Int32,"Float32":gdal.GDT_Float32,"Float64":gdal.GDT_Float64}
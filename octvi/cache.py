@@ -0,0 +1,387 @@
+## set up logging
+import logging, os
+logging.basicConfig(level=os.environ.get("LOGLEVEL","INFO"))
+log = logging.getLogger(__name__)
+
+## import modules
+import hashlib, json, shutil, threading, time, uuid
+import numpy as np
+from contextlib import contextmanager
+try:
+	import fcntl
+except ImportError: # windows
+	fcntl = None
+	import msvcrt
+
+granule_cache = None
+day_store = None
+
+
+@contextmanager
+def fileLock(lock_path:str):
+	"""
+	Context manager holding an exclusive, cross-process lock
+	on the file at lock_path for the duration of the block.
+	"""
+	with open(lock_path,'a+b') as fd:
+		if fcntl is not None:
+			fcntl.flock(fd.fileno(),fcntl.LOCK_EX)
+		else:
+			fd.seek(0)
+			msvcrt.locking(fd.fileno(),msvcrt.LK_LOCK,1)
+		try:
+			yield fd
+		finally:
+			if fcntl is not None:
+				fcntl.flock(fd.fileno(),fcntl.LOCK_UN)
+			else:
+				fd.seek(0)
+				msvcrt.locking(fd.fileno(),msvcrt.LK_UNLCK,1)
+
+
+def granuleKey(url:str):
+	"""
+	Returns a cache key of the form "{product}.{date}.{tile}.{collection}.{ext}"
+	for the granule at url, or None if the file name cannot be parsed.
+	CMG-scale granules, which have no tile, use "global" in its place.
+
+	...
+
+	Parameters
+	----------
+
+	url: str
+		Url or file name of a MODIS/VIIRS granule; e.g.
+		".../MOD09Q1.A2019001.h00v08.006.2019010204213.hdf"
+	"""
+	parts = url.split("/")[-1].split(".")
+	if len(parts) < 4:
+		return None
+	product, date = parts[0], parts[1]
+	if (parts[2][0] == "h") and ("v" in parts[2]):
+		tile, collection = parts[2], parts[3]
+	else:
+		tile, collection = "global", parts[2]
+	return ".".join([product,date,tile,collection,parts[-1]])
+
+
+class GranuleCache:
+	"""
+	An on-disk cache of downloaded granules, keyed by product, date,
+	tile, and collection, and bounded by a total size in bytes. When
+	the budget is exceeded, the least recently used granules are
+	evicted first.
+
+	All changes to the cache directory are made under a file lock, so
+	that several processes may safely share the same cache.
+
+	...
+
+	Parameters
+	----------
+
+	directory: str
+		Path to the cache directory; created if it does not exist
+	max_bytes: int
+		Maximum total size of cached granules
+	"""
+
+	def __init__(self,directory:str,max_bytes:int):
+		self.directory = directory
+		self.max_bytes = int(max_bytes)
+		self._lockPath = os.path.join(directory,".lock")
+		os.makedirs(directory,exist_ok=True)
+
+	def _path(self,key:str) -> str:
+		return os.path.join(self.directory,key.split(".")[0],key)
+
+	@staticmethod
+	def _place(src:str,dst:str) -> None:
+		"""
+		Copies src to dst. Granules are never hard-linked in or out
+		of the cache, so that a file opened for update after a pull
+		cannot change the cached copy.
+		"""
+		if os.path.exists(dst):
+			os.remove(dst)
+		shutil.copyfile(src,dst)
+
+	def get(self,url:str,out_path:str,file_size=None) -> bool:
+		"""
+		Places the cached copy of the granule at url at out_path and
+		returns True, or returns False if there is no usable cached
+		copy. If file_size is given, cached files of any other size
+		are ignored.
+		"""
+		key = granuleKey(url)
+		if key is None:
+			return False
+		path = self._path(key)
+		with fileLock(self._lockPath):
+			if not os.path.exists(path):
+				return False
+			if (file_size is not None) and (os.path.getsize(path) != file_size):
+				log.debug(f"Cached {key} does not match listed size; ignoring")
+				return False
+			self._place(path,out_path)
+			os.utime(path) # mark as recently used
+		log.debug(f"Cache hit for {key}")
+		return True
+
+	def put(self,url:str,in_path:str) -> None:
+		"""
+		Adds the downloaded granule at in_path to the cache, then
+		evicts least recently used granules until the cache fits
+		in max_bytes.
+		"""
+		key = granuleKey(url)
+		if key is None:
+			return None
+		path = self._path(key)
+		os.makedirs(os.path.dirname(path),exist_ok=True)
+		temp = f"{path}.{uuid.uuid4().hex}.tmp"
+		self._place(in_path,temp)
+		with fileLock(self._lockPath):
+			os.replace(temp,path)
+			self._evict()
+		return None
+
+	def _evict(self) -> None:
+		"""Removes least recently used granules; caller must hold the lock"""
+		_evictLeastRecent(self.directory,self.max_bytes)
+
+	def size(self) -> int:
+		"""Returns the total size in bytes of all cached granules"""
+		return _storedBytes(self.directory)
+
+
+def _storedFiles(directory:str) -> list:
+	"""Returns (mtime, size, path) of every stored file under directory"""
+	entries = []
+	for root, dirs, files in os.walk(directory):
+		for f in files:
+			if f.startswith(".") or f.endswith(".tmp"):
+				continue
+			stat = os.stat(os.path.join(root,f))
+			entries.append((stat.st_mtime,stat.st_size,os.path.join(root,f)))
+	return entries
+
+def _storedBytes(directory:str) -> int:
+	return sum(e[1] for e in _storedFiles(directory))
+
+def _evictLeastRecent(directory:str,max_bytes:int) -> None:
+	"""Removes the least recently used files under directory until they fit in max_bytes"""
+	entries = _storedFiles(directory)
+	total = sum(e[1] for e in entries)
+	for mtime, size, path in sorted(entries):
+		if total <= max_bytes:
+			break
+		log.debug(f"Evicting {os.path.basename(path)} from {directory}")
+		os.remove(path)
+		total -= size
+
+
+class ListingCache:
+	"""
+	A cache of parsed DAAC directory listings, keyed by listing url.
+	Entries are held in memory and, if a directory is given, also
+	written to disk so that they outlive the process. Whether an
+	entry is still fresh is decided at lookup time, by the time-to-
+	live the caller passes to get().
+
+	...
+
+	Parameters
+	----------
+
+	directory: str (optional)
+		Path to a directory in which to persist listings
+	"""
+
+	def __init__(self,directory=None):
+		self.directory = directory
+		self._memory = {}
+		self._lock = threading.Lock()
+		if directory is not None:
+			os.makedirs(directory,exist_ok=True)
+
+	def _path(self,url:str) -> str:
+		return os.path.join(self.directory,hashlib.sha1(url.encode('utf-8')).hexdigest() + ".json")
+
+	def get(self,url:str,ttl:float):
+		"""
+		Returns the cached rows for url if they are younger than
+		ttl seconds, or None otherwise.
+		"""
+		now = time.time()
+		with self._lock:
+			entry = self._memory.get(url)
+		if (entry is None) and (self.directory is not None):
+			try:
+				with open(self._path(url),'r') as rf:
+					stored = json.load(rf)
+				entry = (stored['time'],stored['rows'])
+				with self._lock:
+					self._memory[url] = entry
+			except (OSError, ValueError, KeyError):
+				entry = None
+		if (entry is None) or (now - entry[0] > ttl):
+			return None
+		return entry[1]
+
+	def put(self,url:str,rows:list) -> None:
+		"""Stores the parsed rows of the listing at url"""
+		entry = (time.time(),rows)
+		with self._lock:
+			self._memory[url] = entry
+		if self.directory is not None:
+			path = self._path(url)
+			temp = f"{path}.{uuid.uuid4().hex}.tmp"
+			with open(temp,'w') as wf:
+				json.dump({'url':url,'time':entry[0],'rows':rows},wf)
+			os.replace(temp,path)
+		return None
+
+	def clear(self) -> None:
+		"""Forgets all in-memory and on-disk listings"""
+		with self._lock:
+			self._memory = {}
+		if self.directory is not None:
+			for f in os.listdir(self.directory):
+				if f.endswith(".json"):
+					os.remove(os.path.join(self.directory,f))
+
+
+listing_cache = ListingCache()
+
+
+class DayStore:
+	"""
+	An on-disk store of the per-day arrays that go into a CMG
+	composite (rank, view angle, VI, and water; see
+	octvi.extract.cmgDayArrays()), together with the day's
+	georeference. Entries are keyed by product, date, and VI,
+	and bounded by a total size in bytes, evicting the least
+	recently used days first.
+
+	With a store, a rolling composite (see octvi.rollingCmgVi())
+	only downloads and reads the days it has not seen before.
+
+	...
+
+	Parameters
+	----------
+
+	directory: str
+		Path to the store directory; created if it does not exist
+	max_bytes: int
+		Maximum total size of stored days
+	"""
+
+	def __init__(self,directory:str,max_bytes:int):
+		self.directory = directory
+		self.max_bytes = int(max_bytes)
+		self._lockPath = os.path.join(directory,".lock")
+		os.makedirs(directory,exist_ok=True)
+
+	def _path(self,product:str,date:str,vi:str) -> str:
+		return os.path.join(self.directory,product,f"{product}.{date}.{vi}.npz")
+
+	def get(self,product:str,date:str,vi:str):
+		"""
+		Returns ((rank, vang, vi, water), (geoTransform, projection))
+		for the given day, or None if it is not stored.
+		"""
+		path = self._path(product,date,vi)
+		with fileLock(self._lockPath):
+			if not os.path.exists(path):
+				return None
+			os.utime(path) # mark as recently used
+			with np.load(path) as stored:
+				arrays = tuple(stored[name] for name in ("rank","vang","vi","water"))
+				georeference = (tuple(stored["geotransform"].tolist()),str(stored["projection"]))
+		log.debug(f"Day store hit for {product} {date} {vi}")
+		return arrays, georeference
+
+	def put(self,product:str,date:str,vi:str,arrays:tuple,georeference:tuple) -> None:
+		"""
+		Stores the (rank, vang, vi, water) arrays and (geoTransform,
+		projection) of the given day, then evicts least recently used
+		days until the store fits in max_bytes.
+		"""
+		path = self._path(product,date,vi)
+		os.makedirs(os.path.dirname(path),exist_ok=True)
+		temp = f"{path}.{uuid.uuid4().hex}.tmp"
+		rank, vang, viArray, water = arrays
+		with open(temp,'wb') as wf:
+			np.savez(wf,rank=rank,vang=vang,vi=viArray,water=water,geotransform=np.array(georeference[0],dtype=np.float64),projection=np.array(georeference[1]))
+		with fileLock(self._lockPath):
+			os.replace(temp,path)
+			_evictLeastRecent(self.directory,self.max_bytes)
+		return None
+
+	def size(self) -> int:
+		"""Returns the total size in bytes of all stored days"""
+		return _storedBytes(self.directory)
+
+
+def enable(directory:str,max_bytes=50*1024**3) -> GranuleCache:
+	"""
+	Turns on the granule cache for all subsequent calls to
+	octvi.url.pull(), and returns it.
+
+	...
+
+	Parameters
+	----------
+
+	directory: str
+		Path to the cache directory
+	max_bytes: int
+		Maximum total size of the cache. Default 50 GiB.
+	"""
+	global granule_cache
+	granule_cache = GranuleCache(directory,max_bytes)
+	return granule_cache
+
+
+def persistListings(directory:str) -> ListingCache:
+	"""
+	Keeps DAAC directory listings on disk at {directory}, in addition
+	to in memory, and returns the listing cache.
+	"""
+	global listing_cache
+	listing_cache = ListingCache(directory)
+	return listing_cache
+
+
+def enableDayStore(directory:str,max_bytes=20*1024**3) -> DayStore:
+	"""
+	Turns on the store of per-day CMG arrays for all subsequent
+	CMG composites, and returns it.
+
+	...
+
+	Parameters
+	----------
+
+	directory: str
+		Path to the store directory
+	max_bytes: int
+		Maximum total size of the store. Default 20 GiB.
+	"""
+	global day_store
+	day_store = DayStore(directory,max_bytes)
+	return day_store
+
+
+def disable() -> None:
+	"""Turns off the granule cache. Cached files are left on disk."""
+	global granule_cache
+	granule_cache = None
+
+
+def disableDayStore() -> None:
+	"""Turns off the day store. Stored days are left on disk."""
+	global day_store
+	day_store = None
@@ -21,9 +21,10 @@ def main():
 	parser.add_argument("-vi",
 		"--vegetation_index",
 		type=str,
+		nargs="+",
 		choices = octvi.supported_indices,
-		default = "NDVI",
-		help="Which Vegetation Index should be calculated. Default is NDVI.")
+		default = ["NDVI"],
+		help="Which Vegetation Index, or indices, should be calculated. Several indices are computed from a single download, with one output file each. Default is NDVI.")
 	parser.add_argument('-qa',
 		action='store_true',
 		help="If set, a second output TIFF is created with QA metadata at PATH.qa.EXTENSION.")
@@ -37,6 +38,22 @@ def main():
 		default="LADS",
 		choices=["LADS","LP"],
 		help="Which Distributed Archive (DAAC) to pull imagery from. Default LADS.")
+	parser.add_argument("-j",
+		"--jobs",
+		type=int,
+		default=1,
+		help="Number of tiles to download concurrently, or for CMG-scale products, processes used for compositing. Default 1.")
+	parser.add_argument("--hedge",
+		action='store_true',
+		help="If set, slow tile downloads are raced against the other DAAC.")
+	parser.add_argument("--block_mb",
+		type=float,
+		required=False,
+		help="If set, each tile is processed in row stripes using about this many megabytes of memory. Stripes are at least 240 rows (about 55 MB for 250-m tiles).")
+	parser.add_argument("--cmg_days",
+		type=int,
+		default=8,
+		help="Number of days in a CMG-scale composite. Default 8.")
 
 	args = parser.parse_args()
 
@@ -45,9 +62,13 @@ def main():
 	if args.filename:
 		newOutName = os.path.join(args.out_directory,args.filename)
 	else:
-		newOutName = os.path.join(args.out_directory,f"{args.product}.{year}.{doy}.{args.vegetation_index.lower()}.tif")
+		newOutName = os.path.join(args.out_directory,f"{args.product}.{year}.{doy}.{{vi}}.tif")
+
+	blockBytes = int(args.block_mb * 1024**2) if args.block_mb else None
 
 	try:
-		octvi.globalVi(args.product,args.date,newOutName,args.overwrite,args.vegetation_index,qa=args.qa)
+		octvi.globalVi(args.product,args.date,newOutName,args.overwrite,args.vegetation_index,qa=args.qa,daac=args.daac,jobs=args.jobs,hedge=args.hedge,block_bytes=blockBytes,cmg_days=args.cmg_days)
 	except FileExistsError:
-		print(f"WARNING: file {os.path.basename(newOutName)} already exists in {args.out_directory}. Use the '--overwrite' flag to overwrite existing files.")
\ No newline at end of file
+		for outName in octvi._viPaths(newOutName,args.vegetation_index):
+			if os.path.exists(outName):
+				print(f"WARNING: file {os.path.basename(outName)} already exists in {args.out_directory}. Use the '--overwrite' flag to overwrite existing files.")
\ No newline at end of file
@@ -8,6 +8,62 @@ class UnavailableError(Exception):
 	def __str__(self):
 		return repr(self.data)
 
+class IncompleteDownloadError(UnavailableError):
+	"""
+	Error class indicating that a download
+	finished with a different number of bytes
+	than the DAAC listed for the file.
+	"""
+	def __init__(self,data):
+		self.data=data
+	def __str__(self):
+		return repr(self.data)
+
+class TransientError(UnavailableError):
+	"""
+	Error class indicating that a request kept
+	failing with retryable errors (timeouts,
+	dropped connections, throttling, or server
+	errors) until its retry policy gave up.
+	"""
+	def __init__(self,data):
+		self.data=data
+	def __str__(self):
+		return repr(self.data)
+
+class NotFoundError(UnavailableError):
+	"""
+	Error class indicating that the DAAC reported
+	a requested file or listing as missing
+	(HTTP 404 or 410).
+	"""
+	def __init__(self,data):
+		self.data=data
+	def __str__(self):
+		return repr(self.data)
+
+class AuthorizationError(UnavailableError):
+	"""
+	Error class indicating that the DAAC refused
+	a request (HTTP 401 or 403). Check the app key
+	set with `octviconfig`.
+	"""
+	def __init__(self,data):
+		self.data=data
+	def __str__(self):
+		return repr(self.data)
+
+class DownloadCancelledError(Exception):
+	"""
+	Error class indicating that a download was
+	abandoned on request, for example because a
+	hedged request to the other DAAC won.
+	"""
+	def __init__(self,data):
+		self.data=data
+	def __str__(self):
+		return repr(self.data)
+
 class FileTypeError(TypeError):
 	"""
 	Error class indicating that there is
@@ -4,58 +4,409 @@ logging.basicConfig(level=os.environ.get("LOGLEVEL","INFO"))
 log = logging.getLogger(__name__)
 
 ## import modules
-import octvi.exceptions, octvi.array, gdal
+import octvi.exceptions, octvi.array, octvi.indices, octvi.qa, gdal, h5py
 from gdalnumeric import *
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 
+## approximate bytes of working memory per pixel used by the
+## VI calculation and masking, on top of the bands themselves
+WORKING_BYTES_PER_PIXEL = 40
 
-def getDatasetNames(stack_path:str) -> list:
+
+class Granule:
 	"""
-	Returns list of all subdataset names, in format
-	suitable for passing to other functions'
-	'dataset_name' argument
+	An open MODIS/VIIRS hierarchical file (.hdf or .h5).
+
+	The file is opened and its subdatasets listed once, when the
+	object is created. Subdatasets are then found by name in a
+	dict, and each one is opened at most once, on first use. All
+	of the functions in this module accept either a Granule or a
+	path, so a Granule can be passed from one step to the next
+	instead of re-opening and re-scanning the file each time.
+
+	...
+
+	Parameters
+	----------
+
+	stack_path: str
+		Full path to a hierarchical file on disk
 	"""
 
-	## parsing arguments
-	ext = os.path.splitext(stack_path)[1]
-	if ext == ".hdf":
-		splitter = ":"
-	elif ext == ".h5":
-		splitter = "/"
-	else:
-		raise octvi.exceptions.FileTypeError("File must be of format .hdf or .h5")
+	def __init__(self,stack_path:str):
+		self.path = stack_path
+		self.ext = os.path.splitext(stack_path)[1]
+		if self.ext == ".hdf":
+			splitter = ":"
+		elif self.ext == ".h5":
+			splitter = "/"
+		else:
+			raise octvi.exceptions.FileTypeError("File must be of format .hdf or .h5")
+		self.product = os.path.basename(stack_path).split(".")[0]
+		self.suffix = self.product[3:7]
+
+		self.container = gdal.Open(stack_path,0) # open stack as gdal dataset
+		self._names = []
+		self._subdatasets = {}
+		for sd in self.container.GetSubDatasets():
+			sdName = sd[0].split(splitter)[-1].strip("\"") # split name out of path and strip away quotes
+			self._names.append(sdName)
+			self._subdatasets[sdName] = sd[0]
+		self._handles = {}
+		self._arrays = {}
+		self._decoded = {}
+		self._georeference = None
+
+	def datasetNames(self) -> list:
+		"""Returns list of all subdataset names, in file order"""
+		return list(self._names)
+
+	def datasetPath(self,dataset_name:str) -> str:
+		"""Returns the full GDAL path of the named subdataset"""
+		try:
+			return self._subdatasets[dataset_name]
+		except KeyError:
+			raise octvi.exceptions.DatasetNotFoundError(f"Dataset '{dataset_name}' not found in '{os.path.basename(self.path)}'")
+
+	def dataset(self,dataset_name:str) -> "gdal dataset":
+		"""Returns the open GDAL dataset of the named subdataset"""
+		handle = self._handles.get(dataset_name)
+		if handle is None:
+			handle = gdal.Open(self.datasetPath(dataset_name),0)
+			self._handles[dataset_name] = handle
+		return handle
+
+	def shape(self,dataset_name:str) -> tuple:
+		"""Returns the (rows, columns) of the named subdataset"""
+		ds = self.dataset(dataset_name)
+		return ds.RasterYSize, ds.RasterXSize
+
+	def itemSize(self,dataset_name:str) -> int:
+		"""Returns the size in bytes of one pixel of the named subdataset"""
+		return gdal.GetDataTypeSize(self.dataset(dataset_name).GetRasterBand(1).DataType) // 8
+
+	def storageRows(self,dataset_name:str) -> int:
+		"""Returns the height in rows of the blocks in which the named subdataset is stored"""
+		return self.dataset(dataset_name).GetRasterBand(1).GetBlockSize()[1]
+
+	def read(self,dataset_name:str,window=None) -> "numpy array":
+		"""
+		Returns the named subdataset as a numpy array. Subdatasets
+		held by load() are returned from memory, and are read-only;
+		anything else is read from disk.
+
+		If window is set to (xoff, yoff, xsize, ysize), only that
+		part of the subdataset is returned.
+		"""
+		arr = self._arrays.get(dataset_name)
+		if arr is None:
+			arr = self._readDisk(dataset_name,window)
+		elif window is not None:
+			xoff, yoff, xsize, ysize = window
+			arr = arr[yoff:yoff+ysize,xoff:xoff+xsize]
+		return arr
+
+	def _readDisk(self,dataset_name:str,window=None) -> "numpy array":
+		band = self.dataset(dataset_name).GetRasterBand(1)
+		if window is None:
+			return BandReadAsArray(band)
+		return band.ReadAsArray(*window)
+
+	def window(self,window:tuple) -> "GranuleWindow":
+		"""Returns a view of the (xoff, yoff, xsize, ysize) window of the granule"""
+		return GranuleWindow(self,window)
+
+	def load(self,dataset_names:list) -> None:
+		"""
+		Reads each of the named subdatasets from disk, once, and
+		holds them in memory for later calls to read(), until
+		release() is called. See readPlan().
+		"""
+		for name in dataset_names:
+			if name not in self._arrays:
+				arr = self._readDisk(name)
+				arr.flags.writeable = False # shared by every reader
+				self._arrays[name] = arr
+
+	def release(self) -> None:
+		"""Drops all subdatasets held in memory by load(), and decoded QA"""
+		self._arrays = {}
+		self._decoded = {}
+
+	def decode(self,spec) -> "numpy array":
+		"""
+		Returns the verdicts of an octvi.qa.QaSpec over this
+		granule. They are evaluated once, and the same read-only
+		array is returned by later calls until release().
+		"""
+		verdict = self._decoded.get(spec)
+		if verdict is None:
+			verdict = spec.evaluate(self)
+			verdict.flags.writeable = False
+			self._decoded[spec] = verdict
+		return verdict
+
+	def georeference(self) -> tuple:
+		"""Returns the (geoTransform, projection) of the granule"""
+		if self._georeference is None:
+			self._georeference = octvi.array.getGeoreference(self)
+		return self._georeference
+
+	def close(self) -> None:
+		"""Releases all open GDAL datasets and loaded arrays"""
+		self._handles = {}
+		self._arrays = {}
+		self._decoded = {}
+		self.container = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self,*args):
+		self.close()
+
+	def __repr__(self):
+		return f"Granule({self.path!r})"
+
+
+class H5Granule(Granule):
+	"""
+	An open VIIRS HDF5 file (.h5), read directly with h5py.
 
-	## loop over all subdatasets
-	outSds = []
-	ds = gdal.Open(stack_path,0) # open stack as gdal dataset
-	for sd in ds.GetSubDatasets():
-		sdName = sd[0].split(splitter)[-1] # split name out of path
-		outSds.append(sdName.strip("\"")) # strip away quotes
+	Subdataset names are mapped straight to their HDF5 paths, and
+	reads are served by h5py slicing, without going through GDAL's
+	subdataset lookup. The grid metadata is parsed once, when first
+	needed, and cached. Otherwise this behaves as a Granule, and
+	openGranule() returns one for any .h5 path.
 
-	return outSds
+	...
 
-def datasetToPath(stack_path,dataset_name) -> str:
-	## parsing arguments
-	ext = os.path.splitext(stack_path)[1]
-	if ext == ".hdf":
-		splitter = ":"
-	elif ext == ".h5":
-		splitter = "/"
-	else:
-		raise octvi.exceptions.FileTypeError("File must be of format .hdf or .h5")
+	Parameters
+	----------
 
-	## searching heirarchy for matching subdataset
-	outSd = None
-	ds = gdal.Open(stack_path,0) # open stack as gdal dataset
-	for sd in ds.GetSubDatasets():
-		sdName = sd[0].split(splitter)[-1]
-		if sdName.strip("\"") == dataset_name:
-			outSd = sd[0]
+	stack_path: str
+		Full path to an .h5 file on disk
+	"""
 
-	if outSd is None:
-		raise octvi.exceptions.DatasetNotFoundError(f"Dataset '{dataset_name}' not found in '{os.path.basename(stack_path)}'")
+	def __init__(self,stack_path:str):
+		self.path = stack_path
+		self.ext = os.path.splitext(stack_path)[1]
+		if self.ext != ".h5":
+			raise octvi.exceptions.FileTypeError("File must be of format .h5")
+		self.product = os.path.basename(stack_path).split(".")[0]
+		self.suffix = self.product[3:7]
+
+		self.container = h5py.File(stack_path,mode='r') # open file in read-only mode
+		self._names = []
+		self._subdatasets = {}
+		def visit(h5path,obj):
+			# gdal lists only datasets of two or more dimensions
+			if isinstance(obj,h5py.Dataset) and (len(obj.shape) >= 2):
+				sdName = h5path.split("/")[-1]
+				self._names.append(sdName)
+				self._subdatasets[sdName] = h5path
+		self.container.visititems(visit)
+		self._handles = {}
+		self._arrays = {}
+		self._decoded = {}
+		self._georeference = None
+
+	def datasetPath(self,dataset_name:str) -> str:
+		"""Returns the full GDAL path of the named subdataset"""
+		h5path = self._h5Path(dataset_name)
+		return f'HDF5:"{self.path}"://{h5path.replace(" ","_")}'
+
+	def _h5Path(self,dataset_name:str) -> str:
+		try:
+			return self._subdatasets[dataset_name]
+		except KeyError:
+			raise octvi.exceptions.DatasetNotFoundError(f"Dataset '{dataset_name}' not found in '{os.path.basename(self.path)}'")
+
+	def dataset(self,dataset_name:str) -> "h5py dataset":
+		"""Returns the h5py dataset of the named subdataset"""
+		handle = self._handles.get(dataset_name)
+		if handle is None:
+			handle = self.container[self._h5Path(dataset_name)]
+			self._handles[dataset_name] = handle
+		return handle
+
+	def shape(self,dataset_name:str) -> tuple:
+		"""Returns the (rows, columns) of the named subdataset"""
+		return tuple(self.dataset(dataset_name).shape[:2])
+
+	def itemSize(self,dataset_name:str) -> int:
+		"""Returns the size in bytes of one pixel of the named subdataset"""
+		return self.dataset(dataset_name).dtype.itemsize
+
+	def storageRows(self,dataset_name:str) -> int:
+		"""Returns the height in rows of the chunks in which the named subdataset is stored"""
+		ds = self.dataset(dataset_name)
+		return ds.chunks[0] if ds.chunks else ds.shape[0]
+
+	def _readDisk(self,dataset_name:str,window=None) -> "numpy array":
+		ds = self.dataset(dataset_name)
+		if window is None:
+			return ds[()]
+		xoff, yoff, xsize, ysize = window
+		return ds[yoff:yoff+ysize,xoff:xoff+xsize]
+
+	def georeference(self) -> tuple:
+		"""Returns the (geoTransform, projection) of the granule"""
+		if self._georeference is None:
+			self._georeference = (octvi.array.h5GeoTransform(self.container,self.path),octvi.array.SINUSOIDAL_WKT)
+		return self._georeference
+
+	def close(self) -> None:
+		"""Closes the file and drops loaded arrays"""
+		self._handles = {}
+		self._arrays = {}
+		self._decoded = {}
+		if self.container is not None:
+			self.container.close()
+		self.container = None
+
+	def __repr__(self):
+		return f"H5Granule({self.path!r})"
+
+
+class GranuleWindow:
+	"""
+	A rectangular window onto an open Granule. It can be passed
+	to the same functions as a Granule, which then read and
+	return only the pixels inside the window.
 
-	return outSd
+	...
+
+	Parameters
+	----------
+
+	granule: Granule
+		The open file
+	window: tuple
+		(xoff, yoff, xsize, ysize) of the window, in pixels
+	"""
+
+	def __init__(self,granule:Granule,window:tuple):
+		self.granule = granule
+		self.window = tuple(window)
+		self.path = granule.path
+		self.ext = granule.ext
+		self.product = granule.product
+		self.suffix = granule.suffix
+		self._arrays = {}
+		self._decoded = {}
+
+	def read(self,dataset_name:str) -> "numpy array":
+		"""Returns the window of the named subdataset"""
+		arr = self._arrays.get(dataset_name)
+		if arr is None:
+			arr = self.granule.read(dataset_name,self.window)
+		return arr
+
+	def load(self,dataset_names:list) -> None:
+		"""As Granule.load(), for the pixels inside the window only"""
+		for name in dataset_names:
+			if name not in self._arrays:
+				arr = self.granule.read(name,self.window)
+				arr.flags.writeable = False
+				self._arrays[name] = arr
+
+	def release(self) -> None:
+		"""Drops all subdatasets held in memory by load(), and decoded QA"""
+		self._arrays = {}
+		self._decoded = {}
+
+	def decode(self,spec) -> "numpy array":
+		"""As Granule.decode(), for the pixels inside the window only"""
+		verdict = self._decoded.get(spec)
+		if verdict is None:
+			verdict = spec.evaluate(self)
+			verdict.flags.writeable = False
+			self._decoded[spec] = verdict
+		return verdict
+
+	def __repr__(self):
+		return f"GranuleWindow({self.path!r},{self.window})"
+
+
+def openGranule(stack) -> Granule:
+	"""
+	Returns stack if it is already a Granule (or a
+	GranuleWindow), or else opens the file at path
+	stack as a new Granule; an H5Granule for .h5 files
+	"""
+	if isinstance(stack,(Granule,GranuleWindow)):
+		return stack
+	if os.path.splitext(stack)[1] == ".h5":
+		return H5Granule(stack)
+	return Granule(stack)
+
+def bandDatasets(stack) -> dict:
+	"""
+	Returns a dict mapping each band available in the given
+	file (e.g. "red", "nir") to the name of its subdataset,
+	from octvi.indices.PRODUCT_BANDS. Products that ship a
+	pre-generated NDVI list it as "ndvi".
+	"""
+	stack = openGranule(stack)
+	return octvi.indices.productBands(stack.suffix,stack.ext)
+
+def maskDatasets(stack) -> list:
+	"""
+	Returns the names of the QA subdatasets read by
+	octvi.array.mask() (and, for CMG files, by the
+	cmgTo*Array() functions) for the given file.
+	"""
+	return octvi.qa.maskSpec(openGranule(stack)).datasets()
+
+def readPlan(stack,vi="NDVI",qa_name=None) -> list:
+	"""
+	Returns the names of every subdataset needed to compute and
+	mask the given vegetation index (or list of indices) from the
+	given file, plus the QA subdataset qa_name if it is set.
+	Passing the result to Granule.load() reads each of them
+	exactly once.
+
+	...
+
+	Parameters
+	----------
+
+	stack: str or Granule
+		Full path to input hierarchical file
+	vi: str or list
+		Vegetation index, or indices; see octvi.supported_indices
+	qa_name: str (optional)
+		Name of a QA subdataset to be written alongside the VI
+	"""
+	bands = bandDatasets(stack)
+	plan = []
+	for index in ([vi] if isinstance(vi,str) else vi):
+		if (index == "NDVI") and ("ndvi" in bands):
+			names = [bands["ndvi"]]
+		else:
+			try:
+				names = [bands[band] for band in octvi.indices.get(index).bands]
+			except KeyError:
+				raise octvi.exceptions.UnsupportedError(f"Vegetation index '{index}' not supported for {os.path.basename(openGranule(stack).path)}")
+		plan += [name for name in names if name not in plan]
+	for name in maskDatasets(stack) + ([qa_name] if qa_name else []):
+		if name not in plan:
+			plan.append(name)
+	return plan
+
+def getDatasetNames(stack_path:str) -> list:
+	"""
+	Returns list of all subdataset names, in format
+	suitable for passing to other functions'
+	'dataset_name' argument
+	"""
+	return openGranule(stack_path).datasetNames()
+
+def datasetToPath(stack_path,dataset_name) -> str:
+	return openGranule(stack_path).datasetPath(dataset_name)
 
 def datasetToArray(stack_path,dataset_name) -> "numpy array":
 	"""
@@ -67,20 +418,68 @@ def datasetToArray(stack_path,dataset_name) -> "numpy array":
 	Parameters
 	----------
 
-	stack_path: str
+	stack_path: str or Granule
 		Full path to heirarchical file containing the desired subdataset
 	dataset_name: str
 		Name of desired subdataset, as it appears in the heirarchical file
 	"""
+	return openGranule(stack_path).read(dataset_name)
+
+def rowsPerBlock(stack,dataset_names:list,block_bytes:int) -> int:
+	"""
+	Returns how many full-width rows of the given subdatasets can
+	be read and processed at once within about block_bytes of
+	memory. Where possible, the result is a whole number of the
+	file's own storage blocks, so that no block is read twice.
+	"""
+	stack = openGranule(stack)
+	ysize, xsize = stack.shape(dataset_names[0])
+	pixelBytes = WORKING_BYTES_PER_PIXEL + sum(stack.itemSize(name) for name in dataset_names)
+	rows = int(block_bytes // (pixelBytes * xsize))
+	storageRows = stack.storageRows(dataset_names[0])
+	if rows >= storageRows:
+		rows -= rows % storageRows
+	return max(1,min(rows,ysize))
+
+def blocksToRaster(stack,out_path,dataset_names:list,compute,block_bytes:int,nbands=1,dtype=None) -> str:
+	"""
+	This function writes a raster one row stripe at a time. For
+	each stripe, compute() is passed a GranuleWindow and returns
+	a list of arrays, one per output band. Only the stripe being
+	processed is held in memory, so peak memory is set by
+	block_bytes rather than by the size of the file.
+
+	Returns the string path to the output file
 
-	sd = datasetToPath(stack_path, dataset_name)
+	***
 
-	## return subdataset as numpy array
-	subDs = gdal.Open(sd, 0)
-	subDs_band = subDs.GetRasterBand(1)
-	return BandReadAsArray(subDs_band)
+	Parameters
+	----------
+	stack:str or Granule
+	out_path:str
+	dataset_names:list
+		Subdatasets read by compute(); used to size the stripes
+	compute:function
+		Called with each GranuleWindow
+	block_bytes:int
+		Approximate memory budget, in bytes
+	nbands:int
+		Number of output bands
+	dtype:str
+		Output data type; see octvi.array.createRaster()
+	"""
+	stack = openGranule(stack)
+	ysize, xsize = stack.shape(dataset_names[0])
+	rows = rowsPerBlock(stack,dataset_names,block_bytes)
+	log.debug(f"Processing {os.path.basename(stack.path)} in blocks of {rows} rows")
+	ds = octvi.array.createRaster(out_path,stack,xsize,ysize,nbands,dtype)
+	for window in octvi.array.iterWindows(xsize,ysize,rows):
+		for i, arr in enumerate(compute(stack.window(window))):
+			ds.GetRasterBand(i + 1).WriteArray(arr,window[0],window[1])
+	ds = None # flush to disk
+	return out_path
 
-def datasetToRaster(stack_path,dataset_name, out_path,dtype = None, *args, **kwargs) -> None:
+def datasetToRaster(stack_path,dataset_name, out_path,dtype = None, *args, block_bytes=None, **kwargs) -> None:
 	"""
 	Wrapper for extractAsArray and arrayToRaster which pulls
 	subdataset from hdf or h5 file and saves to new location.
@@ -93,76 +492,76 @@ def datasetToRaster(stack_path,dataset_name, out_path,dtype = None, *args, **kwa
 	stack_path: str
 	dataset_name: str
 	out_path: str
+	block_bytes (optional): int
+		If set, the subdataset is copied in row stripes using about
+		this many bytes of memory; see blocksToRaster()
 
 	"""
 
-	sd_array = datasetToArray(stack_path, dataset_name)
-	return octvi.array.toRaster(sd_array, out_path, model_file = stack_path,dtype=dtype)
+	granule = openGranule(stack_path)
+	if block_bytes is not None:
+		return blocksToRaster(granule,out_path,[dataset_name],lambda window: [window.read(dataset_name)],block_bytes,dtype=dtype)
+	sd_array = granule.read(dataset_name)
+	return octvi.array.toRaster(sd_array, out_path, model_file = granule,dtype=dtype)
 
-def ndviToArray(in_stack) -> "numpy array":
+def viToArray(in_stack,vi="NDVI",dtype=np.int16,out=None) -> "numpy array":
 	"""
-	This function finds the correct Red and NIR bands
-	from a hierarchical file, calculates an NDVI array,
-	and returns the outpus in numpy array format.
-
-	Valid input formats are MODIS HDF or VIIRS HDF5 (h5).
+	This function finds the bands of a registered vegetation
+	index (see octvi.indices) in a hierarchical file, evaluates
+	the index, and returns it in numpy array format.
 
 	...
 
 	Parameters
 	----------
 
-	in_stack: str
+	in_stack: str, Granule, or GranuleWindow
 		Full path to input hierarchical file
+	vi: str
+		Vegetation index; one of octvi.supported_indices
+	dtype: numpy dtype
+		Type of the returned array. Default int16
+	out: numpy.array (optional)
+		Preallocated array to write the index into
 
 	"""
 
-	suffix = os.path.basename(in_stack).split(".")[0][3:7]
+	in_stack = openGranule(in_stack)
+	bands = bandDatasets(in_stack)
 
 	# check whether it's an ndvi product
-	if suffix == "09Q4" or suffix == "13Q4":
-		arr_ndvi = datasetToArray(in_stack, "250m 8 days NDVI")
-
-	elif suffix == "13Q1":
-		arr_ndvi = datasetToArray(in_stack, "250m 16 days NDVI")
-
-	elif suffix == "09CM":
-		## determine correct band subdataset names
-		ext = os.path.splitext(in_stack)[1]
-		if ext == ".hdf":
-			sdName_red = "Coarse Resolution Surface Reflectance Band 1"
-			sdName_nir = "Coarse Resolution Surface Reflectance Band 2"
-		elif ext == '.h5':
-			sdName_red = "SurfReflect_I1"
-			sdName_nir = "SurfReflect_I2"
+	if (vi == "NDVI") and ("ndvi" in bands):
+		# copied, since mask() modifies the VI array in place
+		if out is None:
+			return in_stack.read(bands["ndvi"]).astype(dtype)
+		np.copyto(out,in_stack.read(bands["ndvi"]),casting='unsafe')
+		return out
+
+	index = octvi.indices.get(vi)
+	try:
+		arrays = {band:in_stack.read(bands[band]) for band in index.bands}
+	except KeyError:
+		raise octvi.exceptions.UnsupportedError(f"Vegetation index '{vi}' not supported for {os.path.basename(in_stack.path)}")
+	return index.evaluate(arrays,dtype,out)
 
-		## extract red and nir bands from stack
-		arr_red = datasetToArray(in_stack,sdName_red)
-		arr_nir = datasetToArray(in_stack,sdName_nir)
+def ndviToArray(in_stack) -> "numpy array":
+	"""
+	This function finds the correct Red and NIR bands
+	from a hierarchical file, calculates an NDVI array,
+	and returns the outpus in numpy array format.
 
-		## perform calculation
-		arr_ndvi = octvi.array.calcNdvi(arr_red,arr_nir)
+	Valid input formats are MODIS HDF or VIIRS HDF5 (h5).
 
-	else:
-		## determine correct band subdataset names
-		ext = os.path.splitext(in_stack)[1]
-		if ext == ".hdf":
-			sdName_red = "sur_refl_b01"
-			sdName_nir = "sur_refl_b02"
-		elif ext == ".h5":
-			sdName_red = "SurfReflect_I1"
-			sdName_nir = "SurfReflect_I2"
-		else:
-			raise octvi.exceptions.FileTypeError("File must be of type .hdf or .h5")
+	...
 
-		## extract red and nir bands from stack
-		arr_red = datasetToArray(in_stack,sdName_red)
-		arr_nir = datasetToArray(in_stack,sdName_nir)
+	Parameters
+	----------
 
-		## perform calculation
-		arr_ndvi = octvi.array.calcNdvi(arr_red,arr_nir)
+	in_stack: str or Granule
+		Full path to input hierarchical file
 
-	return arr_ndvi
+	"""
+	return viToArray(in_stack,"NDVI")
 
 def gcviToArray(in_stack:str) -> "numpy array":
 	"""
@@ -170,49 +569,18 @@ def gcviToArray(in_stack:str) -> "numpy array":
 	from a hierarchical file, calculates a GCVI array,
 	and returns the outpus in numpy array format.
 
-	Valid input format is MOD09CMG HDF.
+	Valid input formats are MOD09CMG, VNP09CMG, and MOD09A1.
 
 	...
 
 	Parameters
 	----------
 
-	in_stack: str
+	in_stack: str or Granule
 		Full path to input hierarchical file
 
 	"""
-
-	suffix = os.path.basename(in_stack).split(".")[0][3:7]
-
-	# check whether it's an ndvi product
-	if suffix  == "09CM":
-		## determine correct band subdataset names
-		ext = os.path.splitext(in_stack)[1]
-		if ext == ".hdf":
-			sdName_green = "Coarse Resolution Surface Reflectance Band 4"
-			sdName_nir = "Coarse Resolution Surface Reflectance Band 2"
-		elif ext == '.h5':
-			sdName_green = "SurfReflect_M4"
-			sdName_nir = "SurfReflect_I2"
-
-		## extract red and nir bands from stack
-		arr_green = datasetToArray(in_stack,sdName_green)
-		arr_nir = datasetToArray(in_stack,sdName_nir)
-
-		## perform calculation
-		arr_gcvi = octvi.array.calcGcvi(arr_green,arr_nir)
-
-	elif suffix == "09A1":
-		sdName_green = "sur_refl_b04"
-		sdName_nir = "sur_refl_b02"
-		arr_green = datasetToArray(in_stack,sdName_green)
-		arr_nir = datasetToArray(in_stack,sdName_nir)
-		arr_gcvi = octvi.array.calcGcvi(arr_green,arr_nir)
-
-	else:
-		raise octvi.exceptions.UnsupportedError("Only MOD09CMG and MOD09A1 imagery is supported for GCVI generation")
-
-	return arr_gcvi
+	return viToArray(in_stack,"GCVI")
 
 def ndwiToArray(in_stack:str) -> "numpy array":
 	"""
@@ -220,35 +588,24 @@ def ndwiToArray(in_stack:str) -> "numpy array":
 	from a hierarchical file, calculates a NDWI array,
 	and returns the outpus in numpy array format.
 
-	Valid input format is HDF.
+	Valid input format is MOD09A1 HDF.
 
 	...
 
 	Parameters
 	----------
 
-	in_stack: str
+	in_stack: str or Granule
 		Full path to input hierarchical file
 
 	"""
+	return viToArray(in_stack,"NDWI")
 
-	suffix = os.path.basename(in_stack).split(".")[0][3:7]
-
-	if suffix == "09A1":
-		sdName_nir = "sur_refl_b02"
-		sdName_swir = "sur_refl_b05"
-		arr_nir = datasetToArray(in_stack, sdName_nir)
-		arr_swir = datasetToArray(in_stack,sdName_swir)
-		arr_ndwi = octvi.array.calcNdwi(arr_nir,arr_swir)
-	else:
-		raise octvi.exceptions.UnsupportedError("Only MOD09A1 imagery is supported for GCVI generation")
-
-	return arr_ndwi
-
-def ndviToRaster(in_stack,out_path,qa_name=None) -> str:
+def viToRaster(in_stack,out_path,vi="NDVI",qa_name=None,block_bytes=None) -> str:
 	"""
 	This function directly converts a hierarchical data
-	file into an NDVI raster.
+	file into a raster of any registered vegetation index,
+	masked for clouds, shadow, and water.
 
 	Returns the string path to the output file
 
@@ -256,87 +613,212 @@ def ndviToRaster(in_stack,out_path,qa_name=None) -> str:
 
 	Parameters
 	----------
-	in_stack:str
+	in_stack:str or Granule
 	out_path:str
+	vi:str
+		Vegetation index; one of octvi.supported_indices
 	qa_name (optional):str
 		Name of QA dataset, if included produces
 		two-band tiff
+	block_bytes (optional):int
+		If set, the file is processed in row stripes using
+		about this many bytes of memory
 	"""
 
-	# create ndvi array
-	ndviArray = ndviToArray(in_stack)
+	in_stack = openGranule(in_stack)
 
-	# apply cloud, shadow, and water masks
-	ndviArray = octvi.array.mask(ndviArray, in_stack)
+	if block_bytes is not None:
+		def compute(window):
+			arrays = [octvi.array.mask(viToArray(window,vi),window)]
+			if qa_name is not None:
+				arrays.append(window.read(qa_name))
+			return arrays
+		nbands = 1 if qa_name is None else 2
+		return blocksToRaster(in_stack,out_path,readPlan(in_stack,vi,qa_name),compute,block_bytes,nbands)
 
-	sample_sd = getDatasetNames(in_stack)[0]
+	in_stack.load(readPlan(in_stack,vi,qa_name))
+
+	# create vi array
+	viArray = viToArray(in_stack,vi)
+
+	# apply cloud, shadow, and water masks
+	viArray = octvi.array.mask(viArray, in_stack)
 
-	#ext = os.path.splitext(in_stack)[1]
-	#if ext == ".hdf":
-		#sample_sd = "sur_refl_b01"
-	#elif ext == ".h5":
-		#sample_sd = "SurfReflect_I1"
-	#else:
-		#raise octvi.exceptions.FileTypeError("File must be of format .hdf or .h5")
 	if qa_name is None:
-		#octvi.array.toRaster(ndviArray,out_path,datasetToPath(in_stack,sample_sd))
-		octvi.array.toRaster(ndviArray,out_path,in_stack,sample_sd)
+		octvi.array.toRaster(viArray,out_path,in_stack)
 	else:
 		# get qa array
-		qaArray = datasetToArray(in_stack,qa_name)
+		qaArray = in_stack.read(qa_name)
 		# create multiband at out_path
-		#octvi.array.toRaster(ndviArray,out_path,datasetToPath(in_stack,sample_sd),qa_array = qaArray)
-		octvi.array.toRaster(ndviArray,out_path,in_stack,qa_array = qaArray)
+		octvi.array.toRaster(viArray,out_path,in_stack,qa_array = qaArray)
 
 	return out_path
 
-def gcviToRaster(in_stack:str,out_path:str) -> str:
+def visToRasters(in_stack,vis:list,out_paths:list,block_bytes=None) -> list:
 	"""
-	This function directly converts a hierarchical data
-	file into a GCVI raster.
+	This function converts a hierarchical data file into one
+	masked raster per vegetation index in vis, written to the
+	matching path in out_paths. Each band and QA layer is read
+	only once, and the mask decoded only once, for all of the
+	indices together.
 
-	Returns the string path to the output file
+	Returns the list of output paths
+
+	***
+
+	Parameters
+	----------
+	in_stack:str or Granule
+	vis:list
+		Vegetation indices; see octvi.supported_indices
+	out_paths:list
+		Output file for each index
+	block_bytes (optional):int
+		If set, the file is processed in row stripes using
+		about this many bytes of memory
 	"""
 
-	# create gcvi array
-	gcviArray = gcviToArray(in_stack)
+	in_stack = openGranule(in_stack)
+	plan = readPlan(in_stack,vis)
+
+	if block_bytes is None:
+		in_stack.load(plan)
+		for vi, out_path in zip(vis,out_paths):
+			viToRaster(in_stack,out_path,vi)
+		return out_paths
+
+	ysize, xsize = in_stack.shape(plan[0])
+	rows = rowsPerBlock(in_stack,plan,block_bytes)
+	log.debug(f"Processing {os.path.basename(in_stack.path)} in blocks of {rows} rows")
+	datasets = [octvi.array.createRaster(out_path,in_stack,xsize,ysize) for out_path in out_paths]
+	for window in octvi.array.iterWindows(xsize,ysize,rows):
+		part = in_stack.window(window)
+		part.load(plan)
+		for vi, ds in zip(vis,datasets):
+			ds.GetRasterBand(1).WriteArray(octvi.array.mask(viToArray(part,vi),part),window[0],window[1])
+		part.release()
+	datasets = None # flush to disk
+	return out_paths
+
+def visToMosaics(in_stack,vis:list,writers:list,block_bytes=None) -> None:
+	"""
+	As visToRasters(), but each masked index is written straight
+	into its place in the matching global mosaic in writers, rather
+	than to a raster file of its own.
 
-	# apply cloud, shadow, and water masks
-	gcviArray = octvi.array.mask(gcviArray, in_stack)
+	***
+
+	Parameters
+	----------
+	in_stack:str or Granule
+		A tile of a sinusoidal-grid product
+	vis:list
+		Vegetation indices; see octvi.supported_indices
+	writers:list
+		octvi.array.MosaicWriter for each index
+	block_bytes (optional):int
+		If set, the file is processed in row stripes using
+		about this many bytes of memory, rounded to whole blocks
+		of the mosaics, and never less than one block; see
+		octvi.array.MosaicWriter.stripeRows()
+	"""
 
-	sample_sd = getDatasetNames(in_stack)[0]
+	in_stack = openGranule(in_stack)
+	plan = readPlan(in_stack,vis)
+
+	if block_bytes is None:
+		in_stack.load(plan)
+		for vi, writer in zip(vis,writers):
+			writer.write(in_stack,octvi.array.mask(viToArray(in_stack,vi),in_stack))
+		return None
+
+	ysize, xsize = in_stack.shape(plan[0])
+	rows = rowsPerBlock(in_stack,plan,block_bytes)
+	for writer in writers: # stripes of whole mosaic blocks
+		rows = writer.stripeRows(in_stack,rows)
+	log.debug(f"Processing {os.path.basename(in_stack.path)} in blocks of {rows} rows")
+	for window in octvi.array.iterWindows(xsize,ysize,rows):
+		part = in_stack.window(window)
+		part.load(plan)
+		for vi, writer in zip(vis,writers):
+			writer.write(in_stack,octvi.array.mask(viToArray(part,vi),part),window[0],window[1])
+		part.release()
+	return None
 
-	#ext = os.path.splitext(in_stack)[1]
-	#if ext == ".hdf":
-		#sample_sd = "sur_refl_b01"
-	#elif ext == ".h5":
-		#sample_sd = "SurfReflect_I1"
-	#else:
-		#raise octvi.exceptions.FileTypeError("File must be of format .hdf or .h5")
+def datasetToMosaic(stack_path,dataset_name,writer,block_bytes=None) -> None:
+	"""
+	Pulls subdataset from a tile's hdf or h5 file and writes it
+	straight into its place in a global mosaic.
 
-	octvi.array.toRaster(gcviArray,out_path,datasetToPath(in_stack,sample_sd))
+	...
 
-	return out_path
+	Arguments
+	---------
 
-def ndwiToRaster(in_stack:str, out_path:str) -> str:
+	stack_path: str or Granule
+	dataset_name: str
+	writer: octvi.array.MosaicWriter
+	block_bytes (optional): int
+		If set, the subdataset is copied in row stripes using about
+		this many bytes of memory, rounded to whole blocks of the
+		mosaic, and never less than one block; see
+		octvi.array.MosaicWriter.stripeRows()
+
+	"""
+
+	granule = openGranule(stack_path)
+	if block_bytes is None:
+		writer.write(granule,granule.read(dataset_name))
+		return None
+	ysize, xsize = granule.shape(dataset_name)
+	rows = writer.stripeRows(granule,rowsPerBlock(granule,[dataset_name],block_bytes))
+	for window in octvi.array.iterWindows(xsize,ysize,rows):
+		writer.write(granule,granule.window(window).read(dataset_name),window[0],window[1])
+	return None
+
+def ndviToRaster(in_stack,out_path,qa_name=None,block_bytes=None) -> str:
 	"""
 	This function directly converts a hierarchical data
-	file into an NDWI raster.
+	file into an NDVI raster.
 
 	Returns the string path to the output file
-	"""
 
-	# create gcvi array
-	ndwiArray = ndwiToArray(in_stack)
+	***
 
-	# apply cloud, shadow, and water masks
-	ndwiArray = octvi.array.mask(ndwiArray, in_stack)
+	Parameters
+	----------
+	in_stack:str or Granule
+	out_path:str
+	qa_name (optional):str
+		Name of QA dataset, if included produces
+		two-band tiff
+	block_bytes (optional):int
+		If set, the file is processed in row stripes using
+		about this many bytes of memory
+	"""
+	return viToRaster(in_stack,out_path,"NDVI",qa_name,block_bytes)
 
-	sample_sd = getDatasetNames(in_stack)[0]
+def gcviToRaster(in_stack:str,out_path:str,block_bytes=None) -> str:
+	"""
+	This function directly converts a hierarchical data
+	file into a GCVI raster. If block_bytes is set, the
+	file is processed in row stripes using about that
+	many bytes of memory.
 
-	octvi.array.toRaster(ndwiArray,out_path,datasetToPath(in_stack,sample_sd))
+	Returns the string path to the output file
+	"""
+	return viToRaster(in_stack,out_path,"GCVI",block_bytes=block_bytes)
 
-	return out_path
+def ndwiToRaster(in_stack:str, out_path:str,block_bytes=None) -> str:
+	"""
+	This function directly converts a hierarchical data
+	file into an NDWI raster. If block_bytes is set, the
+	file is processed in row stripes using about that
+	many bytes of memory.
+
+	Returns the string path to the output file
+	"""
+	return viToRaster(in_stack,out_path,"NDWI",block_bytes=block_bytes)
 
 def cmgToViewAngArray(source_stack,product="MOD09CMG") -> "numpy array":
 	"""
@@ -350,20 +832,39 @@ def cmgToViewAngArray(source_stack,product="MOD09CMG") -> "numpy array":
 
 	Parameters
 	----------
-	source_stack:str
+	source_stack:str or Granule
 		Path to the M*D CMG .hdf file on disk
 	"""
+	source_stack = openGranule(source_stack)
 	if product == "MOD09CMG":
-		vang_arr = datasetToArray(source_stack,"Coarse Resolution View Zenith Angle")
-		state_arr = datasetToArray(source_stack,"Coarse Resolution State QA")
+		vang_arr = source_stack.read("Coarse Resolution View Zenith Angle")
+		state_arr = source_stack.read("Coarse Resolution State QA")
 		water = ((state_arr & 0b111000)) # check bits
-		vang_arr[water==32]=9999 # ephemeral water???
+		vang_arr = np.where(water==32,9999,vang_arr) # ephemeral water???
 		vang_arr[vang_arr<=0]=9999
 	elif product == "VNP09CMG":
-		vang_arr = datasetToArray(source_stack,"SensorZenith")
-		vang_arr[vang_arr<=0]=9999
+		vang_arr = source_stack.read("SensorZenith")
+		vang_arr = np.where(vang_arr<=0,9999,vang_arr)
 	return vang_arr
 
+def cmgToWaterArray(source_stack,product="MOD09CMG") -> "numpy array":
+	"""
+	This function takes the path to a CMG file, and returns
+	a binary array, with "0" for non-water pixels and "1" for
+	water pixels.
+
+	***
+
+	Parameters
+	----------
+	source_stack:str or Granule
+		Path to the CMG .hdf/.h5 file on disk
+	product:str
+		String of either MOD09CMG or VNP09CMG
+	"""
+	source_stack = openGranule(source_stack)
+	return source_stack.decode(octvi.qa.CMG_WATER[product])
+
 def cmgListToWaterArray(stacks:list,product="MOD09CMG") -> "numpy array":
 	"""
 	This function takes a list of CMG .hdf files, and returns
@@ -376,28 +877,9 @@ def cmgListToWaterArray(stacks:list,product="MOD09CMG") -> "numpy array":
 	Parameters
 	----------
 	stacks:list
-		List of hdf filepaths (M*D**CMG)
-	"""
-	water_list = []
-	for source_stack in stacks:
-		if product == "MOD09CMG":
-			state_arr = datasetToArray(source_stack,"Coarse Resolution State QA")
-			water = ((state_arr & 0b111000)) # check bits
-			water[water==56]=1 # deep ocean
-			water[water==48]=1 # continental/moderate ocean
-			water[water==24]=1 # shallow inland water
-			water[water==40]=1 # deep inland water
-			water[water==0]=1 # shallow ocean
-			water[state_arr==0]=0
-			water[water!=1]=0 # set non-water to zero
-		elif product == "VNP09CMG":
-			state_arr = datasetToArray(source_stack,"State_QA")
-			water = ((state_arr & 0b111000)) # check bits 3-5
-			water[water == 40] = 0 # "coastal" = 101
-			water[water>8]=1 # sea water = 011; inland water = 010
-			water[water!=1]=0 # set non-water to zero
-			water[water!=0]=1
-		water_list.append(water)
+		List of hdf filepaths or Granules (M*D**CMG)
+	"""
+	water_list = [cmgToWaterArray(source_stack,product) for source_stack in stacks]
 	water_final = np.maximum.reduce(water_list)
 	return water_final
 
@@ -413,141 +895,180 @@ def cmgToRankArray(source_stack,product="MOD09CMG") -> "numpy array":
 
 	Parameters
 	----------
-	source_stack:str
+	source_stack:str or Granule
 		Path to the CMG .hdf/.h5 file on disk
 	product:str
 		String of either MOD09CMG or VNP09CMG
 	"""
-	if product == "MOD09CMG":
-		qa_arr = datasetToArray(source_stack,"Coarse Resolution QA")
-		state_arr = datasetToArray(source_stack,"Coarse Resolution State QA")
-		vang_arr = datasetToArray(source_stack,"Coarse Resolution View Zenith Angle")
-		vang_arr[vang_arr<=0]=9999
-		sang_arr = datasetToArray(source_stack,"Coarse Resolution Solar Zenith Angle")
-		rank_arr = np.full(qa_arr.shape,10) # empty rank array
-
-		## perform the ranking!
-		logging.debug("--rank 9: SNOW")
-		SNOW = ((state_arr & 0b1000000000000) | (state_arr & 0b1000000000000000)) # state bit 12 OR 15
-		rank_arr[SNOW>0]=9 # snow
-		del SNOW
-		logging.debug("--rank 8: HIGHAEROSOL")
-		HIGHAEROSOL=(state_arr & 0b11000000) # state bits 6 AND 7
-		rank_arr[HIGHAEROSOL==192]=8
-		del HIGHAEROSOL
-		logging.debug("--rank 7: CLIMAEROSOL")
-		CLIMAEROSOL=(state_arr & 0b11000000) # state bits 6 & 7
-		#CLIMAEROSOL=(cloudMask & 0b100000000000000) # cloudMask bit 14
-		rank_arr[CLIMAEROSOL==0]=7 # default aerosol level
-		del CLIMAEROSOL
-		logging.debug("--rank 6: UNCORRECTED")
-		UNCORRECTED = (qa_arr & 0b11) # qa bits 0 AND 1
-		rank_arr[UNCORRECTED==3]=6 # flagged uncorrected
-		del UNCORRECTED
-		logging.debug("--rank 5: SHADOW")
-		SHADOW = (state_arr & 0b100) # state bit 2
-		rank_arr[SHADOW==4]=5 # cloud shadow
-		del SHADOW
-		logging.debug("--rank 4: CLOUDY")
-		# set adj to 11 and internal to 12 to verify in qa output
-		CLOUDY = ((state_arr & 0b11)) # state bit 0 OR bit 1 OR bit 10 OR bit 13
-		#rank_arr[CLOUDY!=0]=4 # cloud pixel
-		del CLOUDY
-		CLOUDADJ = (state_arr & 0b10000000000000)
-		#rank_arr[CLOUDADJ>0]=4 # adjacent to cloud
-		del CLOUDADJ
-		CLOUDINT = (state_arr & 0b10000000000)
-		rank_arr[CLOUDINT>0]=4
-		del CLOUDINT
-		logging.debug("--rank 3: HIGHVIEW")
-		rank_arr[sang_arr>(85/0.01)]=3 # HIGHVIEW
-		logging.debug("--rank 2: LOWSUN")
-		rank_arr[vang_arr>(60/0.01)]=2 # LOWSUN
-		# BAD pixels
-		logging.debug("--rank 1: BAD pixels") # qa bits (2-5 OR 6-9 == 1110)
-		BAD = ((qa_arr & 0b111100) | (qa_arr & 0b1110000000))
-		rank_arr[BAD==112]=1
-		rank_arr[BAD==896]=1
-		rank_arr[BAD==952]=1
-		del BAD
-
-		logging.debug("-building water mask")
-		water = ((state_arr & 0b111000)) # check bits
-		water[water==56]=1 # deep ocean
-		water[water==48]=1 # continental/moderate ocean
-		water[water==24]=1 # shallow inland water
-		water[water==40]=1 # deep inland water
-		water[water==0]=1 # shallow ocean
-		rank_arr[water==1]=0
-		vang_arr[water==32]=9999 # ephemeral water???
-		water[state_arr==0]=0
-		water[water!=1]=0 # set non-water to zero
+	source_stack = openGranule(source_stack)
+	return source_stack.decode(octvi.qa.CMG_RANK[product])
 
-	elif product == "VNP09CMG":
-		#print("cmgToRankArray(product='VNP09CMG')")
-		qf2 = datasetToArray(source_stack,"SurfReflect_QF2")
-		qf4 = datasetToArray(source_stack,"SurfReflect_QF4")
-		state_arr = datasetToArray(source_stack,"State_QA")
-		vang_arr = datasetToArray(source_stack,"SensorZenith")
-		vang_arr[vang_arr<=0]=9999
-		sang_arr = datasetToArray(source_stack,"SolarZenith")
-		rank_arr = np.full(state_arr.shape,10) # empty rank array
-
-		## perform the ranking!
-		logging.debug("--rank 9: SNOW")
-		SNOW = (state_arr & 0b1000000000000000) # state bit 15
-		rank_arr[SNOW>0]=9 # snow
-		del SNOW
-		logging.debug("--rank 8: HIGHAEROSOL")
-		HIGHAEROSOL=(qf2 & 0b10000) # qf2 bit 4
-		rank_arr[HIGHAEROSOL!=0]=8
-		del HIGHAEROSOL
-		logging.debug("--rank 7: AEROSOL")
-		CLIMAEROSOL=(state_arr & 0b1000000) # state bit 6
-		#CLIMAEROSOL=(cloudMask & 0b100000000000000) # cloudMask bit 14
-		#rank_arr[CLIMAEROSOL==0]=7 # "No"
-		del CLIMAEROSOL
-		# logging.debug("--rank 6: UNCORRECTED")
-		# UNCORRECTED = (qa_arr & 0b11) # qa bits 0 AND 1
-		# rank_arr[UNCORRECTED==3]=6 # flagged uncorrected
-		# del UNCORRECTED
-		logging.debug("--rank 5: SHADOW")
-		SHADOW = (state_arr & 0b100) # state bit 2
-		rank_arr[SHADOW!=0]=5 # cloud shadow
-		del SHADOW
-		logging.debug("--rank 4: CLOUDY")
-		# set adj to 11 and internal to 12 to verify in qa output
-		# CLOUDY = ((state_arr & 0b11)) # state bit 0 OR bit 1 OR bit 10 OR bit 13
-		# rank_arr[CLOUDY!=0]=4 # cloud pixel
-		# del CLOUDY
-		# CLOUDADJ = (state_arr & 0b10000000000) # nonexistent for viirs
-		# #rank_arr[CLOUDADJ>0]=4 # adjacent to cloud
-		# del CLOUDADJ
-		CLOUDINT = (state_arr & 0b10000000000) # state bit 10
-		rank_arr[CLOUDINT>0]=4
-		del CLOUDINT
-		logging.debug("--rank 3: HIGHVIEW")
-		rank_arr[sang_arr>(85/0.01)]=3 # HIGHVIEW
-		logging.debug("--rank 2: LOWSUN")
-		rank_arr[vang_arr>(60/0.01)]=2 # LOWSUN
-		# BAD pixels
-		logging.debug("--rank 1: BAD pixels") # qa bits (2-5 OR 6-9 == 1110)
-		BAD = (qf4 & 0b110)
-		rank_arr[BAD!= 0]=1
-		del BAD
-
-		logging.debug("-building water mask")
-		water = ((state_arr & 0b111000)) # check bits 3-5
-		water[water == 40] = 0 # "coastal" = 101
-		water[water>8]=1 # sea water = 011; inland water = 010
-		# water[water==16]=1 # inland water = 010
-		# water[state_arr==0]=0
-		water[water!=1]=0 # set non-water to zero
-		water[water!=0]=1
-		rank_arr[water==1]=0
-
-	# return the results
-	return rank_arr
+def cmgDayArrays(stack,vi="NDVI",product="MOD09CMG") -> tuple:
+	"""
+	Reads one daily CMG file, and returns its (rank, view angle,
+	VI, water) arrays; everything CmgCompositor needs from the
+	day. These are what octvi.cache.DayStore keeps per date.
+
+	If vi is a list, a list of such tuples is returned, one per
+	index. The bands are then read, and the rank, view angle, and
+	water decoded, only once; the tuples share those arrays.
+
+	...
+
+	Parameters
+	----------
+	stack:str or Granule
+		Path to the CMG .hdf/.h5 file on disk
+	vi:str or list
+		"NDVI" or "GCVI", or a list of indices
+	product:str
+		String of either MOD09CMG or VNP09CMG
+	"""
+	vis = [vi] if isinstance(vi,str) else list(vi)
+	opened = not isinstance(stack,(Granule,GranuleWindow))
+	granule = openGranule(stack)
+	try:
+		granule.load(readPlan(granule,vis))
+		rank = cmgToRankArray(granule,product)
+		vang = cmgToViewAngArray(granule,product)
+		viArrays = [viToArray(granule,index) for index in vis]
+		water = cmgToWaterArray(granule,product)
+	finally:
+		if opened:
+			granule.close()
+		else:
+			granule.release()
+	if isinstance(vi,str):
+		return rank, vang, viArrays[0], water
+	return [(rank, vang, viArray, water) for viArray in viArrays]
+
+def _selectionKey(rank,vang,vi,snow_mask) -> "numpy array":
+	"""
+	Combines one day's rank and view angle into an int32 key,
+	which is higher for a higher rank, or for the same rank
+	and a lower view angle. Pixels with no VI are ranked 0,
+	as are snow pixels if snow_mask is set.
+	"""
+	# no nodata wanted
+	rank = np.where(vi == -3000,0,rank)
+	# apply snow mask if requested
+	if snow_mask:
+		rank[rank==9] = 0
+	vang = np.where(vang == 0,9997,vang) # view angles are positive from here
+	key = rank.astype(np.int32)
+	key *= 32768
+	key += 32767
+	key -= vang
+	return key
+
+def _keyRank(key) -> "numpy array":
+	return key // 32768
+
+def _keyVang(key) -> "numpy array":
+	return 32767 - (key % 32768)
+
+
+class CmgCompositor:
+	"""
+	Builds a CMG composite one day at a time.
+
+	Each call to addDay() folds a daily file into running
+	per-pixel accumulators (best selection key and its VI,
+	the VI of the last lower-ranked day, and water), and
+	the file's bands are dropped straight after. Memory use is
+	therefore the same whatever the number of days, and
+	finalize() returns exactly what cmgBestViPixels() would for
+	the same files in the same order: the VI of the day with
+	the highest rank, ties broken by lowest view angle and then
+	by the latest day.
+
+	...
+
+	Parameters
+	----------
+
+	vi: str
+		Vegetation index; "NDVI" or "GCVI"
+	product: str
+		"MOD09CMG" or "VNP09CMG"
+	snow_mask: bool
+		If True, snow-ranked pixels are treated as nodata
+	"""
+
+	def __init__(self,vi="NDVI",product="MOD09CMG",snow_mask=False):
+		octvi.indices.get(vi) # raises UnsupportedError if unknown
+		self.vi = vi
+		self.product = product
+		self.snow_mask = snow_mask
+		self.days = 0
+		self._rank = None # highest rank so far
+		self._key = None # highest selection key so far
+		self._vi = None # VI of the latest day with that key
+		self._day = None # index of that day
+		self._lowerVi = None # VI of the latest day ranked below self._rank
+		self._lowerDay = None # index of that day; -1 if none
+		self._previousVi = None
+		self._water = None
+
+	def addDay(self,stack) -> None:
+		"""
+		Folds one daily CMG file (path or Granule) into the
+		composite. Days must be added in date order.
+		"""
+		self.addDayArrays(*cmgDayArrays(stack,self.vi,self.product))
+
+	def addDayArrays(self,rank,vang,vi,water) -> None:
+		"""
+		Folds one day's (rank, view angle, VI, water) arrays, as
+		returned by cmgDayArrays(), into the composite. Days must
+		be added in date order.
+		"""
+		key = _selectionKey(rank,vang,vi,self.snow_mask)
+		rank = _keyRank(key)
+		day = self.days
+
+		if day == 0:
+			self._rank = rank
+			self._key = key
+			self._vi = vi
+			self._day = np.zeros(rank.shape,dtype=np.int16)
+			self._lowerVi = np.full(vi.shape,-3000,dtype=vi.dtype)
+			self._lowerDay = np.full(rank.shape,-1,dtype=np.int16)
+			self._water = water.copy()
+		else:
+			higher = rank > self._rank
+			lower = rank < self._rank
+			# when the best rank rises, every earlier day is now
+			# lower-ranked, the latest of them being yesterday
+			self._lowerVi = np.where(higher,self._previousVi,np.where(lower,vi,self._lowerVi))
+			self._lowerDay = np.where(higher,day-1,np.where(lower,day,self._lowerDay)).astype(np.int16)
+			# the latest of equal keys wins
+			better = key >= self._key
+			np.maximum(self._key,key,out=self._key)
+			self._vi = np.where(better,vi,self._vi)
+			self._day = np.where(better,day,self._day).astype(np.int16)
+			np.maximum(self._rank,rank,out=self._rank)
+			np.maximum(self._water,water,out=self._water)
+		self._previousVi = vi
+		self.days += 1
+
+	def finalize(self) -> "numpy array":
+		"""Returns the composite VI array"""
+		if self.days == 0:
+			raise ValueError("No days have been added to the composite")
+		# lower-ranked days count as view angle 9998, so they are
+		# chosen over best-ranked days with no valid view angle
+		vang = _keyVang(self._key)
+		useLower = (self._lowerDay >= 0) & ((vang > 9998) | ((vang == 9998) & (self._lowerDay > self._day)))
+		finalVi = np.where(useLower,self._lowerVi,self._vi)
+
+		# mask out ranks that are too low
+		finalVi[self._rank <=7] = -3000
+
+		# mask water
+		finalVi[self._water==1] = -3000
+
+		return finalVi
 
 def cmgBestViPixels(input_stacks:list,vi="NDVI",product = "MOD09CMG",snow_mask=False) -> "numpy array":
 	"""
@@ -556,65 +1077,139 @@ def cmgBestViPixels(input_stacks:list,vi="NDVI",product = "MOD09CMG",snow_mask=F
 	determined through the ranking method (see
 	cmgToRankArray() for details).
 
+	Every day's selection key and VI are held in memory
+	together, and the best day is found with a single argmax
+	along the day axis. To composite many days in constant
+	memory, use CmgCompositor instead.
+
 	***
 
 	Parameters
 	----------
 	input_stacks:list
 		A list of strings, each pointing to a CMG hdf/h5 file
-		on disk
+		on disk, or of open Granules
 	product:str
 		A string of either "MOD09CMG" or "VNP09CMG"
 	"""
+	octvi.indices.get(vi) # raises UnsupportedError if unknown
+	return _bestViPixels((cmgDayArrays(hdf,vi,product) for hdf in input_stacks),len(input_stacks),snow_mask)
 
-	viExtractors = {
-		"NDVI":ndviToArray,
-		"GCVI":gcviToArray
-	}
-
-	rankArrays = [cmgToRankArray(hdf,product) for hdf in input_stacks]
-	vangArrays = [cmgToViewAngArray(hdf,product) for hdf in input_stacks]
-	try:
-		viArrays = [viExtractors[vi](hdf) for hdf in input_stacks]
-	except KeyError:
-		raise octvi.exceptions.UnsupportedError(f"Index type '{vi}' is not recognized or not currently supported.")
-	# no nodata wanted
-	for i in range(len(rankArrays)):
-		rankArrays[i][viArrays[i] == -3000] = 0
+def _bestViPixels(day_arrays,days:int,snow_mask:bool) -> "numpy array":
+	"""
+	cmgBestViPixels() on the (rank, view angle, VI, water)
+	arrays of each of {days} days, as returned by
+	cmgDayArrays(), in date order
+	"""
+	for i, (rank, vang, viArray, dayWater) in enumerate(day_arrays):
+		if i == 0:
+			keys = np.empty((days,)+rank.shape,dtype=np.int32)
+			viArrays = np.empty((days,)+viArray.shape,dtype=viArray.dtype)
+			water = dayWater.copy()
+		else:
+			np.maximum(water,dayWater,out=water)
+		keys[i] = _selectionKey(rank,vang,viArray,snow_mask)
+		viArrays[i] = viArray
+		del rank, vang, viArray, dayWater
+
+	# the latest of equal keys wins, so search the days backwards
+	bestDay = (days - 1) - np.argmax(keys[::-1],axis=0)
+	bestKey = np.take_along_axis(keys,bestDay[np.newaxis],axis=0)[0]
+	idealRank = _keyRank(bestKey)
+
+	# lower-ranked days count as view angle 9998, so they are
+	# chosen over best-ranked days with no valid view angle; this
+	# only matters where the best rank is kept (above 7)
+	tie = (idealRank > 7) & (_keyVang(bestKey) >= 9998)
+	if tie.any():
+		tieKeys = keys[:,tie]
+		tieRanks = _keyRank(tieKeys)
+		lowerRanked = tieRanks < idealRank[tie]
+		candidates = lowerRanked | (_keyVang(tieKeys) == 9998)
+		latest = (days - 1) - np.argmax(candidates[::-1],axis=0)
+		bestDay[tie] = np.where(lowerRanked.any(axis=0),latest,bestDay[tie])
+
+	finalVi = np.take_along_axis(viArrays,bestDay[np.newaxis],axis=0)[0]
 
-	# apply snow mask if requested
-	if snow_mask:
-		for rankArray in rankArrays:
-			rankArray[rankArray==9] = 0
+	# mask out ranks that are too low
+	finalVi[idealRank <=7] = -3000
 
-	idealRank = np.maximum.reduce(rankArrays)
+	# mask water
+	finalVi[water==1] = -3000
 
-	# mask non-ideal view angles
-	for i in range(len(vangArrays)):
-		vangArrays[i][rankArrays[i] != idealRank] = 9998
-		vangArrays[i][vangArrays[i] == 0] = 9997
+	# return result
+	return finalVi
 
-	idealVang = np.minimum.reduce(vangArrays)
+## granules opened once by each cmgCompositeStripes() worker process
+_stripeGranules = []
 
-	#print("Max vang:")
-	#print(np.amax(idealVang))
-	#octvi.array.toRaster(idealVang,"C:/temp/MOD09CMG.VANG.tif",input_stacks[0])
-	#octvi.array.toRaster(idealRank,"C:/temp/VNP09CMG.RANK.tif",input_stacks[0])
+def _openStripeDays(input_stacks:list) -> None:
+	"""
+	Process pool initializer for cmgCompositeStripes(); opens
+	each day once, for every stripe the worker composites
+	"""
+	_stripeGranules[:] = [openGranule(stack) for stack in input_stacks]
 
-	finalVi = np.full(viArrays[0].shape,-3000)
+def _compositeStripe(vi:str,product:str,snow_mask:bool,window:tuple,shm_name:str,shape:tuple,dtype:str) -> tuple:
+	"""
+	Process pool worker for cmgCompositeStripes(); composites
+	one window of the worker's open days into the shared output
+	array
+	"""
+	shm = shared_memory.SharedMemory(name=shm_name)
+	try:
+		out = np.ndarray(shape,dtype=dtype,buffer=shm.buf)
+		compositor = CmgCompositor(vi,product,snow_mask)
+		for granule in _stripeGranules:
+			compositor.addDay(GranuleWindow(granule,window))
+		xoff, yoff, xsize, ysize = window
+		out[yoff:yoff+ysize,xoff:xoff+xsize] = compositor.finalize()
+	finally:
+		shm.close()
+	return window
+
+def cmgCompositeStripes(input_stacks:list,vi="NDVI",product="MOD09CMG",snow_mask=False,jobs=None) -> "numpy array":
+	"""
+	Returns the same composite as cmgBestViPixels(), computed
+	in parallel: the grid is split into one row stripe per
+	process, and each process composites its stripe of every
+	day with a CmgCompositor, writing the result straight into
+	a shared-memory output array. Each process opens every day
+	only once, however many stripes it is given.
 
-	# mask each ndviArray to only where it matches ideal rank
-	for i in range(len(viArrays)):
-		finalVi[vangArrays[i] == idealVang] = viArrays[i][vangArrays[i] == idealVang]
+	***
 
-	# mask out ranks that are too low
-	finalVi[idealRank <=7] = -3000
+	Parameters
+	----------
+	input_stacks:list
+		A list of paths to CMG hdf/h5 files on disk
+	vi:str
+		"NDVI" or "GCVI"
+	product:str
+		A string of either "MOD09CMG" or "VNP09CMG"
+	snow_mask:bool
+		If True, snow-ranked pixels are treated as nodata
+	jobs:int
+		Number of processes. Default os.cpu_count()
+	"""
+	octvi.indices.get(vi) # raises UnsupportedError if unknown
+	jobs = jobs or os.cpu_count() or 1
 
-	# mask water
-	water = cmgListToWaterArray(input_stacks,product)
-	finalVi[water==1] = -3000
+	with openGranule(input_stacks[0]) as granule:
+		shape = granule.shape(readPlan(granule,vi)[0])
+	dtype = np.dtype(np.int16) # see octvi.array.calcNdvi()
+	rows = -(-shape[0] // jobs)
 
-	# return result
+	shm = shared_memory.SharedMemory(create=True,size=max(1,int(np.prod(shape)) * dtype.itemsize))
+	try:
+		with ProcessPoolExecutor(max_workers=jobs,initializer=_openStripeDays,initargs=(list(input_stacks),)) as executor:
+			futures = [executor.submit(_compositeStripe,vi,product,snow_mask,window,shm.name,shape,dtype.str) for window in octvi.array.iterWindows(shape[1],shape[0],rows)]
+			for future in futures:
+				log.debug(f"Composited stripe {future.result()}")
+		finalVi = np.ndarray(shape,dtype=dtype,buffer=shm.buf).copy()
+	finally:
+		shm.close()
+		shm.unlink()
 	return finalVi
 
 def qaTo8BitArray(stack_path) -> "numpy array":
@@ -0,0 +1,277 @@
+## set up logging
+import logging, os
+logging.basicConfig(level=os.environ.get("LOGLEVEL","INFO"))
+log = logging.getLogger(__name__)
+
+## import modules
+import ast, octvi.exceptions
+import numpy as np
+
+## band roles that index expressions may refer to
+BAND_ROLES = ("red","nir","green","swir","blue")
+
+## subdataset of each band role, by product suffix and file
+## extension; None matches any suffix or extension. Products
+## that ship a pre-generated NDVI list it as "ndvi".
+PRODUCT_BANDS = {
+	("13Q1",None):{"ndvi":"250m 16 days NDVI"},
+	("09Q4",None):{"ndvi":"250m 8 days NDVI"},
+	("13Q4",None):{"ndvi":"250m 8 days NDVI"},
+	("09CM",".hdf"):{
+		"red":"Coarse Resolution Surface Reflectance Band 1",
+		"nir":"Coarse Resolution Surface Reflectance Band 2",
+		"blue":"Coarse Resolution Surface Reflectance Band 3",
+		"green":"Coarse Resolution Surface Reflectance Band 4"
+		},
+	("09CM",".h5"):{"red":"SurfReflect_I1","nir":"SurfReflect_I2","blue":"SurfReflect_M3","green":"SurfReflect_M4"},
+	("09A1",None):{"red":"sur_refl_b01","nir":"sur_refl_b02","blue":"sur_refl_b03","green":"sur_refl_b04","swir":"sur_refl_b05"},
+	(None,".hdf"):{"red":"sur_refl_b01","nir":"sur_refl_b02"},
+	(None,None):{"red":"SurfReflect_I1","nir":"SurfReflect_I2"}
+	}
+
+## pixels per chunk of an evaluation; small enough that the
+## work arrays of a chunk stay in cache
+CHUNK_PIXELS = 1 << 15
+
+_UFUNCS = {
+	ast.Add:np.add,
+	ast.Sub:np.subtract,
+	ast.Mult:np.multiply,
+	ast.Div:np.divide
+	}
+
+supported_indices = []
+_registry = {}
+
+
+def productBands(suffix:str,ext:str) -> dict:
+	"""
+	Returns the dict of band role to subdataset name for files
+	of the given product suffix (e.g. "09A1") and extension.
+	"""
+	for key in ((suffix,ext),(suffix,None),(None,ext),(None,None)):
+		if key in PRODUCT_BANDS:
+			return PRODUCT_BANDS[key]
+
+
+class Expression:
+	"""
+	A vegetation index, written as an arithmetic expression of
+	band roles; e.g. "(nir - red) / (nir + red)". Bands are in
+	the integer units of the file (reflectance x 10000), so any
+	additive constants must be scaled to match.
+
+	The expression is compiled once into a short program of
+	in-place numpy operations over a few float32 work arrays,
+	reused from one operation to the next. evaluate() runs it
+	over CHUNK_PIXELS pixels at a time, so that the only full-
+	size array it allocates is its output. Pixels where any
+	divisor is zero are set to -3000.
+
+	...
+
+	Parameters
+	----------
+
+	text: str
+		The expression. Allowed are the names in BAND_ROLES,
+		numbers, parentheses, unary minus, and + - * /
+	scale: float
+		Factor applied to the result. Default 10000
+	"""
+
+	def __init__(self,text:str,scale=10000):
+		self.text = text
+		self.scale = scale
+		self.bands = []
+		self._program = []
+		self._free = []
+		self.registers = 0
+		try:
+			tree = ast.parse(text,mode="eval")
+		except SyntaxError:
+			raise ValueError(f"Could not parse index expression '{text}'")
+		result = self._compile(tree.body)
+		if result[0] != "reg":
+			result = self._toRegister(result)
+		self._result = result[1]
+		del self._free
+
+	## compilation; operands are ("band", role), ("const", value) or ("reg", i)
+
+	def _register(self) -> int:
+		if self._free:
+			return self._free.pop()
+		self.registers += 1
+		return self.registers - 1
+
+	def _release(self,operand,keep=None) -> None:
+		if (operand[0] == "reg") and (operand[1] != keep):
+			self._free.append(operand[1])
+
+	def _toRegister(self,operand) -> tuple:
+		reg = self._register()
+		self._program.append(("copy",operand,None,reg))
+		return ("reg",reg)
+
+	def _compile(self,node) -> tuple:
+		if isinstance(node,ast.Name):
+			if node.id not in BAND_ROLES:
+				raise ValueError(f"Unknown band '{node.id}' in index expression '{self.text}'; valid bands are {BAND_ROLES}")
+			if node.id not in self.bands:
+				self.bands.append(node.id)
+			return ("band",node.id)
+		elif isinstance(node,ast.Constant) and isinstance(node.value,(int,float)) and not isinstance(node.value,bool):
+			return ("const",float(node.value))
+		elif isinstance(node,ast.UnaryOp) and isinstance(node.op,(ast.USub,ast.UAdd)):
+			operand = self._compile(node.operand)
+			if isinstance(node.op,ast.UAdd):
+				return operand
+			if operand[0] == "const":
+				return ("const",-operand[1])
+			if operand[0] == "band":
+				operand = self._toRegister(operand)
+			self._program.append((np.negative,operand,None,operand[1]))
+			return operand
+		elif isinstance(node,ast.BinOp) and (type(node.op) in _UFUNCS):
+			ufunc = _UFUNCS[type(node.op)]
+			left = self._compile(node.left)
+			right = self._compile(node.right)
+			if (left[0] == "const") and (right[0] == "const"):
+				if (ufunc is np.divide) and (right[1] == 0):
+					raise ValueError(f"Division by zero in index expression '{self.text}'")
+				return ("const",float(ufunc(left[1],right[1])))
+			if ufunc is np.divide:
+				if right == ("const",0.0):
+					raise ValueError(f"Division by zero in index expression '{self.text}'")
+				if right[0] == "band":
+					right = self._toRegister(right)
+				if right[0] == "reg":
+					self._program.append(("guard",right,None,right[1]))
+			# write into a work array already holding an operand
+			if left[0] == "reg":
+				out = left[1]
+			elif right[0] == "reg":
+				out = right[1]
+			else:
+				out = self._register()
+			self._program.append((ufunc,left,right,out))
+			self._release(left,out)
+			self._release(right,out)
+			return ("reg",out)
+		raise ValueError(f"Unsupported syntax in index expression '{self.text}'")
+
+	## evaluation
+
+	def evaluate(self,bands:dict,dtype=np.int16,out=None) -> "numpy array":
+		"""
+		Evaluates the expression over the given arrays, and returns
+		the scaled result. Integer results are truncated toward zero
+		and saturate at the limits of the dtype.
+
+		...
+
+		Parameters
+		----------
+
+		bands: dict
+			Arrays of the same shape, keyed by band role; must include
+			every role in self.bands
+		dtype: numpy dtype
+			Type of the returned array. Default int16
+		out: numpy.array (optional)
+			Preallocated array to write the result into, in which case
+			its own dtype is used
+		"""
+		arrays = {role:np.asarray(bands[role]) for role in self.bands}
+		shape = np.broadcast_shapes(*[a.shape for a in arrays.values()]) if arrays else ()
+		if out is None:
+			out = np.empty(shape,dtype=dtype)
+		if out.ndim == 0:
+			target = out.reshape(1)
+			arrays = {role:a.reshape(1) for role, a in arrays.items()}
+		else:
+			target = out
+		rowPixels = int(np.prod(target.shape[1:]))
+		rows = max(1,CHUNK_PIXELS // max(1,rowPixels))
+		chunkShape = (min(rows,target.shape[0]),) + target.shape[1:]
+		work = [np.empty(chunkShape,dtype=np.float32) for i in range(self.registers)]
+		zeroBuffer = np.empty(chunkShape,dtype=bool)
+		limits = np.iinfo(out.dtype) if np.issubdtype(out.dtype,np.integer) else None
+		for start in range(0,target.shape[0],rows):
+			stop = min(start + rows,target.shape[0])
+			n = stop - start
+			chunk = {role:a[start:stop] for role, a in arrays.items()}
+			registers = [w[:n] for w in work]
+			zero = zeroBuffer[:n]
+			zero[...] = False
+			result = self._run(chunk,registers,zero)
+			if self.scale != 1:
+				result *= self.scale
+			result[zero] = -3000
+			if limits is not None:
+				np.clip(result,limits.min,limits.max,out=result)
+			np.copyto(target[start:stop],result,casting='unsafe')
+		return out
+
+	def _run(self,chunk:dict,registers:list,zero) -> "numpy array":
+		def value(operand):
+			if operand[0] == "band":
+				return chunk[operand[1]]
+			elif operand[0] == "const":
+				return np.float32(operand[1])
+			return registers[operand[1]]
+		for op, a, b, out in self._program:
+			if op == "copy":
+				np.copyto(registers[out],value(a),casting='unsafe')
+			elif op == "guard":
+				divisor = registers[out]
+				isZero = divisor == 0
+				zero |= isZero
+				divisor[isZero] = 1
+			elif b is None:
+				op(value(a),out=registers[out])
+			else:
+				op(value(a),value(b),out=registers[out],dtype=np.float32)
+		return registers[self._result]
+
+
+def register(name:str,expression:str,scale=10000) -> Expression:
+	"""
+	Adds a vegetation index to octvi, under the given name, and
+	returns its compiled Expression. Registered indices can be
+	passed as 'vi' anywhere in octvi, including the command line
+	and CMG compositing, for products that have all of their bands.
+
+	...
+
+	Parameters
+	----------
+
+	name: str
+		Name of the index; e.g. "EVI"
+	expression: str
+		Arithmetic expression of band roles; see Expression
+	scale: float
+		Factor applied to the result. Default 10000
+	"""
+	compiled = Expression(expression,scale)
+	_registry[name] = compiled
+	if name not in supported_indices:
+		supported_indices.append(name)
+	return compiled
+
+
+def get(name:str) -> Expression:
+	"""Returns the compiled Expression of a registered index"""
+	try:
+		return _registry[name]
+	except KeyError:
+		raise octvi.exceptions.UnsupportedError(f"Index type '{name}' is not recognized or not currently supported.")
+
+
+register("NDVI","(nir - red) / (nir + red)")
+register("GCVI","(nir - green) / green")
+register("NDWI","(nir - swir) / (nir + swir)")
+register("EVI","2.5 * (nir - red) / (nir + 6 * red - 7.5 * blue + 10000)")
+register("SAVI","1.5 * (nir - red) / (nir + red + 5000)")
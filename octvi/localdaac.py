@@ -0,0 +1,285 @@
+## set up logging
+import logging, os
+logging.basicConfig(level=os.environ.get("LOGLEVEL","INFO"))
+log = logging.getLogger(__name__)
+
+## import modules
+import argparse, csv, hashlib, octvi.cache, octvi.url, random, threading, time
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from io import StringIO
+from urllib.parse import urlsplit
+
+
+class LocalDaac:
+	"""
+	A local HTTP server standing in for the LADS, LANCE NRT, and LP
+	DAACs, for offline tests and repeatable download benchmarks.
+
+	It mimics the parts of each archive that octvi.url reads: the LADS
+	".csv" year and day listings, the NRT "api/v2/content/details" csv,
+	and the LP "MOLT" directory tree. Granules added with addGranule()
+	are served as deterministic synthetic bytes (not valid HDF files),
+	with support for HTTP Range requests.
+
+	Used as a context manager, the server is started and octvi.url is
+	pointed at it for the duration of the block:
+
+		with LocalDaac(latency=0.05) as daac:
+			daac.addGranule("MOD09Q1","2019-01-01","h00v08")
+			octvi.url.getUrls("MOD09Q1","2019-01-01")
+
+	...
+
+	Parameters
+	----------
+
+	latency: float
+		Seconds to wait before answering each request
+	bandwidth: float (optional)
+		Maximum bytes per second sent for each response
+	error_rate: float
+		Fraction of requests answered with an error instead
+	error_codes: tuple
+		HTTP status codes chosen from for injected errors
+	drop_rate: float
+		Fraction of file downloads cut off halfway through
+	seed: int (optional)
+		Seed for the random choice of injected errors
+	"""
+
+	def __init__(self,latency=0.0,bandwidth=None,error_rate=0.0,error_codes=(503,),drop_rate=0.0,seed=None):
+		self.latency = latency
+		self.bandwidth = bandwidth
+		self.error_rate = error_rate
+		self.error_codes = tuple(error_codes)
+		self.drop_rate = drop_rate
+		self.requests = []
+		self._random = random.Random(seed)
+		self._lock = threading.Lock()
+		self._granules = {} # (product,collection,year,doy) -> {name:size}
+		self._server = None
+		self._thread = None
+		self._previousUrls = None
+
+	## catalogue
+
+	def addGranule(self,product:str,date:str,tile=None,size=1024*1024) -> str:
+		"""
+		Adds a synthetic granule of {size} bytes to the archive,
+		and returns its file name. {tile} should be omitted for
+		CMG-scale products.
+		"""
+		collection = octvi.url._collection(product)
+		dateObj = datetime.strptime(date,"%Y-%m-%d")
+		year, doy = dateObj.strftime("%Y"), dateObj.strftime("%j")
+		ext = "h5" if product[:3] == "VNP" else "hdf"
+		version = "001" if collection == "5000" else collection.zfill(3)
+		parts = [product,f"A{year}{doy}"] + ([tile] if tile else []) + [version,"2020001000000",ext]
+		name = ".".join(parts)
+		with self._lock:
+			self._granules.setdefault((product,collection,year,doy),{})[name] = int(size)
+		return name
+
+	def granuleBytes(self,name:str,size:int) -> bytes:
+		"""Returns the synthetic contents of the granule {name}"""
+		block = hashlib.sha256(name.encode('utf-8')).digest()
+		return (block * (size // len(block) + 1))[:size]
+
+	def _days(self,product,collection,year) -> list:
+		with self._lock:
+			return sorted(k[3] for k in self._granules if k[:3] == (product,collection,year))
+
+	def _files(self,product,collection,year,doy) -> dict:
+		with self._lock:
+			return dict(self._granules.get((product,collection,year,doy),{}))
+
+	## server lifecycle
+
+	@property
+	def url(self) -> str:
+		"""Root url of the running server"""
+		host, port = self._server.server_address[:2]
+		return f"http://{host}:{port}"
+
+	def start(self) -> str:
+		"""Starts the server in a background thread, and returns its root url"""
+		daac = self
+		class Handler(_DaacRequestHandler):
+			pass
+		Handler.daac = daac
+		self._server = ThreadingHTTPServer(("127.0.0.1",0),Handler)
+		self._server.daemon_threads = True
+		self._thread = threading.Thread(target=self._server.serve_forever,daemon=True)
+		self._thread.start()
+		return self.url
+
+	def stop(self) -> None:
+		"""Stops the server"""
+		if self._server is not None:
+			self._server.shutdown()
+			self._server.server_close()
+			self._server = None
+
+	def __enter__(self):
+		self.start()
+		self._previousUrls = octvi.url.setBaseUrls(lads=f"{self.url}/lads",nrt=f"{self.url}/nrt",lp=f"{self.url}/lp")
+		octvi.url.connection_pool.clear()
+		if octvi.cache.listing_cache is not None:
+			octvi.cache.listing_cache.clear()
+		return self
+
+	def __exit__(self,*args):
+		octvi.url.setBaseUrls(**self._previousUrls)
+		octvi.url.connection_pool.clear()
+		if octvi.cache.listing_cache is not None:
+			octvi.cache.listing_cache.clear()
+		self.stop()
+
+
+def _csv(fields:list,rows:list) -> bytes:
+	out = StringIO()
+	writer = csv.DictWriter(out,fieldnames=fields,lineterminator="\n")
+	writer.writeheader()
+	writer.writerows(rows)
+	return out.getvalue().encode('utf-8')
+
+
+class _DaacRequestHandler(BaseHTTPRequestHandler):
+	"""Routes requests to the LADS, NRT, and LP views of a LocalDaac"""
+	protocol_version = "HTTP/1.1"
+	daac = None
+
+	def log_message(self,format,*args):
+		log.debug(format % args)
+
+	def do_GET(self):
+		daac = self.daac
+		with daac._lock:
+			daac.requests.append(self.path)
+			injectError = daac._random.random() < daac.error_rate
+			code = daac._random.choice(daac.error_codes) if daac.error_codes else 503
+		if daac.latency:
+			time.sleep(daac.latency)
+		if injectError:
+			return self._send(code,b"",headers={"Retry-After":"0"} if code in (429,503) else None)
+
+		path = urlsplit(self.path).path
+		parts = [p for p in path.split("/") if p]
+		try:
+			if parts[:3] == ["lads","archive","allData"]:
+				return self._lads(parts[3:])
+			elif parts[:3] == ["nrt","archive","allData"]:
+				return self._file(parts[3:7],parts[7])
+			elif parts[:6] == ["nrt","api","v2","content","details","allData"]:
+				return self._nrt(parts[6:])
+			elif parts[:2] == ["lp","MOLT"]:
+				return self._lp(parts[2:])
+		except (IndexError, ValueError, KeyError):
+			pass
+		return self._send(404,b"Not Found")
+
+	def _lads(self,parts):
+		# {collection}/{product}/{year}/[{doy}/].csv or {collection}/{product}/{year}/{doy}/{name}
+		collection, product, year = parts[:3]
+		if parts[-1] == ".csv" and len(parts) == 4:
+			days = self.daac._days(product,collection,year)
+			if not days:
+				return self._send(404,b"Not Found")
+			return self._send(200,_csv(["name","size"],[{"name":d,"size":0} for d in days]),"text/csv")
+		doy = parts[3]
+		if parts[-1] == ".csv":
+			files = self.daac._files(product,collection,year,doy)
+			if not files:
+				return self._send(404,b"Not Found")
+			return self._send(200,_csv(["name","size"],[{"name":n,"size":s} for n, s in sorted(files.items())]),"text/csv")
+		return self._file([collection,product,year,doy],parts[4])
+
+	def _nrt(self,parts):
+		# {collection}/{product}/{year}/[{doy}/]
+		collection, product, year = parts[:3]
+		fields = ["kind","name","size","downloadsLink"]
+		if len(parts) == 3:
+			rows = [{"kind":"DIRECTORY","name":d,"size":0,"downloadsLink":""} for d in self.daac._days(product,collection,year)]
+		else:
+			doy = parts[3]
+			rows = [{"kind":"FILE","name":n,"size":s,"downloadsLink":f"/archive/allData/{collection}/{product}/{year}/{doy}/{n}"} for n, s in sorted(self.daac._files(product,collection,year,doy).items())]
+		return self._send(200,_csv(fields,rows),"text/csv")
+
+	def _lp(self,parts):
+		# {product}.{collection}/{%Y.%m.%d}/[{name}]
+		product = parts[0].split(".")[0]
+		collection = octvi.url._collection(product)
+		dateObj = datetime.strptime(parts[1],"%Y.%m.%d")
+		year, doy = dateObj.strftime("%Y"), dateObj.strftime("%j")
+		if len(parts) == 2:
+			files = self.daac._files(product,collection,year,doy)
+			links = "".join(f'<a href="{n}">{n}</a>\n' for n in sorted(files))
+			return self._send(200,f"<html><body>\n{links}</body></html>".encode('utf-8'),"text/html")
+		return self._file([collection,product,year,doy],parts[2])
+
+	def _file(self,location,name):
+		collection, product, year, doy = location
+		size = self.daac._files(product,collection,year,doy).get(name)
+		if size is None:
+			return self._send(404,b"Not Found")
+		data = self.daac.granuleBytes(name,size)
+		start = 0
+		rangeHeader = self.headers.get("Range")
+		if rangeHeader and rangeHeader.startswith("bytes="):
+			start = int(rangeHeader[6:].split("-")[0])
+			if start >= size:
+				return self._send(416,b"",headers={"Content-Range":f"bytes */{size}"})
+			headers = {"Content-Range":f"bytes {start}-{size-1}/{size}"}
+			status = 206
+		else:
+			headers = {}
+			status = 200
+		with self.daac._lock:
+			drop = self.daac._random.random() < self.daac.drop_rate
+		return self._send(status,data[start:],"application/octet-stream",headers,drop)
+
+	def _send(self,status,body,content_type="text/plain",headers=None,drop=False):
+		self.send_response(status)
+		self.send_header("Content-Type",content_type)
+		self.send_header("Content-Length",str(len(body)))
+		for k, v in (headers or {}).items():
+			self.send_header(k,v)
+		self.end_headers()
+		if drop: # send half the body, then hang up
+			body = body[:len(body)//2]
+			self.close_connection = True
+		bandwidth = self.daac.bandwidth
+		chunk = int(bandwidth / 10) if bandwidth else len(body)
+		for i in range(0,len(body),max(1,chunk)):
+			self.wfile.write(body[i:i+chunk])
+			if bandwidth:
+				time.sleep(len(body[i:i+chunk]) / bandwidth)
+		self.wfile.flush()
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Serve a synthetic local DAAC for offline octvi benchmarks.")
+	parser.add_argument('product',type=str,choices=octvi.url.supported_products,help="Product code; e.g. 'MOD09Q1'")
+	parser.add_argument('date',type=str,help="Date of the synthetic granules, in format '%%Y-%%m-%%d'")
+	parser.add_argument('-n','--tiles',type=int,default=10,help="Number of tiles to serve. Default 10.")
+	parser.add_argument('-s','--size',type=int,default=10*1024*1024,help="Size of each granule in bytes. Default 10 MiB.")
+	parser.add_argument('--latency',type=float,default=0.0,help="Seconds of latency added to each request.")
+	parser.add_argument('--bandwidth',type=float,default=None,help="Bytes per second per response.")
+	parser.add_argument('--error_rate',type=float,default=0.0,help="Fraction of requests answered with HTTP 503.")
+	args = parser.parse_args()
+
+	daac = LocalDaac(latency=args.latency,bandwidth=args.bandwidth,error_rate=args.error_rate)
+	for i in range(args.tiles):
+		daac.addGranule(args.product,args.date,None if args.product[5:8] == "CMG" else f"h{i % 36:02d}v{i // 36:02d}",args.size)
+	url = daac.start()
+	print(f"Serving synthetic DAAC at {url}. Set:\n  OCTVI_LADS_URL={url}/lads\n  OCTVI_NRT_URL={url}/nrt\n  OCTVI_LP_URL={url}/lp")
+	try:
+		while True:
+			time.sleep(3600)
+	except KeyboardInterrupt:
+		daac.stop()
+
+
+if __name__ == "__main__":
+	main()
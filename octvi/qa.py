@@ -0,0 +1,247 @@
+## set up logging
+import logging, os
+logging.basicConfig(level=os.environ.get("LOGLEVEL","INFO"))
+log = logging.getLogger(__name__)
+
+## import modules
+import octvi.exceptions
+import numpy as np
+from collections import namedtuple
+
+## every possible value of a 16-bit QA word
+_WORDS = np.arange(65536,dtype=np.int64)
+
+## a QA rule: where (word & bits) is (or, for "not in", is
+## not) one of values, the pixel's verdict is at most verdict
+Rule = namedtuple("Rule",["bits","test","values","verdict"])
+
+## an angle rule: where the angle is at or below lower, or
+## above upper, the pixel's verdict is at most verdict
+Limit = namedtuple("Limit",["dataset","lower","upper","verdict"])
+
+
+def lookup(table,qa_arr) -> "numpy array":
+	"""
+	Decodes a QA band through a 65536-entry lookup table
+	in a single gather, and returns an array of the table's
+	dtype with the same shape as qa_arr.
+
+	All of the QA rules in octvi read bits 0-15 only, so
+	wider (e.g. 32-bit) words are truncated to 16 bits and
+	narrower ones are used as they are.
+
+	...
+
+	Parameters
+	----------
+
+	table: numpy.array
+		A lookup table, as built by compileRules()
+	qa_arr: numpy.array
+		Integer QA band
+	"""
+	return np.take(table,qa_arr.astype(np.uint16,copy=False))
+
+def compileRules(rules:list,default:int) -> "numpy array":
+	"""
+	Evaluates a list of Rules against all 65536 possible QA
+	words, and returns the verdicts as a uint8 lookup table.
+	Each word's verdict is the lowest verdict of the rules it
+	matches, or default if it matches none.
+	"""
+	table = np.full(_WORDS.shape,default,dtype=np.uint8)
+	for rule in rules:
+		matched = np.isin(_WORDS & rule.bits,rule.values)
+		if rule.test == "not in":
+			matched = ~matched
+		elif rule.test != "in":
+			raise ValueError(f"Unknown rule test '{rule.test}'")
+		np.minimum(table,rule.verdict,out=table,where=matched)
+	return table
+
+
+class QaSpec:
+	"""
+	The QA rules of one product, defined as data.
+
+	Each QA subdataset has its own list of Rules, compiled once
+	to a lookup table. A pixel's verdict is the lowest verdict
+	of any rule it matches across all of its QA words and angle
+	Limits, or default if none match. Masks use 1 for "keep"
+	and 0 for "drop"; CMG ranks run from 10 (best) to 0 (water).
+
+	...
+
+	Parameters
+	----------
+
+	words: dict
+		Maps QA subdataset names to lists of Rules
+	default: int
+		Verdict of pixels that match no rule
+	limits: list
+		Angle Limits
+	threshold: int
+		octvi.array.mask() drops pixels whose verdict is at or
+		below threshold
+	"""
+
+	def __init__(self,words:dict,default=1,limits=(),threshold=0):
+		self.words = words
+		self.default = default
+		self.limits = list(limits)
+		self.threshold = threshold
+		self._tables = None
+
+	def datasets(self) -> list:
+		"""Returns the names of all subdatasets read by evaluate()"""
+		return list(self.words) + [limit.dataset for limit in self.limits]
+
+	def tables(self) -> dict:
+		"""Returns the compiled lookup table of each QA subdataset"""
+		if self._tables is None:
+			self._tables = {name:compileRules(rules,self.default) for name, rules in self.words.items()}
+		return self._tables
+
+	def evaluate(self,stack) -> "numpy array":
+		"""
+		Returns the uint8 verdict of every pixel of stack, a
+		Granule or GranuleWindow
+		"""
+		verdict = None
+		for name, table in self.tables().items():
+			decoded = lookup(table,stack.read(name))
+			if verdict is None:
+				verdict = decoded
+			else:
+				np.minimum(verdict,decoded,out=verdict)
+		for limit in self.limits:
+			angle = stack.read(limit.dataset)
+			outside = angle > limit.upper
+			if limit.lower is not None:
+				outside |= angle <= limit.lower
+			np.minimum(verdict,limit.verdict,out=verdict,where=outside)
+		return verdict
+
+	def __repr__(self):
+		return f"QaSpec({self.datasets()})"
+
+
+## standard surface reflectance: MxD09Q1, MxD09A1, and VNP09H1 state QA
+STANDARD_RULES = [
+	Rule(0b11,"not in",(0,),0), # clouds
+	Rule(0b10000000000,"not in",(0,),0), # internal cloud mask
+	Rule(0b100,"not in",(0,),0), # cloud shadow
+	Rule(0b10000000000000,"not in",(0,),0), # cloud adjacent
+	Rule(0b11000000,"in",(0,192),0), # climatology aerosol; high aerosol, known to be an unreliable flag in MODIS collection 6
+	Rule(0b1000000000000,"not in",(0,),0), # snow/ice
+	Rule(0b111000,"not in",(8,16,32),0), # land, coastline, and ephemeral water are kept
+]
+
+## MxD13Q1 and MxD13Q4N VI Quality
+VI_QUALITY_RULES = [
+	Rule(0b11,"in",(2,3),0), # bits 0-1 > 01 = Cloudy
+	Rule(0b11000000,"in",(0,192),0), # climatology or high aerosol
+	Rule(0b11100000000000,"not in",(2048,4096,8192),0), # 001 = land, 010 = coastline, 100 = ephemeral water
+	Rule(0b100000000000000,"not in",(0,),0), # snow/ice; bit 14
+	Rule(0b1000000000000000,"not in",(0,),0), # cloud shadow; bit 15
+	Rule(0b100000000,"not in",(0,),0), # cloud adjacent; bit 8
+]
+
+## CMG land/water classes (state bits 3-5) treated as water
+MOD_CMG_WATER_CLASSES = (0,24,40,48,56) # shallow, continental, and deep ocean; shallow and deep inland water
+VNP_CMG_WATER_CLASSES = (16,24,32,48,56) # inland and sea water; not "coastal" = 101
+
+## CMG ranks, as defined on page 7 of the MOD09 user guide
+MOD_CMG_RANK = QaSpec(
+	{
+		"Coarse Resolution State QA":[
+			Rule(0b1001000000000000,"not in",(0,),9), # snow; state bit 12 OR 15
+			Rule(0b11000000,"in",(192,),8), # high aerosol; state bits 6 AND 7
+			Rule(0b11000000,"in",(0,),7), # climatology aerosol
+			Rule(0b100,"not in",(0,),5), # cloud shadow; state bit 2
+			Rule(0b10000000000,"not in",(0,),4), # internal cloud; state bit 10
+			Rule(0b111000,"in",MOD_CMG_WATER_CLASSES,0),
+		],
+		"Coarse Resolution QA":[
+			Rule(0b11,"in",(3,),6), # flagged uncorrected; qa bits 0 AND 1
+			Rule(0b1110111100,"in",(112,896,952),1), # bad pixels; qa bits (2-5 OR 6-9 == 1110)
+		],
+	},
+	default=10,
+	limits=[
+		Limit("Coarse Resolution View Zenith Angle",0,60/0.01,2), # missing or high view angle
+		Limit("Coarse Resolution Solar Zenith Angle",None,85/0.01,3), # low sun
+	],
+	threshold=7
+)
+
+VNP_CMG_RANK = QaSpec(
+	{
+		"SurfReflect_QF2":[
+			Rule(0b10000,"not in",(0,),8), # high aerosol; qf2 bit 4
+		],
+		"SurfReflect_QF4":[
+			Rule(0b110,"not in",(0,),1), # bad pixels; qf4 bits 1-2
+		],
+		"State_QA":[
+			Rule(0b1000000000000000,"not in",(0,),9), # snow; state bit 15
+			Rule(0b100,"not in",(0,),5), # cloud shadow; state bit 2
+			Rule(0b10000000000,"not in",(0,),4), # internal cloud; state bit 10
+			Rule(0b111000,"in",VNP_CMG_WATER_CLASSES,0),
+		],
+	},
+	default=10,
+	limits=[
+		Limit("SensorZenith",0,60/0.01,2), # missing or high view angle
+		Limit("SolarZenith",None,85/0.01,3), # low sun
+	],
+	threshold=7
+)
+
+## CMG water masks; 1 = water
+MOD_CMG_WATER = QaSpec({"Coarse Resolution State QA":[
+	Rule(0b111000,"not in",MOD_CMG_WATER_CLASSES,0),
+	Rule(0xFFFF,"in",(0,),0), # an empty state word is not water
+]})
+
+VNP_CMG_WATER = QaSpec({"State_QA":[
+	Rule(0b111000,"not in",VNP_CMG_WATER_CLASSES,0),
+]})
+
+CMG_RANK = {"MOD09CMG":MOD_CMG_RANK,"VNP09CMG":VNP_CMG_RANK}
+CMG_WATER = {"MOD09CMG":MOD_CMG_WATER,"VNP09CMG":VNP_CMG_WATER}
+
+
+## masks of the standard and pre-generated VI products, by QA subdataset
+MASK_SPECS = {name:QaSpec({name:rules}) for name, rules in [
+	("250m 16 days VI Quality",VI_QUALITY_RULES),
+	("250m 8 days VI Quality",VI_QUALITY_RULES),
+	("sur_refl_state_500m",STANDARD_RULES),
+	("sur_refl_state_250m",STANDARD_RULES),
+	("SurfReflect_State_500m",STANDARD_RULES),
+]}
+
+
+def maskSpec(stack) -> QaSpec:
+	"""
+	Returns the QaSpec used by octvi.array.mask() for the given
+	Granule (or GranuleWindow)
+	"""
+	suffix, ext = stack.suffix, stack.ext
+	if suffix == "13Q1":
+		return MASK_SPECS["250m 16 days VI Quality"]
+	elif suffix == "13Q4":
+		return MASK_SPECS["250m 8 days VI Quality"]
+	elif suffix == "09CM":
+		if ext == ".hdf":
+			return MOD_CMG_RANK
+		elif ext == ".h5":
+			return VNP_CMG_RANK
+	elif suffix == "09A1":
+		return MASK_SPECS["sur_refl_state_500m"]
+	elif ext == ".hdf":
+		return MASK_SPECS["sur_refl_state_250m"]
+	elif ext == ".h5":
+		return MASK_SPECS["SurfReflect_State_500m"]
+	raise octvi.exceptions.FileTypeError("File must be of format .hdf or .h5")
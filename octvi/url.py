@@ -4,17 +4,564 @@ logging.basicConfig(level=os.environ.get("LOGLEVEL","INFO"))
 log = logging.getLogger(__name__)
 
 ## import modules
-import csv, octvi.exceptions, shutil, ssl, subprocess, sys, urllib
-from datetime import datetime
-from io import StringIO
+import csv, http.client, octvi.cache, octvi.exceptions, random, ssl, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from io import BytesIO, StringIO
 from  octvi.exceptions import UnavailableError
-from urllib.request import urlopen, Request, URLError, HTTPError
+from urllib.parse import urljoin, urlsplit
+from urllib.request import URLError, HTTPError
 
 supported_products = ["MOD09Q1","MOD13Q1","MYD09Q1","MYD13Q1","VNP09H1","MOD09Q1N","MOD13Q4N","MOD09CMG","VNP09CMG","MOD09A1"]
 #app_key = '95A63BCA-39AE-11E8-B469-FEF9569DBFBA'
 
+## DAAC base urls; may be pointed elsewhere (e.g. at octvi.localdaac)
+## with setBaseUrls() or the OCTVI_*_URL environment variables
+LADS_URL = os.environ.get("OCTVI_LADS_URL","https://ladsweb.modaps.eosdis.nasa.gov")
+NRT_URL = os.environ.get("OCTVI_NRT_URL","https://nrt3.modaps.eosdis.nasa.gov")
+LP_URL = os.environ.get("OCTVI_LP_URL","https://e4ftl01.cr.usgs.gov")
 
-def pull(url:str,out_dir=None,file_name_override=None,retries=5) -> str:
+## seconds for which a DAAC listing is trusted
+LISTING_TTL_NRT = 300 # near-real-time products change constantly
+LISTING_TTL_CURRENT = 3600 # the current year is still being filled in
+LISTING_TTL_ARCHIVE = 30*86400 # past years are effectively static
+
+## number of NRT day-of-year listings probed at once
+PROBE_JOBS = 8
+
+## bytes read per chunk when saving a download to disk
+COPY_CHUNK = 1024*1024
+
+_SSL_CONTEXT = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
+_REDIRECT_CODES = (301,302,303,307,308)
+
+
+def setBaseUrls(lads=None,nrt=None,lp=None) -> dict:
+	"""
+	Overrides the base urls of the LADS, LANCE NRT, and LP DAACs
+	used by getUrls(), getDates(), and pull(). Arguments left as
+	None are unchanged. Returns the previous base urls, as a dict
+	that may be passed back to this function to restore them.
+
+	...
+
+	Parameters
+	----------
+
+	lads: str
+		e.g. "https://ladsweb.modaps.eosdis.nasa.gov"
+	nrt: str
+		e.g. "https://nrt3.modaps.eosdis.nasa.gov"
+	lp: str
+		e.g. "https://e4ftl01.cr.usgs.gov"
+	"""
+	global LADS_URL, NRT_URL, LP_URL
+	previous = {"lads":LADS_URL,"nrt":NRT_URL,"lp":LP_URL}
+	if lads is not None:
+		LADS_URL = lads.rstrip("/")
+	if nrt is not None:
+		NRT_URL = nrt.rstrip("/")
+	if lp is not None:
+		LP_URL = lp.rstrip("/")
+	return previous
+
+
+def _isLp(url:str) -> bool:
+	return url.startswith(LP_URL + "/") or (url.split("/")[2] == 'e4ftl01.cr.usgs.gov')
+
+
+class ConnectionPool:
+	"""
+	A thread-safe pool of persistent HTTP(S) connections, keyed
+	by scheme, host, and port. Idle connections are kept alive
+	between requests, so that repeated calls against the same DAAC
+	reuse an open TCP/TLS session instead of performing a fresh
+	handshake for every file and every listing.
+
+	Each request checks a connection out of the pool for its own
+	exclusive use, so a single pool may safely be shared between
+	worker threads.
+
+	...
+
+	Parameters
+	----------
+
+	maxsize: int
+		Maximum number of idle connections kept per host
+	timeout: float
+		Socket timeout, in seconds
+	"""
+
+	def __init__(self,maxsize=16,timeout=120):
+		self.maxsize = maxsize
+		self.timeout = timeout
+		self._lock = threading.Lock()
+		self._idle = {}
+
+	def _connect(self,key):
+		scheme, host, port = key
+		if scheme == "https":
+			return http.client.HTTPSConnection(host,port,timeout=self.timeout,context=_SSL_CONTEXT)
+		elif scheme == "http":
+			return http.client.HTTPConnection(host,port,timeout=self.timeout)
+		else:
+			raise URLError(f"Unsupported url scheme '{scheme}'")
+
+	def _acquire(self,key):
+		"""Returns a (connection,reused) tuple"""
+		with self._lock:
+			idle = self._idle.get(key)
+			if idle:
+				return idle.pop(), True
+		return self._connect(key), False
+
+	def _release(self,key,conn,response):
+		"""Returns conn to the pool if its last response was fully consumed"""
+		if not (response.isclosed() and not response.will_close):
+			conn.close()
+			return
+		with self._lock:
+			idle = self._idle.setdefault(key,[])
+			if len(idle) < self.maxsize:
+				idle.append(conn)
+				return
+		conn.close()
+
+	def _send(self,key,method,path,headers):
+		"""Sends a single request, replacing stale keep-alive connections"""
+		rate_limiter.request()
+		while True:
+			conn, reused = self._acquire(key)
+			try:
+				conn.request(method,path,headers=headers)
+				return conn, conn.getresponse()
+			except (ConnectionError,http.client.BadStatusLine) as e:
+				# the server may have silently dropped an idle connection
+				conn.close()
+				if not reused:
+					raise URLError(e)
+			except OSError as e:
+				conn.close()
+				raise URLError(e)
+			except Exception:
+				conn.close()
+				raise
+
+	@contextmanager
+	def open(self,url:str,headers=None,method="GET",max_redirects=5):
+		"""
+		Context manager which sends a request for {url} and yields the
+		http.client.HTTPResponse. Redirects are followed. When the
+		context exits, the connection is returned to the pool if the
+		response body was read to the end, and closed otherwise.
+
+		Raises urllib.request.HTTPError for status codes >= 400 and
+		urllib.request.URLError for connection failures, matching the
+		behaviour of urllib.request.urlopen().
+		"""
+		headers = dict(headers or {})
+		for i in range(max_redirects + 1):
+			parts = urlsplit(url)
+			key = (parts.scheme, parts.hostname, parts.port)
+			path = parts.path or "/"
+			if parts.query:
+				path += "?" + parts.query
+			conn, response = self._send(key,method,path,headers)
+			if response.status in _REDIRECT_CODES and response.getheader("Location"):
+				response.read()
+				self._release(key,conn,response)
+				url = urljoin(url,response.getheader("Location"))
+				if response.status == 303:
+					method = "GET"
+				continue
+			if response.status >= 400:
+				body = response.read()
+				self._release(key,conn,response)
+				raise HTTPError(url,response.status,response.reason,response.headers,BytesIO(body))
+			break
+		else:
+			raise HTTPError(url,response.status,"Too many redirects",response.headers,None)
+		try:
+			yield response
+		finally:
+			self._release(key,conn,response)
+
+	def clear(self) -> None:
+		"""Closes all idle connections"""
+		with self._lock:
+			idle, self._idle = self._idle, {}
+		for conns in idle.values():
+			for conn in conns:
+				conn.close()
+
+
+## shared by pull(), and therefore by getUrls() and getDates()
+connection_pool = ConnectionPool()
+
+
+class TokenBucket:
+	"""
+	A thread-safe token bucket. Tokens are added continuously at
+	{rate} per second, up to {capacity}; take() blocks until the
+	requested number of tokens is available.
+
+	...
+
+	Parameters
+	----------
+
+	rate: float
+		Tokens added per second
+	capacity: float (optional)
+		Largest number of tokens the bucket can hold. Default is one
+		second's worth of tokens.
+	"""
+
+	def __init__(self,rate:float,capacity=None):
+		self.rate = float(rate)
+		self.capacity = float(capacity) if capacity is not None else max(1.0,self.rate)
+		self._tokens = self.capacity
+		self._last = time.monotonic()
+		self._lock = threading.Lock()
+
+	def take(self,amount=1.0) -> None:
+		"""Blocks until {amount} tokens are available, then removes them"""
+		# requests larger than the bucket are allowed to run it into debt
+		while True:
+			with self._lock:
+				now = time.monotonic()
+				self._tokens = min(self.capacity,self._tokens + (now - self._last) * self.rate)
+				self._last = now
+				if self._tokens >= min(amount,self.capacity):
+					self._tokens -= amount
+					return None
+				wait = (min(amount,self.capacity) - self._tokens) / self.rate
+			time.sleep(wait)
+
+
+class RateLimiter:
+	"""
+	Process-wide limits on the number of requests per second and the
+	number of bytes per second that octvi sends to and receives from
+	the DAACs. Both limits are shared by every thread. A limit of None
+	means unlimited.
+
+	...
+
+	Parameters
+	----------
+
+	requests_per_second: float (optional)
+		Maximum rate at which new requests are sent
+	bytes_per_second: float (optional)
+		Maximum download bandwidth
+	"""
+
+	def __init__(self,requests_per_second=None,bytes_per_second=None):
+		self.configure(requests_per_second,bytes_per_second)
+
+	def configure(self,requests_per_second=None,bytes_per_second=None) -> None:
+		"""Replaces both limits; None removes a limit"""
+		self._requests = TokenBucket(requests_per_second) if requests_per_second else None
+		self._bytes = TokenBucket(bytes_per_second) if bytes_per_second else None
+
+	def request(self) -> None:
+		"""Blocks until another request may be sent"""
+		if self._requests is not None:
+			self._requests.take(1)
+
+	def transfer(self,nbytes:int) -> None:
+		"""Blocks until {nbytes} more bytes may be received"""
+		if (self._bytes is not None) and (nbytes > 0):
+			self._bytes.take(nbytes)
+
+
+## shared by all requests sent through connection_pool; see also the
+## 'max_requests_per_second' and 'max_bytes_per_second' config options
+rate_limiter = RateLimiter()
+
+
+class RetryPolicy:
+	"""
+	Decides whether, and after how long, a failed network call
+	should be tried again.
+
+	Retryable failures (HTTP 408/425/429/5xx, timeouts, dropped or
+	reset connections, and incomplete downloads) are retried with
+	exponential backoff and random jitter, waiting at least as long
+	as any Retry-After header asks. Fatal failures are raised at
+	once: octvi.exceptions.NotFoundError for HTTP 404/410,
+	AuthorizationError for 401/403, and UnavailableError for any
+	other client error. When attempts or time run out, a
+	TransientError is raised.
+
+	...
+
+	Parameters
+	----------
+
+	max_attempts: int
+		Total number of attempts, including the first
+	backoff: float
+		Delay in seconds before the first retry; doubled for each
+		further retry
+	max_backoff: float
+		Upper bound on the computed delay between attempts
+	jitter: float
+		Fraction, between 0 and 1, of each delay that is randomized
+	max_time: float
+		Seconds after which no further attempt is started
+	"""
+
+	RETRYABLE_CODES = (408,425,429,500,502,503,504)
+
+	def __init__(self,max_attempts=6,backoff=1.0,max_backoff=60.0,jitter=0.5,max_time=900.0):
+		self.max_attempts = max(1,int(max_attempts))
+		self.backoff = backoff
+		self.max_backoff = max_backoff
+		self.jitter = jitter
+		self.max_time = max_time
+
+	def withAttempts(self,max_attempts:int) -> "RetryPolicy":
+		"""Returns a copy of this policy allowing max_attempts attempts"""
+		return RetryPolicy(max_attempts,self.backoff,self.max_backoff,self.jitter,self.max_time)
+
+	def isRetryable(self,error:Exception) -> bool:
+		"""Returns whether error is worth another attempt"""
+		if isinstance(error,HTTPError):
+			return (error.code in self.RETRYABLE_CODES) or (error.code >= 500)
+		return isinstance(error,(URLError,http.client.HTTPException,ConnectionError,TimeoutError,octvi.exceptions.IncompleteDownloadError))
+
+	@staticmethod
+	def retryAfter(error:Exception):
+		"""Returns the delay in seconds requested by a Retry-After header, or None"""
+		headers = getattr(error,"headers",None)
+		value = headers.get("Retry-After") if headers is not None else None
+		if not value:
+			return None
+		value = value.strip()
+		if value.isdigit():
+			return float(value)
+		try:
+			return max(0.0,(parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+		except (TypeError, ValueError):
+			return None
+
+	def delay(self,attempt:int,error=None) -> float:
+		"""Returns the number of seconds to wait after failed attempt number {attempt} (from 1)"""
+		base = min(self.max_backoff,self.backoff * (2 ** (attempt - 1)))
+		wait = base * (1 - self.jitter * random.random())
+		requested = self.retryAfter(error) if error is not None else None
+		if requested is not None:
+			wait = max(wait,requested)
+		return wait
+
+	def fatalError(self,error:Exception,description:str) -> Exception:
+		"""Returns the typed exception to raise for a non-retryable error"""
+		if isinstance(error,HTTPError):
+			if error.code in (404,410):
+				return octvi.exceptions.NotFoundError(f"{description}: HTTP {error.code}")
+			elif error.code in (401,403):
+				return octvi.exceptions.AuthorizationError(f"{description}: HTTP {error.code}")
+		return UnavailableError(f"{description}: {error}")
+
+	def call(self,func,*args,description="Request failed",**kwargs):
+		"""
+		Calls func(*args,**kwargs) until it succeeds, a fatal error
+		is raised, or attempts or time run out. Exceptions that are
+		not network failures are passed through unchanged.
+		"""
+		start = time.monotonic()
+		attempt = 0
+		while True:
+			attempt += 1
+			try:
+				return func(*args,**kwargs)
+			except (URLError,http.client.HTTPException,ConnectionError,TimeoutError,octvi.exceptions.IncompleteDownloadError) as e:
+				if not self.isRetryable(e):
+					raise self.fatalError(e,description) from e
+				wait = self.delay(attempt,e)
+				if attempt >= self.max_attempts:
+					raise octvi.exceptions.TransientError(f"{description} after {attempt} attempts: {e}") from e
+				if time.monotonic() - start + wait > self.max_time:
+					raise octvi.exceptions.TransientError(f"{description}; gave up after {time.monotonic() - start:.0f} seconds: {e}") from e
+				log.warning(f"{description} ({e}); retrying in {wait:.1f} s. Remaining attempts: {self.max_attempts - attempt}")
+				time.sleep(wait)
+
+
+## shared by all network calls made through pull()
+retry_policy = RetryPolicy()
+
+
+class HedgePolicy:
+	"""
+	Decides when a slow tile transfer should be duplicated against the
+	other DAAC. A hedged request is started once a transfer has run
+	longer than the {percentile}th percentile of completed transfer
+	times, or if, after {grace} seconds, it is still arriving slower
+	than {min_throughput} bytes per second. Whichever request finishes
+	first is kept.
+
+	The same instance should be shared by all tiles of a run, since
+	it learns typical transfer times as tiles complete.
+
+	...
+
+	Parameters
+	----------
+
+	percentile: float
+		Percentile of completed transfer times after which a hedge
+		is started
+	min_samples: int
+		Number of completed transfers needed before the latency
+		percentile is trusted
+	min_throughput: float (optional)
+		Throughput, in bytes per second, below which a transfer is
+		hedged
+	grace: float
+		Seconds a transfer runs before its throughput is judged
+	interval: float
+		Seconds between checks on a running transfer
+	"""
+
+	def __init__(self,percentile=95,min_samples=5,min_throughput=None,grace=30.0,interval=1.0):
+		self.percentile = percentile
+		self.min_samples = min_samples
+		self.min_throughput = min_throughput
+		self.grace = grace
+		self.interval = interval
+		self._durations = []
+		self._lock = threading.Lock()
+
+	def record(self,seconds:float) -> None:
+		"""Records the duration of a completed transfer"""
+		with self._lock:
+			self._durations.append(seconds)
+
+	def latencyThreshold(self):
+		"""Returns the transfer time after which to hedge, or None if not yet known"""
+		with self._lock:
+			durations = sorted(self._durations)
+		if len(durations) < max(1,self.min_samples):
+			return None
+		index = min(len(durations) - 1,int(round(self.percentile / 100 * (len(durations) - 1))))
+		return durations[index]
+
+	def shouldHedge(self,elapsed:float,received:int) -> bool:
+		"""Returns whether a transfer running for {elapsed} seconds, with {received} bytes so far, should be hedged"""
+		threshold = self.latencyThreshold()
+		if (threshold is not None) and (elapsed > threshold):
+			return True
+		if (self.min_throughput is not None) and (elapsed > self.grace) and (received / elapsed < self.min_throughput):
+			return True
+		return False
+
+
+def _expectedSize(response,offset:int):
+	"""Returns the full size of the remote file, as reported by the server, or None"""
+	if response.status == 206:
+		contentRange = response.getheader("Content-Range","")
+		total = contentRange.split("/")[-1].strip()
+		if total.isdigit():
+			return int(total)
+	else:
+		length = response.getheader("Content-Length")
+		if length is not None and length.isdigit():
+			return int(length)
+	return None
+
+
+def _copy(fh,fd,received:int,progress=None,cancel=None) -> int:
+	"""Copies fh to fd chunk by chunk, reporting progress and honouring cancellation"""
+	while True:
+		if (cancel is not None) and cancel.is_set():
+			raise octvi.exceptions.DownloadCancelledError("Download cancelled")
+		chunk = fh.read(COPY_CHUNK)
+		if not chunk:
+			return received
+		rate_limiter.transfer(len(chunk))
+		fd.write(chunk)
+		received += len(chunk)
+		if progress is not None:
+			progress(received)
+
+
+def _download(url:str,headers:dict,out:str,file_size=None,progress=None,cancel=None) -> str:
+	"""
+	Downloads {url} to {out}, by way of a temporary "{out}.part" file.
+
+	If a partial file is already present, only the missing bytes are
+	requested, using an HTTP Range header. The .part file is moved to
+	{out} only once its size matches {file_size} (or, if that is not
+	known, the size reported by the server); otherwise an
+	IncompleteDownloadError is raised and the partial file is left in
+	place for the next attempt to resume.
+
+	If {progress} is given, it is called with the number of bytes on
+	disk after every chunk. If the threading.Event {cancel} is set, the
+	transfer stops, the partial file is deleted, and a
+	DownloadCancelledError is raised.
+	"""
+	part = out + ".part"
+	offset = os.path.getsize(part) if os.path.exists(part) else 0
+	if (file_size is not None) and (offset > file_size):
+		os.remove(part)
+		offset = 0
+
+	requestHeaders = dict(headers)
+	if offset > 0:
+		requestHeaders['Range'] = f"bytes={offset}-"
+	try:
+		with connection_pool.open(url,requestHeaders) as fh:
+			if fh.status != 206: # server ignored the range; start over
+				offset = 0
+			expected = file_size if file_size is not None else _expectedSize(fh,offset)
+			with open(part,'ab' if offset > 0 else 'wb') as fd:
+				_copy(fh,fd,offset,progress,cancel)
+	except octvi.exceptions.DownloadCancelledError:
+		os.remove(part)
+		raise
+	except HTTPError as e:
+		# range starts at end of file; nothing left to fetch
+		if (e.code == 416) and (file_size is not None) and (offset == file_size):
+			expected = file_size
+		else:
+			raise
+
+	diskSize = os.path.getsize(part)
+	if (expected is not None) and (diskSize != expected):
+		if diskSize > expected:
+			os.remove(part)
+		raise octvi.exceptions.IncompleteDownloadError(f"Pulled {diskSize} of {expected} bytes from {url}")
+	os.replace(part,out)
+	return out
+
+
+def fileName(url:str) -> str:
+	"""
+	Returns the name under which pull() saves the file at {url}:
+	"{product}.{date}.{tile}.{extension}". Both LADS/NRT archive urls
+	and LP DAAC urls are understood.
+	"""
+	url_parts = url.split("/")
+	tile = url_parts[-1].split(".")[2]
+	extension = url_parts[-1].split(".")[-1]
+	if _isLp(url): # .../MOLT/{product}.{collection}/{%Y.%m.%d}/{file}
+		product = url_parts[-3].split(".")[0]
+		date = datetime.strptime(url_parts[-2],"%Y.%m.%d").strftime("%Y-%m-%d")
+	else: # .../allData/{collection}/{product}/{year}/{doy}/{file}
+		product = url_parts[-4]
+		year = url_parts[-3]
+		doy = url_parts[-2]
+		date = datetime.strptime(f"{year}{doy}","%Y%j").strftime("%Y-%m-%d")
+	return f"{product}.{date}.{tile}.{extension}"
+
+
+def pull(url:str,out_dir=None,file_name_override=None,retries=None,file_size=None,policy=None,progress=None,cancel=None) -> str:
 	"""
 	This function attempts to open the data file located at {url}. If
 	{out_dir} is provided, the file is saved to that location. Otherwise,
@@ -37,87 +584,110 @@ def pull(url:str,out_dir=None,file_name_override=None,retries=5) -> str:
 		extract the product, date, and tile of the url, in order to form the
 		name as follows: "{product}.{date}.{tile}.{extension}"
 	retries: int
-		How many times to re-try the download if it fails
+		How many times to re-try the download if it fails. If None (default),
+		the limit set by {policy} is used. Interrupted downloads are resumed
+		from where they left off.
+	file_size: int
+		Expected size of the file in bytes, as listed by getUrls(). If set,
+		the download only counts as complete once the file on disk has
+		exactly this size.
+	policy: RetryPolicy
+		Retry policy governing failed attempts. Default is the shared
+		octvi.url.retry_policy.
+	progress: function (optional)
+		Called with the number of bytes received so far, during downloads
+	cancel: threading.Event (optional)
+		If set while downloading, the transfer is abandoned and an
+		octvi.exceptions.DownloadCancelledError is raised
 	"""
 	# check whether LP or LADS
-	if url.split("/")[2] == 'e4ftl01.cr.usgs.gov':
+	if _isLp(url):
 		lads_or_lp = "LP"
 	else:
 		lads_or_lp = "LADS"
 
 	## building authorization
-	headers = { 'user-agent' : str('tis/download.py_1.0--' + sys.version.replace('\n','').replace('\r','')), 'Authorization' : f'Bearer {octvi.app_key}'}
+	headers = { 'user-agent' : str('tis/download.py_1.0--' + sys.version.replace('\n','').replace('\r',''))}
+	if getattr(octvi,"app_key",None) is not None:
+		headers['Authorization'] = f'Bearer {octvi.app_key}'
 	#headers['User-Agent'] = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_3) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/35.0.1916.47 Safari/537.36'
-	CTX = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
 
 	## if saving to file, generate file name
 	if out_dir is not None:
-		url_parts = url.split("/")#[-1].split(".")
-		tile = url_parts[-1].split(".")[2]
 		if file_name_override is None:
 			# extracting information from URL string
-			product = url_parts[-4]
-			year = url_parts[-3]
-			doy = url_parts[-2]
-			date = datetime.strptime(f"{year}{doy}","%Y%j").strftime("%Y-%m-%d")
-			extension = url_parts[-1].split(".")[-1]
-			# creating output file name
-			out_base = f"{product}.{date}.{tile}.{extension}"
+			out_base = fileName(url)
 		else:
 			out_base = file_name_override
 		out = os.path.join(out_dir,out_base)
 	else:
 		out=None
 
-	#def tryPull(url,out_path):
-		#"""
-		#Attempt to pull url
-		#"""
-		#try:
-			#fh = urlopen(Request(url, headers=headers), context=CTX)
-			#if out_path is None:
-				#return fh.read().decode('utf-8')
-			#else:
-				#with open(out,'wb') as fd:
-					#shutil.copyfileobj(fh, fd)
-				#fh = fd = None # use garbage collection to force cache flush
-		#except Error as e:
-			#if out_path is None:
-				#raise e
-			#log.warning(f"urllib method failed for {url}, trying wget")
-			#try:
-				#log.info("wget64")
-				#subprocess.call(["wget64",url,'--header',f'"Authorization: Bearer {octvi.app_key}"',"-O",out],shell=True)
-				#return out
-			#except FileNotFoundError:
-				#try:
-					#log.info("wget32")
-					#subprocess.call(["wget32",url,'--header',f'"Authorization: Bearer {octvi.app_key}"',"-O",out],shell=True)
-					#return out
-				#except FileNotFoundError:
-					#log.info("wget")
-					#subprocess.call(["wget",url,'--header',f'"Authorization: Bearer {octvi.app_key}"',"-O",out],shell=True)
-					#return out
+	try:
+		file_size = int(file_size)
+	except (TypeError, ValueError):
+		file_size = None
+
+	## serving from granule cache, if enabled
+	cache = octvi.cache.granule_cache
+	if (out is not None) and (cache is not None) and cache.get(url,out,file_size):
+		return out
 
 	## fetching data
-	try:
-		fh = urlopen(Request(url, headers=headers), context=CTX)
+	if policy is None:
+		policy = retry_policy
+	if retries is not None:
+		policy = policy.withAttempts(retries + 1)
+
+	def fetch():
 		if out is None:
-			return fh.read().decode('utf-8')
+			with connection_pool.open(url,headers) as fh:
+				text = fh.read()
+				rate_limiter.transfer(len(text))
+				return text.decode('utf-8')
 		else:
-			with open(out,'wb') as fd:
-				shutil.copyfileobj(fh, fd)
-			fh = fd = None # use garbage collection to force cache flush
-	except HTTPError:
-		if retries<=0:
-			raise UnavailableError(f"Failed to pull data from {url}")
-		else:
-			log.warning(f"HTTPError at {url}; trying again. Remaining retries: {retries}")
-			return pull(url=url,out_dir=out_dir,file_name_override=file_name_override,retries=retries-1)
-	#except URLError as e:
-		#log.exception('Failed to make request')
+			_download(url,headers,out,file_size,progress,cancel)
+			if cache is not None:
+				cache.put(url,out)
+			return out
 
-	return out
+	return policy.call(fetch,description=f"Failed to pull data from {url}")
+
+def listingTtl(product:str,year) -> int:
+	"""
+	Returns how long, in seconds, a directory listing for
+	{product} in {year} may be reused before it is fetched again.
+	"""
+	if product[-1] == "N":
+		return LISTING_TTL_NRT
+	elif int(year) < datetime.now().year:
+		return LISTING_TTL_ARCHIVE
+	else:
+		return LISTING_TTL_CURRENT
+
+def getListing(csvUrl:str,ttl=0) -> list:
+	"""
+	Returns the rows of the DAAC .csv listing at {csvUrl} as a list
+	of dicts. A cached copy is returned instead if it is younger than
+	{ttl} seconds; see octvi.cache.listing_cache.
+
+	...
+
+	Parameters
+	----------
+
+	csvUrl: str
+		Url of a LADS ".csv" listing or NRT "details" csv
+	ttl: float
+		Maximum age, in seconds, of a cached listing that may be reused
+	"""
+	cache = octvi.cache.listing_cache
+	rows = cache.get(csvUrl,ttl) if cache is not None else None
+	if rows is None:
+		rows = [ f for f in csv.DictReader(StringIO(pull(csvUrl)), skipinitialspace=True) ]
+		if cache is not None:
+			cache.put(csvUrl,rows)
+	return rows
 
 def getUrls(product:str,date:str,tiles=None,lads_or_lp="LADS") -> list:
 	"""
@@ -176,19 +746,23 @@ def getUrls(product:str,date:str,tiles=None,lads_or_lp="LADS") -> list:
 	doy = dateObj.strftime("%j").zfill(3)
 
 	## form directory url and get file listing
+	ttl = listingTtl(product,year)
 	try:
 		if nrt:
-			dirUrl = f"https://nrt3.modaps.eosdis.nasa.gov/archive/allData/{collection}/{product}/{year}/{doy}/"
-			csvUrl = f"https://nrt3.modaps.eosdis.nasa.gov/api/v2/content/details/allData/{collection}/{product}/{year}/{doy}/?fields=all&format=csv"
-			dirFiles = [ f for f in csv.DictReader(StringIO(pull(csvUrl)), skipinitialspace=True) ]
+			dirUrl = f"{NRT_URL}/archive/allData/{collection}/{product}/{year}/{doy}/"
+			csvUrl = f"{NRT_URL}/api/v2/content/details/allData/{collection}/{product}/{year}/{doy}/?fields=all&format=csv"
+			dirFiles = getListing(csvUrl,ttl)
 		else:
-			ladsUrl = f"https://ladsweb.modaps.eosdis.nasa.gov/archive/allData/{collection}/{product}/{year}/{doy}/"
-			lpUrl = f"https://e4ftl01.cr.usgs.gov/MOLT/{product}.{collection.zfill(3)}/{dateObj.strftime('%Y.%m.%d')}/"
-			dirFiles = [ f for f in csv.DictReader(StringIO(pull('%s.csv' % ladsUrl)), skipinitialspace=True) ]
+			ladsUrl = f"{LADS_URL}/archive/allData/{collection}/{product}/{year}/{doy}/"
+			lpUrl = f"{LP_URL}/MOLT/{product}.{collection.zfill(3)}/{dateObj.strftime('%Y.%m.%d')}/"
+			# LP file names are read from the (cached) LADS listing
+			dirFiles = getListing('%s.csv' % ladsUrl,ttl)
 			if lads_or_lp == "LADS":
 				dirUrl = ladsUrl
 			elif lads_or_lp == "LP":
 				dirUrl = lpUrl
+	except (octvi.exceptions.AuthorizationError, octvi.exceptions.NotFoundError, octvi.exceptions.TransientError):
+		raise # let callers tell a refused request or a missing date from other failures
 	except UnavailableError:
 		raise UnavailableError(f"No listed data for requested product {product} on date {date}")
 
@@ -202,7 +776,7 @@ def getUrls(product:str,date:str,tiles=None,lads_or_lp="LADS") -> list:
 			fTile = fPath.split("/")[-1].split(".")[2]
 			if fPath.split(".")[-1] == "met": # skip metadata files for NRT
 				continue
-			fullUrl = "https://nrt3.modaps.eosdis.nasa.gov" + fPath
+			fullUrl = NRT_URL + fPath
 			fSize = f['size']
 		else:
 			fName = f["name"]
@@ -222,7 +796,96 @@ def getUrls(product:str,date:str,tiles=None,lads_or_lp="LADS") -> list:
 
 	return outList
 
-def getDates(product:str,date:str) -> list:
+def _collection(product:str) -> str:
+	"""Returns the archive collection number of {product}"""
+	if product[:3] == "VNP":
+		return "5000"
+	else:
+		return "6"
+
+def _listedDoys(product:str,year:str,collection:str,nrt=False) -> list:
+	"""Returns the day-of-year directories listed for {product} in {year}"""
+	ttl = listingTtl(product,year)
+	try:
+		if nrt:
+			csvUrl = f"{NRT_URL}/api/v2/content/details/allData/{collection}/{product}/{year}/?fields=all&format=csv"
+			dirFiles = getListing(csvUrl,ttl)
+		else:
+			dirUrl = f"{LADS_URL}/archive/allData/{collection}/{product}/{year}/"
+			dirFiles = getListing('%s.csv' % dirUrl,ttl)
+	except octvi.exceptions.NotFoundError: # no directory for the year
+		return []
+	return [d['name'] for d in dirFiles]
+
+def _doyHasFiles(product:str,year:str,doy:str,collection:str) -> bool:
+	"""Returns whether the NRT listing for {product} on {year}/{doy} is non-empty"""
+	doyCsvUrl = f"{NRT_URL}/api/v2/content/details/allData/{collection}/{product}/{year}/{doy}/?fields=all&format=csv"
+	try:
+		return len(getListing(doyCsvUrl,listingTtl(product,year))) > 0
+	except octvi.exceptions.NotFoundError: # listed, but since removed
+		return False
+
+def _doysFromYear(product:str,year:str,collection:str,nrt=False,jobs=PROBE_JOBS) -> list:
+	"""
+	Given product and year, returns valid days of year. NRT
+	products may list empty day-of-year directories, so each of
+	those is probed, {jobs} at a time.
+	"""
+	doys = _listedDoys(product,year,collection,nrt)
+	if (not nrt) or (len(doys) == 0):
+		return doys
+	with ThreadPoolExecutor(max_workers=max(1,int(jobs))) as executor:
+		hasFiles = list(executor.map(lambda doy: _doyHasFiles(product,year,doy,collection),doys))
+	return [doy for doy, ok in zip(doys,hasFiles) if ok]
+
+def getLatestDate(product:str,jobs=PROBE_JOBS):
+	"""
+	This function returns the most recent date, formatted as
+	"%Y-%m-%d", for which imagery of the given product is available,
+	or None if there is none in the current or previous year.
+
+	The latest day-of-year directory listed for the current year is
+	returned, or if there is none, that of the previous year. NRT
+	products may list empty directories, so for those, each day's
+	listing is probed, latest first and {jobs} at a time, until one
+	with files is found.
+
+	Listings that cannot be fetched raise an UnavailableError (e.g.
+	TransientError), rather than being taken to mean no data.
+
+	...
+
+	Parameters
+	----------
+
+	product:str
+		String name of desired imagery product
+	jobs:int
+		Number of NRT day-of-year listings to probe concurrently
+	"""
+	if product not in supported_products:
+		raise octvi.exceptions.UnsupportedError(f"Product '{product}' is not currently supported. See octvi.supported_products for list of supported products.")
+
+	nrt = (product[-1] == "N")
+	collection = _collection(product)
+	jobs = max(1,int(jobs))
+	thisYear = datetime.now().year
+	for year in (str(thisYear), str(thisYear - 1)):
+		doys = sorted(_listedDoys(product,year,collection,nrt),reverse=True)
+		if not nrt:
+			if doys:
+				return datetime.strptime(f"{year}-{doys[0]}","%Y-%j").strftime("%Y-%m-%d")
+			continue
+		with ThreadPoolExecutor(max_workers=jobs) as executor:
+			for i in range(0,len(doys),jobs):
+				batch = doys[i:i+jobs]
+				hasFiles = list(executor.map(lambda doy: _doyHasFiles(product,year,doy,collection),batch))
+				for doy, ok in zip(batch,hasFiles):
+					if ok:
+						return datetime.strptime(f"{year}-{doy}","%Y-%j").strftime("%Y-%m-%d")
+	return None
+
+def getDates(product:str,date:str,jobs=PROBE_JOBS) -> list:
 	"""
 	This function returns all available imagery dates for the
 	given product x date-range combination. If passed a single date,
@@ -242,45 +905,21 @@ def getDates(product:str,date:str) -> list:
 		those dates for which there is imagery available. If a full
 		Y-m-d is passed, returns a list containing that date if there
 		is imagery available, or an empty list if not.
+	jobs:int
+		Number of NRT day-of-year listings to probe concurrently
 	"""
 
-	def doysFromYear(product, year,collection,nrt=False) -> list:
-		"""Given product and year, returns valid days of year"""
-		outList = []
-
-		## get and parse CSV
-		try:
-			if nrt:
-				csvUrl = f"https://nrt3.modaps.eosdis.nasa.gov/api/v2/content/details/allData/{collection}/{product}/{year}/?fields=all&format=csv"
-				dirFiles = [ f for f in csv.DictReader(StringIO(pull(csvUrl)), skipinitialspace=True) ]
-			else:
-				dirUrl = f"https://ladsweb.modaps.eosdis.nasa.gov/archive/allData/{collection}/{product}/{year}/"
-				dirFiles = [ f for f in csv.DictReader(StringIO(pull('%s.csv' % dirUrl)), skipinitialspace=True) ]
-		except UnavailableError:
-			return []
-
-		## extract valid days of year fro CSV
-		for d in dirFiles:
-			doy = d['name']
-			if nrt:
-				doyCsvUrl = f"https://nrt3.modaps.eosdis.nasa.gov/api/v2/content/details/allData/{collection}/{product}/{year}/{doy}/?fields=all&format=csv"
-				doyFiles = [ f for f in csv.DictReader(StringIO(pull(doyCsvUrl)), skipinitialspace=True) ]
-				if len(doyFiles) == 0:
-					continue
-			outList.append(doy)
-
-		## return list
-		return outList
-
 	def checkDoy(product,year,doy,collection,nrt=False) -> bool:
 		"""Returns whether there is any data for a given product on a given date"""
 
-		doyList = doysFromYear(product,year,collection,nrt)
+		doyList = _listedDoys(product,year,collection,nrt)
 
-		if doy in doyList:
-			return True
-		else:
+		if doy not in doyList:
 			return False
+		elif nrt: # only this day's listing needs probing
+			return _doyHasFiles(product,year,doy,collection)
+		else:
+			return True
 
 	## confirm that product is valid
 	if product not in supported_products:
@@ -290,10 +929,10 @@ def getDates(product:str,date:str) -> list:
 	prefix = product[:3]
 	if product[-1] == "N":
 		nrt = True
-		dirUrl = "https://nrt3.modaps.eosdis.nasa.gov/archive/allData/"
+		dirUrl = f"{NRT_URL}/archive/allData/"
 	else:
 		nrt = False
-		dirUrl = "https://ladsweb.modaps.eosdis.nasa.gov/archive/allData/"
+		dirUrl = f"{LADS_URL}/archive/allData/"
 
 	## assign correct collection number
 	if prefix == "VNP":
@@ -316,7 +955,7 @@ def getDates(product:str,date:str) -> list:
 			dateObj = datetime.strptime(date,"%Y-%m")
 			year = dateObj.strftime("%Y")
 			month = dateObj.strftime("%m")
-			validDoys = doysFromYear(product,year,collection,nrt)
+			validDoys = _doysFromYear(product,year,collection,nrt,jobs)
 			for doy in validDoys:
 				if datetime.strptime(f"{year}-{doy}","%Y-%j").strftime("%m") == month:
 					doyList.append(doy)
@@ -324,7 +963,7 @@ def getDates(product:str,date:str) -> list:
 			try:
 				dateObj = datetime.strptime(date,"%Y")
 				year = dateObj.strftime("%Y")
-				doyList= doysFromYear(product,year,collection,nrt)
+				doyList= _doysFromYear(product,year,collection,nrt,jobs)
 			except ValueError:
 				log.error(r"Date must be one of %Y-%m-%d, %Y-%m, %Y")
 				return []
@@ -0,0 +1,16 @@
+import octvi
+
+_previousPolicies = []
+
+def fastRetries():
+	"""
+	Makes DAAC requests fail on the first error, rather than
+	backing off for minutes when the DAACs cannot be reached.
+	Used as setUpModule by test modules that touch the network.
+	"""
+	_previousPolicies.append(octvi.url.retry_policy)
+	octvi.url.retry_policy = octvi.url.RetryPolicy(max_attempts=1)
+
+def restoreRetries():
+	"""Undoes fastRetries(); used as tearDownModule"""
+	octvi.url.retry_policy = _previousPolicies.pop()
@@ -1,5 +1,7 @@
-from unittest import TestCase
+from unittest import TestCase, mock
 import numpy as np
+import os, shutil, tempfile
+import gdal
 import octvi
 
 class TestCalcNdvi(TestCase):
@@ -13,9 +15,116 @@ class TestCalcNdvi(TestCase):
 		nir_array = np.array([-.1])
 		ndvi_array = octvi.array.calcNdvi(red_array,nir_array)
 		self.assertEqual(ndvi_array,np.array(-3000))
+	def test_int16Output(self):
+		red_array = np.array([[1000,0,-28672]],dtype=np.int16)
+		nir_array = np.array([[3000,0,-28672]],dtype=np.int16)
+		ndvi_array = octvi.array.calcNdvi(red_array,nir_array)
+		self.assertEqual(ndvi_array.dtype,np.int16)
+		self.assertEqual(ndvi_array.tolist(),[[5000,-3000,0]])
+	def test_outBuffer(self):
+		out = np.zeros(2,dtype=np.int32)
+		result = octvi.array.calcNdvi(np.array([1,-101]),np.array([3,100]),out=out)
+		self.assertIs(result,out)
+		self.assertEqual(out.tolist(),[5000,-2010000])
+
+class TestCalcGcvi(TestCase):
+	def test_saturatesToDtype(self):
+		gcvi_array = octvi.array.calcGcvi(np.array([1000,1,0],dtype=np.int16),np.array([3000,8000,10],dtype=np.int16))
+		self.assertEqual(gcvi_array.tolist(),[20000,32767,-3000])
+
+class TestIterWindows(TestCase):
+	def test_windowsCoverRaster(self):
+		windows = list(octvi.array.iterWindows(50,103,20))
+		self.assertEqual(len(windows),6)
+		self.assertEqual(windows[0],(0,0,50,20))
+		self.assertEqual(windows[-1],(0,100,50,3))
+		self.assertEqual(sum(w[3] for w in windows),103)
 
 class TestMask(TestCase):
 	pass
 
 class TestToRaster(TestCase):
-	pass
\ No newline at end of file
+	pass
+
+class TestTileIndex(TestCase):
+	def test_parsesName(self):
+		self.assertEqual(octvi.array.tileIndex("/data/MOD09Q1.A2019001.h08v05.006.2019010204213.hdf"),(8,5))
+
+	def test_noTile(self):
+		customError = False
+		try:
+			octvi.array.tileIndex("MOD09CMG.A2019001.006.2019010204213.hdf")
+		except octvi.exceptions.UnsupportedError:
+			customError = True
+		self.assertTrue(customError)
+
+class TestSaveMosaic(TestCase):
+	def setUp(self):
+		self.tempDir = tempfile.mkdtemp()
+		rows, cols = np.indices((384,512))
+		self.array = (((rows + cols) % 2) * 1000).astype(np.int16) # averaging would give 500
+		self.source = gdal.GetDriverByName("MEM").Create("",512,384,1,gdal.GDT_Int16)
+		self.source.SetGeoTransform((0.0,250.0,0.0,0.0,0.0,-250.0))
+		self.source.SetProjection(octvi.array.SINUSOIDAL_WKT)
+		self.source.GetRasterBand(1).WriteArray(self.array)
+	def tearDown(self):
+		self.source = None
+		shutil.rmtree(self.tempDir)
+
+	def checkMosaic(self,path):
+		ds = gdal.Open(path)
+		band = ds.GetRasterBand(1)
+		self.assertEqual(band.GetNoDataValue(),-3000)
+		self.assertTrue(np.array_equal(band.ReadAsArray(),self.array))
+		self.assertGreater(band.GetOverviewCount(),0)
+		self.assertTrue(np.isin(band.GetOverview(0).ReadAsArray(),[0,1000]).all())
+		ds = None
+
+	def test_written(self):
+		self.checkMosaic(octvi.array.saveMosaic(self.source,os.path.join(self.tempDir,"mosaic.tif")))
+
+	def test_gtiffFallback(self):
+		# GDAL before 3.6 has no COG overview count
+		with mock.patch.object(gdal,"VersionInfo",return_value="3050000"):
+			path = octvi.array.saveMosaic(self.source,os.path.join(self.tempDir,"mosaic.tif"))
+		self.checkMosaic(path)
+
+class TestMosaicWriter(TestCase):
+	def setUp(self):
+		self.tempDir = tempfile.mkdtemp()
+		west, south, east, north = octvi.array.MOSAIC_BOUNDS
+		pixelSize = (east - west) / 36 / 16 # 16-pixel tiles
+		self.georeference = ((west,pixelSize,0.0,north,0.0,-pixelSize),octvi.array.SINUSOIDAL_WKT)
+	def tearDown(self):
+		for f in os.listdir(self.tempDir):
+			os.remove(os.path.join(self.tempDir,f))
+		os.rmdir(self.tempDir)
+
+	def test_tilesPlaced(self):
+		writer = octvi.array.MosaicWriter(os.path.join(self.tempDir,"mosaic.tif"),model_file=self.georeference)
+		tile = np.arange(256,dtype=np.int16).reshape(16,16)
+		writer.write("MOD09Q1.A2019001.h02v01.006.0.hdf",tile)
+		writer.write("MOD09Q1.A2019001.h35v14.006.0.hdf",tile[:8],0,0)
+		writer.write("MOD09Q1.A2019001.h35v14.006.0.hdf",tile[8:],0,8)
+		writer.write("MOD09Q1.A2019001.h10v00.006.0.hdf",tile) # outside of the mosaic
+		ds = gdal.Open(writer.close())
+		self.assertEqual((ds.RasterXSize,ds.RasterYSize),(576,224))
+		self.assertEqual(ds.GetRasterBand(1).GetNoDataValue(),-3000)
+		self.assertGreater(ds.GetRasterBand(1).GetOverviewCount(),0)
+		arr = ds.ReadAsArray()
+		self.assertTrue(np.array_equal(arr[0:16,32:48],tile))
+		self.assertTrue(np.array_equal(arr[208:224,560:576],tile))
+		self.assertEqual(arr[16:208,:].max(),-3000)
+		ds = None
+
+	def test_stripesOfWholeBlocks(self):
+		writer = octvi.array.MosaicWriter(os.path.join(self.tempDir,"mosaic.tif"),model_file=self.georeference)
+		self.assertEqual(writer.stripeRows("MOD09Q1.A2019001.h02v01.006.0.hdf",5),16)
+		self.assertEqual(writer.stripeRows("MOD09Q1.A2019001.h02v01.006.0.hdf",40),32)
+		writer.abort()
+
+	def test_noTilesInside(self):
+		writer = octvi.array.MosaicWriter(os.path.join(self.tempDir,"mosaic.tif"),model_file=self.georeference)
+		writer.write("MOD09Q1.A2019001.h10v00.006.0.hdf",np.zeros((16,16),dtype=np.int16))
+		self.assertIsNone(writer.close())
+		self.assertFalse(os.path.exists(os.path.join(self.tempDir,"mosaic.tif")))
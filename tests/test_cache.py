@@ -0,0 +1,124 @@
+from unittest import TestCase
+import numpy as np
+import octvi, os, shutil, tempfile, time
+
+class TestGranuleKey(TestCase):
+
+	def test_tiledGranule(self):
+		key = octvi.cache.granuleKey("https://ladsweb.modaps.eosdis.nasa.gov/archive/allData/6/MOD09Q1/2019/001/MOD09Q1.A2019001.h00v08.006.2019010204213.hdf")
+		self.assertEqual(key,"MOD09Q1.A2019001.h00v08.006.hdf")
+
+	def test_cmgGranule(self):
+		key = octvi.cache.granuleKey("MOD09CMG.A2019001.006.2019003023418.hdf")
+		self.assertEqual(key,"MOD09CMG.A2019001.global.006.hdf")
+
+	def test_unparseable(self):
+		self.assertIsNone(octvi.cache.granuleKey("https://example.com/listing.csv"))
+
+class TestGranuleCache(TestCase):
+	def setUp(self):
+		self.tempDir = tempfile.mkdtemp()
+		self.cache = octvi.cache.GranuleCache(os.path.join(self.tempDir,"cache"),max_bytes=250)
+	def tearDown(self):
+		shutil.rmtree(self.tempDir)
+
+	def writeGranule(self,name,size=100):
+		path = os.path.join(self.tempDir,name)
+		with open(path,'wb') as wf:
+			wf.write(os.urandom(size))
+		return path
+
+	def test_putAndGet(self):
+		url = "MOD09Q1.A2019001.h00v08.006.2019010204213.hdf"
+		src = self.writeGranule(url)
+		self.cache.put(url,src)
+		out = os.path.join(self.tempDir,"out.hdf")
+		self.assertTrue(self.cache.get(url,out))
+		with open(src,'rb') as a, open(out,'rb') as b:
+			self.assertEqual(a.read(),b.read())
+
+	def test_writesDoNotReachCache(self):
+		url = "MOD09Q1.A2019001.h00v08.006.2019010204213.hdf"
+		src = self.writeGranule(url)
+		self.cache.put(url,src)
+		out = os.path.join(self.tempDir,"out.hdf")
+		self.cache.get(url,out)
+		for path in (src, out):
+			with open(path,'r+b') as wf:
+				wf.write(b"\0" * 10)
+		with open(src,'rb') as rf:
+			written = rf.read()
+		self.assertTrue(self.cache.get(url,os.path.join(self.tempDir,"again.hdf")))
+		with open(os.path.join(self.tempDir,"again.hdf"),'rb') as rf:
+			self.assertNotEqual(rf.read(),written)
+
+	def test_sizeMismatchIsMiss(self):
+		url = "MOD09Q1.A2019001.h00v08.006.2019010204213.hdf"
+		self.cache.put(url,self.writeGranule(url))
+		self.assertFalse(self.cache.get(url,os.path.join(self.tempDir,"out.hdf"),file_size=99))
+
+	def test_lruEviction(self):
+		urls = [f"MOD09Q1.A2019001.h0{i}v08.006.2019010204213.hdf" for i in range(3)]
+		for url in urls[:2]:
+			self.cache.put(url,self.writeGranule(url))
+			time.sleep(0.01)
+		# touch the oldest granule so that the second one is evicted instead
+		self.assertTrue(self.cache.get(urls[0],os.path.join(self.tempDir,"out.hdf")))
+		time.sleep(0.01)
+		self.cache.put(urls[2],self.writeGranule(urls[2]))
+		self.assertTrue(self.cache.size() <= 250)
+		self.assertTrue(self.cache.get(urls[0],os.path.join(self.tempDir,"out0.hdf")))
+		self.assertFalse(self.cache.get(urls[1],os.path.join(self.tempDir,"out1.hdf")))
+
+class TestListingCache(TestCase):
+	def setUp(self):
+		self.tempDir = tempfile.mkdtemp()
+	def tearDown(self):
+		shutil.rmtree(self.tempDir)
+
+	def test_freshAndExpired(self):
+		cache = octvi.cache.ListingCache()
+		cache.put("https://example.com/.csv",[{"name":"001"}])
+		self.assertEqual(cache.get("https://example.com/.csv",60),[{"name":"001"}])
+		self.assertIsNone(cache.get("https://example.com/.csv",-1))
+		self.assertIsNone(cache.get("https://example.com/other.csv",60))
+
+	def test_persistedToDisk(self):
+		octvi.cache.ListingCache(self.tempDir).put("https://example.com/.csv",[{"name":"001"}])
+		cache = octvi.cache.ListingCache(self.tempDir)
+		self.assertEqual(cache.get("https://example.com/.csv",60),[{"name":"001"}])
+
+class TestDayStore(TestCase):
+	def setUp(self):
+		self.tempDir = tempfile.mkdtemp()
+		self.store = octvi.cache.DayStore(os.path.join(self.tempDir,"days"),max_bytes=10**6)
+		self.arrays = (np.array([[10,8]],dtype=np.uint8),np.array([[100,200]],dtype=np.int16),np.array([[4000,-3000]]),np.array([[0,1]],dtype=np.uint8))
+		self.georeference = ((-180.0,0.05,0.0,90.0,0.0,-0.05),"")
+	def tearDown(self):
+		shutil.rmtree(self.tempDir)
+
+	def test_putAndGet(self):
+		self.store.put("MOD09CMG","2019-01-01","NDVI",self.arrays,self.georeference)
+		arrays, georeference = self.store.get("MOD09CMG","2019-01-01","NDVI")
+		for stored, original in zip(arrays,self.arrays):
+			self.assertEqual(stored.dtype,original.dtype)
+			self.assertTrue(np.array_equal(stored,original))
+		self.assertEqual(georeference,self.georeference)
+
+	def test_keyedByVi(self):
+		self.store.put("MOD09CMG","2019-01-01","NDVI",self.arrays,self.georeference)
+		self.assertIsNone(self.store.get("MOD09CMG","2019-01-01","GCVI"))
+		self.assertIsNone(self.store.get("MOD09CMG","2019-01-02","NDVI"))
+
+	def test_lruEviction(self):
+		self.store.put("MOD09CMG","2019-01-01","NDVI",self.arrays,self.georeference)
+		self.store.max_bytes = self.store.size()
+		time.sleep(0.01)
+		self.store.put("MOD09CMG","2019-01-02","NDVI",self.arrays,self.georeference)
+		self.assertIsNone(self.store.get("MOD09CMG","2019-01-01","NDVI"))
+		self.assertIsNotNone(self.store.get("MOD09CMG","2019-01-02","NDVI"))
+
+	def test_disableDayStore(self):
+		octvi.cache.enableDayStore(os.path.join(self.tempDir,"enabled"))
+		octvi.cache.disableDayStore()
+		self.assertIsNone(octvi.cache.day_store)
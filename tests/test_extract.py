@@ -1,7 +1,9 @@
 from unittest import TestCase
 import numpy as np
-import os
+import os, shutil, tempfile
+import gdal, h5py
 import octvi
+from tests import fastRetries as setUpModule, restoreRetries as tearDownModule
 
 def downloadExampleFile():
 	return octvi.url.pull(octvi.url.getUrls("MOD09CMG","2019-01-01")[0][0],os.path.dirname(__file__))
@@ -30,6 +32,92 @@ class TestDatasetToPath(TestCase):
 		pathName = octvi.extract.datasetToPath(self.stack,dsn)
 		self.assertIsInstance(pathName,str)
 
+class TestGranule(TestCase):
+	def setUp(self):
+		self.stack = downloadExampleFile()
+	def tearDown(self):
+		os.remove(self.stack)
+
+	def test_matchesPathFunctions(self):
+		with octvi.extract.Granule(self.stack) as granule:
+			self.assertEqual(granule.datasetNames(),octvi.extract.getDatasetNames(self.stack))
+			dsn = granule.datasetNames()[0]
+			self.assertEqual(granule.datasetPath(dsn),octvi.extract.datasetToPath(self.stack,dsn))
+			self.assertTrue(np.array_equal(granule.read(dsn),octvi.extract.datasetToArray(self.stack,dsn)))
+
+	def test_handleReused(self):
+		granule = octvi.extract.Granule(self.stack)
+		dsn = granule.datasetNames()[0]
+		self.assertIs(granule.dataset(dsn),granule.dataset(dsn))
+		self.assertIs(octvi.extract.openGranule(granule),granule)
+
+	def test_missingDataset(self):
+		customError = False
+		try:
+			octvi.extract.Granule(self.stack).datasetPath("not a dataset")
+		except octvi.exceptions.DatasetNotFoundError:
+			customError = True
+		self.assertTrue(customError)
+
+class TestReadPlan(TestCase):
+	def setUp(self):
+		self.stack = downloadExampleFile()
+	def tearDown(self):
+		os.remove(self.stack)
+
+	def test_planCoversViAndMask(self):
+		plan = octvi.extract.readPlan(self.stack,"NDVI")
+		self.assertIn("Coarse Resolution Surface Reflectance Band 1",plan)
+		self.assertIn("Coarse Resolution State QA",plan)
+		self.assertEqual(len(plan),len(set(plan)))
+
+	def test_loadedArraysShared(self):
+		granule = octvi.extract.Granule(self.stack)
+		granule.load(octvi.extract.readPlan(granule,"NDVI"))
+		arr = granule.read("Coarse Resolution State QA")
+		self.assertIs(arr,granule.read("Coarse Resolution State QA"))
+		self.assertFalse(arr.flags.writeable)
+		granule.release()
+		self.assertIsNot(arr,granule.read("Coarse Resolution State QA"))
+
+	def test_unsupportedVi(self):
+		customError = False
+		try:
+			octvi.extract.readPlan(self.stack,"NDWI")
+		except octvi.exceptions.UnsupportedError:
+			customError = True
+		self.assertTrue(customError)
+
+class TestH5Granule(TestCase):
+	def setUp(self):
+		self.tempDir = tempfile.mkdtemp()
+		self.stack = os.path.join(self.tempDir,"VNP09H1.A2019001.h10v05.001.2019010000000.h5")
+		with h5py.File(self.stack,'w') as f:
+			metadata = "GROUP=GridStructure\n\tUpperLeftPointMtrs=(-7783653.637667,4447802.078667)\nEND_GROUP=GridStructure"
+			f.create_dataset("HDFEOS INFORMATION/StructMetadata.0",data=np.bytes_(metadata))
+			for name in ("SurfReflect_I1","SurfReflect_I2"):
+				f.create_dataset(f"HDFEOS/GRIDS/VNP_Grid_1km_L3_2d/Data Fields/{name}",data=np.arange(64*48,dtype=np.int16).reshape(64,48),chunks=(16,48))
+	def tearDown(self):
+		shutil.rmtree(self.tempDir)
+
+	def test_openedForH5(self):
+		with octvi.extract.openGranule(self.stack) as granule:
+			self.assertIsInstance(granule,octvi.extract.H5Granule)
+			self.assertEqual(granule.datasetNames(),["SurfReflect_I1","SurfReflect_I2"])
+			self.assertEqual(granule.shape("SurfReflect_I1"),(64,48))
+			self.assertEqual(granule.storageRows("SurfReflect_I1"),16)
+
+	def test_windowedRead(self):
+		with octvi.extract.openGranule(self.stack) as granule:
+			full = granule.read("SurfReflect_I2")
+			self.assertTrue(np.array_equal(granule.read("SurfReflect_I2",(4,8,10,16)),full[8:24,4:14]))
+
+	def test_georeference(self):
+		with octvi.extract.openGranule(self.stack) as granule:
+			geoTransform, projection = granule.georeference()
+		self.assertEqual(geoTransform,(-7783653.637667,463.3127165,0.0,4447802.078667,0.0,-463.3127165))
+		self.assertEqual(projection,octvi.array.SINUSOIDAL_WKT)
+
 class TestDatasetToArray(TestCase):
 	def setUp(self):
 		self.stack = downloadExampleFile()
@@ -48,6 +136,23 @@ class TestNdviToArray(TestCase):
 	def tearDown(self):
 		os.remove(self.stack)
 
+class TestVisToRasters(TestCase):
+	def setUp(self):
+		self.stack = downloadExampleFile()
+		self.outputs = []
+	def tearDown(self):
+		os.remove(self.stack)
+		for f in self.outputs:
+			os.remove(f)
+
+	def test_matchesSingleIndex(self):
+		vis = ["NDVI","GCVI"]
+		multi = octvi.extract.visToRasters(self.stack,vis,[self.stack.replace(".hdf",f".{vi}.multi.tif") for vi in vis],block_bytes=2**24)
+		single = [octvi.extract.viToRaster(self.stack,self.stack.replace(".hdf",f".{vi}.tif"),vi) for vi in vis]
+		self.outputs = multi + single
+		for a, b in zip(multi,single):
+			self.assertTrue(np.array_equal(gdal.Open(a).ReadAsArray(),gdal.Open(b).ReadAsArray()))
+
 class TestNdviToRaster(TestCase):
 	def setUp(self):
 		self.stack = downloadExampleFile()
@@ -76,4 +181,86 @@ class TestCmgBestNdviPixels(TestCase):
 	def setUp(self):
 		self.stack = downloadExampleFile()
 	def tearDown(self):
-		os.remove(self.stack)
\ No newline at end of file
+		os.remove(self.stack)
+
+class TestCmgCompositor(TestCase):
+	def composite(self,days,snow_mask=False):
+		compositor = octvi.extract.CmgCompositor(snow_mask=snow_mask)
+		for rank, vang, vi in days:
+			compositor.addDayArrays(np.array(rank,dtype=np.uint8),np.array(vang,dtype=np.int16),np.array(vi),np.zeros(len(vi),dtype=np.uint8))
+		return compositor.finalize().tolist()
+
+	def test_bestRankWins(self):
+		self.assertEqual(self.composite([([10,8],[100,100],[1,1]),([9,10],[50,500],[2,2])]),[1,2])
+
+	def test_lowestViewAngleWins(self):
+		self.assertEqual(self.composite([([10,10],[100,300],[1,1]),([10,10],[200,200],[2,2]),([10,10],[100,900],[3,3])]),[3,2])
+
+	def test_lowRanksMasked(self):
+		self.assertEqual(self.composite([([7,9],[100,100],[1,1])],snow_mask=True),[-3000,-3000])
+
+	def test_nodataNotChosen(self):
+		self.assertEqual(self.composite([([10],[100],[1]),([10],[50],[-3000])]),[1])
+
+	def test_matchesBestViPixels(self):
+		# few distinct ranks and view angles, so that keys tie often; view angles
+		# of 9998 and 9999 exercise the rule for lower-ranked days
+		rng = np.random.default_rng(0)
+		days = [(rng.choice([0,2,8,9,10],(60,60)).astype(np.uint8),rng.choice([0,100,100,500,9998,9999],(60,60)).astype(np.int16),rng.choice([-3000,1000,2000,3000,4000],(60,60)).astype(np.int16),(rng.random((60,60)) < 0.02).astype(np.uint8)) for d in range(12)]
+		for snow_mask in (False, True):
+			compositor = octvi.extract.CmgCompositor(snow_mask=snow_mask)
+			for day in days:
+				compositor.addDayArrays(*[a.copy() for a in day])
+			best = octvi.extract._bestViPixels(([a.copy() for a in day] for day in days),len(days),snow_mask)
+			self.assertTrue(np.array_equal(compositor.finalize(),best))
+
+class TestCmgSyntheticDays(TestCase):
+	def setUp(self):
+		self.tempDir = tempfile.mkdtemp()
+		self.stacks = []
+		rng = np.random.default_rng(1)
+		fields = "HDFEOS/GRIDS/VIIRS_Grid_BRDF/Data Fields"
+		for d in range(1,7):
+			stack = os.path.join(self.tempDir,f"VNP09CMG.A201900{d}.001.2019010000000.h5")
+			with h5py.File(stack,'w') as f:
+				metadata = "GROUP=GridStructure\n\tUpperLeftPointMtrs=(-180000000.000000,90000000.000000)\nEND_GROUP=GridStructure"
+				f.create_dataset("HDFEOS INFORMATION/StructMetadata.0",data=np.bytes_(metadata))
+				for name in ("SurfReflect_I1","SurfReflect_I2","SurfReflect_M4"):
+					f.create_dataset(f"{fields}/{name}",data=rng.integers(-100,8000,(40,30)).astype(np.int16))
+				f.create_dataset(f"{fields}/SurfReflect_QF2",data=rng.choice([0,16],(40,30)).astype(np.uint8))
+				f.create_dataset(f"{fields}/SurfReflect_QF4",data=rng.choice([0,0,0,2],(40,30)).astype(np.uint8))
+				f.create_dataset(f"{fields}/State_QA",data=rng.choice([0,4,8,16,1024,32768],(40,30)).astype(np.uint16))
+				f.create_dataset(f"{fields}/SensorZenith",data=rng.choice([0,100,100,2500,7000],(40,30)).astype(np.int16))
+				f.create_dataset(f"{fields}/SolarZenith",data=rng.choice([1000,9000],(40,30)).astype(np.int16))
+			self.stacks.append(stack)
+	def tearDown(self):
+		shutil.rmtree(self.tempDir)
+
+	def test_compositesAgree(self):
+		serial = octvi.extract.cmgBestViPixels(self.stacks,product="VNP09CMG")
+		compositor = octvi.extract.CmgCompositor(product="VNP09CMG")
+		for stack in self.stacks:
+			compositor.addDay(stack)
+		parallel = octvi.extract.cmgCompositeStripes(self.stacks,product="VNP09CMG",jobs=2)
+		self.assertGreater((serial != -3000).sum(),0)
+		self.assertTrue(np.array_equal(compositor.finalize(),serial))
+		self.assertTrue(np.array_equal(parallel,serial))
+
+	def test_severalIndices(self):
+		together = octvi.extract.cmgDayArrays(self.stacks[0],["NDVI","GCVI"],"VNP09CMG")
+		for index, arrays in zip(["NDVI","GCVI"],together):
+			alone = octvi.extract.cmgDayArrays(self.stacks[0],index,"VNP09CMG")
+			for a, b in zip(arrays,alone):
+				self.assertTrue(np.array_equal(a,b))
+
+class TestCmgCompositeStripes(TestCase):
+	def setUp(self):
+		self.stack = downloadExampleFile()
+	def tearDown(self):
+		os.remove(self.stack)
+
+	def test_matchesSerial(self):
+		serial = octvi.extract.cmgBestViPixels([self.stack])
+		parallel = octvi.extract.cmgCompositeStripes([self.stack],jobs=3)
+		self.assertEqual(parallel.dtype,serial.dtype)
+		self.assertTrue(np.array_equal(parallel,serial))
@@ -0,0 +1,48 @@
+from unittest import TestCase
+import numpy as np
+import octvi
+
+class TestExpression(TestCase):
+	def test_matchesNumpy(self):
+		rng = np.random.default_rng(0)
+		bands = {band:rng.integers(1,10000,(300,400)).astype(np.int16) for band in ("red","nir","blue")}
+		red, nir, blue = [bands[band].astype(np.float64) for band in ("red","nir","blue")]
+		expected = 2.5 * (nir - red) / (nir + 6 * red - 7.5 * blue + 10000) * 10000
+		evi = octvi.indices.get("EVI").evaluate(bands,dtype=np.float32)
+		self.assertTrue(np.allclose(evi,expected,rtol=1e-5,atol=0.5))
+
+	def test_chunksMatchWhole(self):
+		rng = np.random.default_rng(1)
+		bands = {"red":rng.integers(-100,10000,(70,1000)).astype(np.int16),"nir":rng.integers(-100,10000,(70,1000)).astype(np.int16)}
+		expression = octvi.indices.Expression("(nir - red) / (nir + red)")
+		whole = expression.evaluate(bands)
+		octvi.indices.CHUNK_PIXELS, chunkPixels = 1000, octvi.indices.CHUNK_PIXELS
+		try:
+			self.assertTrue(np.array_equal(expression.evaluate(bands),whole))
+		finally:
+			octvi.indices.CHUNK_PIXELS = chunkPixels
+
+	def test_zeroDivisorIsNodata(self):
+		expression = octvi.indices.Expression("nir / (nir - red) - -1")
+		result = expression.evaluate({"red":np.array([5,2]),"nir":np.array([5,4])})
+		self.assertEqual(result.tolist(),[-3000,30000])
+
+	def test_invalidExpressions(self):
+		for text in ("nir ** 2","nir / 0","nir + swir1","abs(nir)","nir +"):
+			with self.assertRaises(ValueError):
+				octvi.indices.Expression(text)
+
+class TestRegister(TestCase):
+	def tearDown(self):
+		octvi.indices._registry.pop("TEST",None)
+		if "TEST" in octvi.indices.supported_indices:
+			octvi.indices.supported_indices.remove("TEST")
+
+	def test_registeredIndexSupported(self):
+		octvi.indices.register("TEST","nir - red",scale=1)
+		self.assertIn("TEST",octvi.supported_indices)
+		self.assertEqual(octvi.indices.get("TEST").bands,["nir","red"])
+
+	def test_unknownIndex(self):
+		with self.assertRaises(octvi.exceptions.UnsupportedError):
+			octvi.indices.get("TEST")
@@ -0,0 +1,41 @@
+from unittest import TestCase
+import octvi, octvi.localdaac, os, shutil, tempfile
+
+class TestLocalDaac(TestCase):
+	def setUp(self):
+		self.tempDir = tempfile.mkdtemp()
+		self.daac = octvi.localdaac.LocalDaac(seed=0)
+		self.names = [self.daac.addGranule("MOD09Q1","2019-01-01",tile,size=4096) for tile in ("h00v08","h01v08")]
+		self.daac.__enter__()
+	def tearDown(self):
+		self.daac.__exit__(None,None,None)
+		shutil.rmtree(self.tempDir)
+
+	def test_getUrls(self):
+		urls = octvi.url.getUrls("MOD09Q1","2019-01-01")
+		self.assertEqual(sorted(u[1] for u in urls),["h00v08","h01v08"])
+		self.assertTrue(all(u[0].startswith(self.daac.url) for u in urls))
+
+	def test_pullLadsAndLp(self):
+		for daac in ("LADS","LP"):
+			os.mkdir(os.path.join(self.tempDir,daac))
+			url, tile, size = octvi.url.getUrls("MOD09Q1","2019-01-01",tiles="h00v08",lads_or_lp=daac)[0]
+			out = octvi.url.pull(url,os.path.join(self.tempDir,daac),file_size=size)
+			with open(out,'rb') as rf:
+				self.assertEqual(rf.read(),self.daac.granuleBytes(self.names[0],4096))
+
+	def test_pullRetriesInjectedErrors(self):
+		url, tile, size = octvi.url.getUrls("MOD09Q1","2019-01-01",tiles="h00v08")[0]
+		self.daac.error_rate = 0.5
+		policy = octvi.url.RetryPolicy(max_attempts=20,backoff=0.0,jitter=0.0)
+		out = octvi.url.pull(url,self.tempDir,file_size=size,policy=policy)
+		self.assertEqual(os.path.getsize(out),4096)
+
+	def test_getDates(self):
+		self.assertEqual(octvi.url.getDates("MOD09Q1","2019-01"),["2019-01-01"])
+		self.assertEqual(octvi.url.getDates("MOD09Q1","2019-01-02"),[])
+
+	def test_nrtListing(self):
+		self.daac.addGranule("MOD09Q1N","2019-01-08","h00v08")
+		self.assertEqual(octvi.url.getDates("MOD09Q1N","2019-01-08"),["2019-01-08"])
+		self.assertEqual(len(octvi.url.getUrls("MOD09Q1N","2019-01-08")),1)
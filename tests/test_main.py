@@ -1,7 +1,11 @@
 from unittest import TestCase
 
-import octvi
-import os
+import octvi, octvi.localdaac
+import numpy as np
+import os, shutil, tempfile
+from contextlib import closing
+from datetime import datetime
+from tests import fastRetries as setUpModule, restoreRetries as tearDownModule
 
 class TestMosaic(TestCase):
 
@@ -20,6 +24,84 @@ class TestMosaic(TestCase):
 			for f in ndvis:
 				os.remove(f)
 			os.remove(mosaicPath)
+class TestIterPulls(TestCase):
+
+	def test_allTilesYielded(self):
+		tiles = [(f"url{i}",f"h{i:02d}v08",0) for i in range(10)]
+		with closing(octvi._iterPulls(tiles,lambda t: t[1],jobs=4)) as pulls:
+			results = dict(pulls)
+		self.assertEqual(len(results),10)
+		for tile in tiles:
+			self.assertEqual(results[tile],tile[1])
+
+	def test_errorPropagates(self):
+		def fetch(tile):
+			if tile == 3:
+				raise octvi.exceptions.UnavailableError("failed")
+			return tile
+		customError = False
+		try:
+			with closing(octvi._iterPulls(range(6),fetch,jobs=2)) as pulls:
+				for tile, path in pulls:
+					pass
+		except octvi.exceptions.UnavailableError:
+			customError = True
+		self.assertTrue(customError)
+
+class TestHedgedPull(TestCase):
+	def setUp(self):
+		self.tempDir = tempfile.mkdtemp()
+		self.daac = octvi.localdaac.LocalDaac(bandwidth=20000)
+		self.name = self.daac.addGranule("MOD09Q1","2019-01-01","h00v08",size=30000)
+		self.daac.__enter__()
+	def tearDown(self):
+		self.daac.__exit__(None,None,None)
+		shutil.rmtree(self.tempDir)
+
+	def test_failedHedgeKeepsPrimary(self):
+		tile = octvi.url.getUrls("MOD09Q1","2019-01-01",tiles="h00v08")[0]
+		# the other DAAC has nothing listed for the tile once the slow transfer starts
+		octvi.url.setBaseUrls(lads=f"{self.daac.url}/missing")
+		octvi.cache.listing_cache.clear()
+		hedge = octvi.url.HedgePolicy(min_throughput=10**9,grace=0.1,interval=0.1)
+		out = octvi._hedgedPull("MOD09Q1","2019-01-01",tile,self.tempDir,"LADS",hedge)
+		with open(out,'rb') as rf:
+			self.assertEqual(rf.read(),self.daac.granuleBytes(self.name,30000))
+
+class TestRollingCmgVi(TestCase):
+	def setUp(self):
+		self.tempDir = tempfile.mkdtemp()
+		self.store = octvi.cache.DayStore(os.path.join(self.tempDir,"days"),max_bytes=10**8)
+		self.daac = octvi.localdaac.LocalDaac()
+		self.names = [self.daac.addGranule("VNP09CMG",f"2019-01-0{d}",size=4096) for d in range(1,9)]
+		arrays = (np.full((4,4),10,dtype=np.uint8),np.full((4,4),100,dtype=np.int16),np.full((4,4),5000,dtype=np.int16),np.zeros((4,4),dtype=np.uint8))
+		for d in range(1,8):
+			self.store.put("VNP09CMG",f"2019-01-0{d}","NDVI",arrays,((-180.0,0.05,0.0,90.0,0.0,-0.05),""))
+		self.daac.__enter__()
+	def tearDown(self):
+		self.daac.__exit__(None,None,None)
+		shutil.rmtree(self.tempDir)
+
+	def test_onlyNewDayFetched(self):
+		# the served granule is not a valid .h5 file, so reading it fails
+		try:
+			octvi.rollingCmgVi("2019-01-08",os.path.join(self.tempDir,"rolling.tif"),product="VNP09CMG",store=self.store)
+		except OSError:
+			pass
+		fetched = [r.split("/")[-1] for r in self.daac.requests if not r.endswith(".csv")]
+		self.assertEqual(fetched,[self.names[-1]])
+		self.assertFalse(os.path.exists(os.path.join(self.tempDir,self.names[-1])))
+
+	def test_parallelWithStore(self):
+		customError = False
+		try:
+			dates = [datetime(2019,1,d) for d in range(1,9)]
+			octvi._cmgComposite("VNP09CMG",dates,os.path.join(self.tempDir,"parallel.tif"),"NDVI",True,jobs=2,store=self.store)
+		except octvi.exceptions.UnsupportedError:
+			customError = True
+		self.assertTrue(customError)
+		self.assertEqual(self.daac.requests,[])
+
 """
 class TestCmgNdvi(TestCase):
 	
@@ -40,4 +122,15 @@ class TestGlobalNdvi(TestCase):
 			os.remove(os.path.join(os.path.dirname(__file__),"unsupported.tif"))
 		except octvi.exceptions.UnsupportedError:
 			customError = True
-		self.assertTrue(customError)
\ No newline at end of file
+		self.assertTrue(customError)
+
+class TestViPaths(TestCase):
+
+	def test_singleIndexUnchanged(self):
+		self.assertEqual(octvi._viPaths("out.tif",["NDVI"]),["out.tif"])
+
+	def test_nameAdded(self):
+		self.assertEqual(octvi._viPaths("out.tif",["NDVI","GCVI"]),["out.ndvi.tif","out.gcvi.tif"])
+
+	def test_template(self):
+		self.assertEqual(octvi._viPaths("MOD09A1.{vi}.tif",["NDWI"]),["MOD09A1.ndwi.tif"])
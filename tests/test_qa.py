@@ -0,0 +1,48 @@
+from unittest import TestCase
+import numpy as np
+import octvi
+
+class Window:
+	"""Minimal stand-in for a GranuleWindow over in-memory bands"""
+	def __init__(self,bands):
+		self.bands = bands
+	def read(self,name):
+		return self.bands[name]
+
+class TestCompileRules(TestCase):
+	def test_standardMask(self):
+		# clear land, average aerosol
+		clear = 0b00000000_01_001_000
+		table = octvi.qa.compileRules(octvi.qa.STANDARD_RULES,1)
+		words = np.array([[clear,clear | 0b1,clear | 0b100,clear & ~0b1000]],dtype=np.uint16)
+		self.assertEqual(octvi.qa.lookup(table,words).tolist(),[[1,0,0,0]])
+
+	def test_lowestVerdictWins(self):
+		rules = [octvi.qa.Rule(0b1,"in",(1,),5),octvi.qa.Rule(0b10,"not in",(0,),3)]
+		table = octvi.qa.compileRules(rules,10)
+		self.assertEqual(table[:4].tolist(),[10,5,3,3])
+
+	def test_wideWordsTruncated(self):
+		table = octvi.qa.MOD_CMG_RANK.tables()["Coarse Resolution QA"]
+		words = np.array([3,3 | (1 << 20)],dtype=np.uint32)
+		self.assertEqual(octvi.qa.lookup(table,words).tolist(),[6,6])
+
+class TestQaSpec(TestCase):
+	def test_cmgRank(self):
+		# land pixel flagged as both cloud shadow (5) and internal cloud (4)
+		state = np.array([0b10000000000 | 0b100 | 0b01001000]*3,dtype=np.uint16)
+		stack = Window({
+			"Coarse Resolution State QA":state,
+			"Coarse Resolution QA":np.zeros(3,dtype=np.uint32),
+			"Coarse Resolution View Zenith Angle":np.array([100,0,100],dtype=np.int16),
+			"Coarse Resolution Solar Zenith Angle":np.array([100,100,9000],dtype=np.int16)
+		})
+		self.assertEqual(octvi.qa.MOD_CMG_RANK.evaluate(stack).tolist(),[4,2,3])
+
+	def test_cmgWater(self):
+		state = np.array([0,0b1,0b1000,0b111000],dtype=np.uint16)
+		self.assertEqual(octvi.qa.MOD_CMG_WATER.evaluate(Window({"Coarse Resolution State QA":state})).tolist(),[0,1,0,1])
+		self.assertEqual(octvi.qa.VNP_CMG_WATER.evaluate(Window({"State_QA":state})).tolist(),[0,0,0,1])
+
+	def test_datasets(self):
+		self.assertEqual(octvi.qa.VNP_CMG_RANK.datasets(),["SurfReflect_QF2","SurfReflect_QF4","State_QA","SensorZenith","SolarZenith"])
@@ -1,6 +1,9 @@
 from unittest import TestCase
 import numpy as np
-import octvi, os
+import octvi, octvi.localdaac, os, time
+from datetime import datetime, timedelta
+from urllib.request import HTTPError
+from tests import fastRetries as setUpModule, restoreRetries as tearDownModule
 
 class TestPull(TestCase):
 	
@@ -22,6 +25,97 @@ class TestPull(TestCase):
 			except:
 				pass
 
+class TestTokenBucket(TestCase):
+
+	def test_burstWithinCapacity(self):
+		bucket = octvi.url.TokenBucket(rate=10,capacity=5)
+		start = time.monotonic()
+		for i in range(5):
+			bucket.take()
+		self.assertTrue(time.monotonic() - start < 0.1)
+
+	def test_rateEnforced(self):
+		bucket = octvi.url.TokenBucket(rate=20,capacity=1)
+		start = time.monotonic()
+		for i in range(5):
+			bucket.take()
+		self.assertTrue(time.monotonic() - start >= 0.15)
+
+class TestRetryPolicy(TestCase):
+
+	def httpError(self,code,headers=None):
+		return HTTPError("https://example.com",code,"",headers or {},None)
+
+	def test_classification(self):
+		policy = octvi.url.RetryPolicy()
+		self.assertTrue(policy.isRetryable(self.httpError(503)))
+		self.assertTrue(policy.isRetryable(self.httpError(429)))
+		self.assertTrue(policy.isRetryable(ConnectionResetError()))
+		self.assertFalse(policy.isRetryable(self.httpError(404)))
+		self.assertFalse(policy.isRetryable(self.httpError(401)))
+
+	def test_retryAfterRespected(self):
+		policy = octvi.url.RetryPolicy(backoff=0.1,jitter=0)
+		self.assertEqual(policy.delay(1),0.1)
+		self.assertEqual(policy.delay(1,self.httpError(429,{"Retry-After":"7"})),7)
+
+	def test_fatalNotRetried(self):
+		calls = []
+		def fail():
+			calls.append(1)
+			raise self.httpError(404)
+		customError = False
+		try:
+			octvi.url.RetryPolicy(backoff=0).call(fail)
+		except octvi.exceptions.NotFoundError:
+			customError = True
+		self.assertTrue(customError)
+		self.assertEqual(len(calls),1)
+
+	def test_transientExhausted(self):
+		calls = []
+		def fail():
+			calls.append(1)
+			raise TimeoutError()
+		customError = False
+		try:
+			octvi.url.RetryPolicy(max_attempts=3,backoff=0).call(fail)
+		except octvi.exceptions.TransientError:
+			customError = True
+		self.assertTrue(customError)
+		self.assertEqual(len(calls),3)
+
+class TestHedgePolicy(TestCase):
+
+	def test_noHedgeWithoutSamples(self):
+		hedge = octvi.url.HedgePolicy(min_samples=3)
+		hedge.record(1.0)
+		self.assertIsNone(hedge.latencyThreshold())
+		self.assertFalse(hedge.shouldHedge(100.0,0))
+
+	def test_latencyPercentile(self):
+		hedge = octvi.url.HedgePolicy(percentile=90,min_samples=3)
+		for seconds in range(1,11):
+			hedge.record(float(seconds))
+		self.assertFalse(hedge.shouldHedge(5.0,0))
+		self.assertTrue(hedge.shouldHedge(11.0,0))
+
+	def test_lowThroughput(self):
+		hedge = octvi.url.HedgePolicy(min_throughput=1000,grace=5)
+		self.assertFalse(hedge.shouldHedge(2.0,0))
+		self.assertTrue(hedge.shouldHedge(10.0,5000))
+		self.assertFalse(hedge.shouldHedge(10.0,50000))
+
+class TestFileName(TestCase):
+
+	def test_ladsUrl(self):
+		name = octvi.url.fileName('https://ladsweb.modaps.eosdis.nasa.gov/archive/allData/6/MOD09CMG/2019/001/MOD09CMG.A2019001.006.2019003023418.hdf')
+		self.assertEqual(name,"MOD09CMG.2019-01-01.006.hdf")
+
+	def test_lpUrl(self):
+		name = octvi.url.fileName('https://e4ftl01.cr.usgs.gov/MOLT/MOD09Q1.006/2019.01.01/MOD09Q1.A2019001.h00v08.006.2019010204213.hdf')
+		self.assertEqual(name,"MOD09Q1.2019-01-01.h00v08.hdf")
+
 class TestGetUrls(TestCase):
 	
 	def test_allMod09Tiles(self):
@@ -48,6 +142,61 @@ class TestGetUrls(TestCase):
 		self.assertTrue(len(u) == 1)
 		self.assertIsInstance(u[0],tuple)
 
+class TestGetUrlsErrors(TestCase):
+	def setUp(self):
+		self.daac = octvi.localdaac.LocalDaac()
+		self.daac.addGranule("MOD09Q1","2019-01-01","h00v08")
+		self.daac.__enter__()
+	def tearDown(self):
+		self.daac.__exit__(None,None,None)
+
+	def test_missingDate(self):
+		customError = False
+		try:
+			octvi.url.getUrls("MOD09Q1","2019-01-09")
+		except octvi.exceptions.NotFoundError:
+			customError = True
+		self.assertTrue(customError)
+
+	def test_refused(self):
+		self.daac.error_rate = 1.0
+		self.daac.error_codes = (401,)
+		customError = False
+		try:
+			octvi.url.getUrls("MOD09Q1","2019-01-01")
+		except octvi.exceptions.AuthorizationError:
+			customError = True
+		self.assertTrue(customError)
+
+class TestGetDatesErrors(TestCase):
+	def setUp(self):
+		self.daac = octvi.localdaac.LocalDaac()
+		self.daac.addGranule("MOD09Q1","2019-01-01","h00v08")
+		self.daac.__enter__()
+	def tearDown(self):
+		self.daac.__exit__(None,None,None)
+
+	def test_missingYear(self):
+		self.assertEqual(octvi.url.getDates("MOD09Q1","2018-01"),[])
+
+	def test_throttledYearListing(self):
+		self.daac.error_rate = 1.0
+		self.daac.error_codes = (503,)
+		customError = False
+		try:
+			octvi.url.getDates("MOD09Q1","2019-01")
+		except octvi.exceptions.TransientError:
+			customError = True
+		self.assertTrue(customError)
+
+class TestListingTtl(TestCase):
+
+	def test_nrtIsShortest(self):
+		self.assertEqual(octvi.url.listingTtl("MOD09Q1N","2019"),octvi.url.LISTING_TTL_NRT)
+
+	def test_pastYearIsArchive(self):
+		self.assertEqual(octvi.url.listingTtl("MOD09Q1","2019"),octvi.url.LISTING_TTL_ARCHIVE)
+
 class TestGetDates(TestCase):
 
 	def test_yearOnly(self):
@@ -81,4 +230,51 @@ class TestGetDates(TestCase):
 			customError = True
 		except:
 			pass
-		self.assertTrue(customError)
\ No newline at end of file
+		self.assertTrue(customError)
+
+class TestGetLatestDate(TestCase):
+	def setUp(self):
+		self.daac = octvi.localdaac.LocalDaac()
+		self.daac.__enter__()
+	def tearDown(self):
+		self.daac.__exit__(None,None,None)
+
+	def daysAgo(self,days):
+		return (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+
+	def test_archiveProduct(self):
+		for days in (10,3,17):
+			self.daac.addGranule("MOD09CMG",self.daysAgo(days))
+		self.assertEqual(octvi.url.getLatestDate("MOD09CMG"),self.daysAgo(3))
+
+	def test_previousYear(self):
+		lastYear = datetime.now().year - 1
+		self.daac.addGranule("MOD09CMG",f"{lastYear}-06-01")
+		self.daac.addGranule("MOD09CMG",f"{lastYear}-12-31")
+		self.assertEqual(octvi.url.getLatestDate("MOD09CMG"),f"{lastYear}-12-31")
+
+	def test_nrtProduct(self):
+		for days in (2,5):
+			self.daac.addGranule("MOD09Q1N",self.daysAgo(days),"h00v08")
+		self.assertEqual(octvi.url.getLatestDate("MOD09Q1N",jobs=2),self.daysAgo(2))
+
+	def test_noData(self):
+		self.assertIsNone(octvi.url.getLatestDate("MOD09CMG"))
+
+	def test_throttledListing(self):
+		self.daac.addGranule("MOD09CMG",f"{datetime.now().year - 1}-12-31")
+		self.daac.error_rate = 1.0
+		customError = False
+		try:
+			octvi.url.getLatestDate("MOD09CMG")
+		except octvi.exceptions.TransientError:
+			customError = True
+		self.assertTrue(customError)
+
+	def test_unsupportedProduct(self):
+		customError = False
+		try:
+			octvi.url.getLatestDate("MOD66F8")
+		except octvi.exceptions.UnsupportedError:
+			customError = True
+		self.assertTrue(customError)